@@ -0,0 +1,96 @@
+"""对比预览时SDK模型列表、原始list端点和/system/df快照的Docker API往返次数
+
+用法: python benchmarks/bench_preview_listing.py [--containers 200] [--images 100] [--volumes 50]
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from isolation import isolate_paths
+
+# prunemate.py读取的所有路径都指向临时目录，不写入真实的/config
+isolate_paths(tempfile.mkdtemp(prefix="prunemate-bench-"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import logging  # noqa: E402
+
+import docker  # noqa: E402
+
+import prunemate  # noqa: E402
+from fake_docker import FakeDockerDaemon, build_inventory  # noqa: E402
+
+ALL_OPTIONS = {
+    "prune_containers": True,
+    "prune_images": True,
+    "prune_networks": True,
+    "prune_volumes": True,
+    "prune_build_cache": False,
+}
+
+
+def legacy_preview(client):
+    """重现旧版预览的调用方式：SDK模型对象，每个类别各自列出容器"""
+    [c.status for c in client.containers.list(all=True)]
+    client.images.list()
+    client.containers.list(all=True)
+    client.networks.list()
+    client.containers.list(filters={"status": "running"})
+    client.volumes.list()
+    client.containers.list(all=True)
+
+
+def list_preview(url):
+    """每类资源一次list请求"""
+    use_df = prunemate._use_df_preview
+    prunemate._use_df_preview = lambda options: False
+    try:
+        prunemate._preview_host({"name": "bench", "url": url}, ALL_OPTIONS, {})
+    finally:
+        prunemate._use_df_preview = use_df
+
+
+def df_preview(url):
+    """当前实现：选择多个类别时从一次/system/df生成（网络另需一次list）"""
+    prunemate._preview_host({"name": "bench", "url": url}, ALL_OPTIONS, {})
+
+
+def measure(daemon, fn):
+    daemon.reset()
+    start = time.perf_counter()
+    fn()
+    return daemon.total_calls, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--containers", type=int, default=200)
+    parser.add_argument("--images", type=int, default=100)
+    parser.add_argument("--volumes", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.001, help="每个请求的模拟延迟（秒）")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    daemon = FakeDockerDaemon(build_inventory(args.containers, args.images, args.volumes), latency=args.latency).start()
+    try:
+        client = docker.DockerClient(base_url=daemon.url, version=None)
+        legacy_calls, legacy_time = measure(daemon, lambda: legacy_preview(client))
+        client.close()
+        # 先建立连接池中的客户端，避免把API版本协商计入任何一种实现
+        prunemate.get_docker_client(daemon.url)
+        list_calls, list_time = measure(daemon, lambda: list_preview(daemon.url))
+        df_calls, df_time = measure(daemon, lambda: df_preview(daemon.url))
+    finally:
+        daemon.stop()
+
+    print(f"主机规模: {args.containers} 个容器, {args.images} 个镜像, {args.volumes} 个卷, 延迟 {args.latency * 1000:.1f}ms")
+    print(f"{'实现':<10}{'API往返':>10}{'耗时(s)':>12}")
+    print(f"{'SDK模型':<10}{legacy_calls:>10}{legacy_time:>12.3f}")
+    print(f"{'原始列表':<10}{list_calls:>10}{list_time:>12.3f}")
+    print(f"{'df快照':<10}{df_calls:>10}{df_time:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""预览和清理的基准测试：模拟N个Docker主机，报告耗时、API往返、峰值内存和响应大小
+
+本地主机使用unix套接字上的模拟守护进程，外部主机使用本地TCP端口（PruneMate
+只通过TCP连接外部主机）。每个场景在独立的子进程中运行，峰值RSS互不影响，
+并且每次运行都从空的缓存开始。
+
+用法:
+    python benchmarks/bench_suite.py [--hosts 4] [--containers 200] [--images 100] [--volumes 50]
+                                     [--latency 0.001] [--error-rate 0] [--down-hosts 0] [--repeat 3]
+                                     [--save benchmarks/baselines/default.json]
+                                     [--baseline benchmarks/baselines/default.json]
+
+场景:
+    preview         冷启动的完整预览（POST /preview-prune）
+    preview_warm    同一进程中第二次预览（预览缓存已清除，镜像层缓存和连接池已预热）
+    preview_totals  只返回数量的预览（POST /preview-prune?totals=1）
+    preview_stream  NDJSON流式预览（POST /preview-prune/stream）
+    prune           完整清理（run_prune_job），每次运行前恢复模拟资源清单
+"""
+
+import argparse
+import datetime
+import http.client
+import json
+import os
+import platform
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from isolation import isolate_paths
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+LOCAL_URL = "unix:///var/run/docker.sock"
+SCENARIOS = ("preview", "preview_warm", "preview_totals", "preview_stream", "prune")
+PRUNE_OPTIONS = {
+    "prune_containers": True,
+    "prune_images": True,
+    "prune_networks": True,
+    "prune_volumes": True,
+    "prune_build_cache": True,
+}
+# 比较基线时显示的指标：(字段, 标题, 格式)
+METRICS = (
+    ("wall_s", "耗时(s)", "{:.3f}"),
+    ("round_trips", "API往返", "{:d}"),
+    ("docker_bytes", "Docker数据(KB)", "{:.1f}"),
+    ("response_bytes", "响应(KB)", "{:.1f}"),
+    ("peak_rss_mb", "峰值RSS(MB)", "{:.1f}"),
+)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str):
+        super().__init__("localhost")
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self._path)
+
+
+def _bench_request(url: str, method: str, path: str) -> dict:
+    """调用模拟守护进程的 /_bench/* 端点"""
+    if url.startswith("unix://"):
+        conn = _UnixHTTPConnection(url[len("unix://"):])
+    else:
+        host, port = url[len("tcp://"):].rsplit(":", 1)
+        conn = http.client.HTTPConnection(host, int(port), timeout=10)
+    try:
+        conn.request(method, path)
+        return json.loads(conn.getresponse().read() or b"{}")
+    finally:
+        conn.close()
+
+
+def _daemon_stats(urls: list) -> tuple:
+    """返回所有模拟守护进程的 (调用次数, 发送字节数)"""
+    calls = sent = 0
+    for url in urls:
+        stats = _bench_request(url, "GET", "/_bench/stats")
+        calls += stats["calls"]
+        sent += stats["bytes"]
+    return calls, sent
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux以KB为单位，macOS以字节为单位
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_worker(scenario: str, local_url: str, daemon_urls: list) -> dict:
+    """子进程：导入PruneMate并运行一个场景"""
+    sys.path.insert(0, str(ROOT))
+    import logging
+
+    import prunemate
+
+    logging.getLogger().setLevel(logging.WARNING)
+    # 把本地主机重定向到unix套接字上的模拟守护进程，基准测试绝不会连接真实的Docker
+    create_docker_client = prunemate.create_docker_client
+    prunemate.create_docker_client = lambda url: create_docker_client(local_url if url == LOCAL_URL else url)
+
+    client = prunemate.app.test_client()
+    response_bytes = None
+
+    def preview(path):
+        return client.post(path, json=PRUNE_OPTIONS)
+
+    if scenario == "preview_warm":
+        preview("/preview-prune")
+        for host in prunemate._preview_hosts():
+            prunemate.invalidate_preview_cache(host["url"])
+
+    for url in daemon_urls:
+        _bench_request(url, "POST" if scenario == "prune" else "GET", "/_bench/reset")
+    start = time.perf_counter()
+    if scenario in ("preview", "preview_warm"):
+        response_bytes = len(preview("/preview-prune").data)
+    elif scenario == "preview_totals":
+        response_bytes = len(preview("/preview-prune?totals=1").data)
+    elif scenario == "preview_stream":
+        response_bytes = len(preview("/preview-prune/stream").data)
+    elif scenario == "prune":
+        prunemate.run_prune_job(origin="benchmark", wait=True)
+    wall = time.perf_counter() - start
+    calls, sent = _daemon_stats(daemon_urls)
+    return {
+        "wall_s": wall,
+        "round_trips": calls,
+        "docker_bytes": sent / 1024,
+        "response_bytes": response_bytes / 1024 if response_bytes is not None else None,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _closed_port_url() -> str:
+    """返回一个没有服务监听的本地TCP地址，用于模拟不可达的主机"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    return f"tcp://127.0.0.1:{port}"
+
+
+def _spawn_worker(scenario: str, workdir: str, local_url: str, daemon_urls: list) -> dict:
+    # prunemate.py读取的所有路径都指向临时目录，不写入真实的/config
+    env = isolate_paths(workdir, dict(os.environ))
+    for file in ("stats.json", "history.db", "history.db-wal", "history.db-shm", "last_run_key",
+                 "notification_digest.json"):
+        Path(workdir, file).unlink(missing_ok=True)
+    for directory in ("notifications", "runs"):
+        for path in Path(workdir, directory).glob("*"):
+            path.unlink()
+    proc = subprocess.run(
+        [sys.executable, __file__, "--worker", scenario, "--local-url", local_url, "--daemon-urls", ",".join(daemon_urls)],
+        env=env, capture_output=True, text=True, check=False,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"场景 {scenario} 失败:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _summarize(runs: list) -> dict:
+    """多次运行取耗时中位数，其余指标取最大值"""
+    summary = {"wall_s": statistics.median(r["wall_s"] for r in runs), "runs": len(runs)}
+    for key in ("round_trips", "docker_bytes", "response_bytes", "peak_rss_mb"):
+        values = [r[key] for r in runs if r[key] is not None]
+        summary[key] = max(values) if values else None
+    return summary
+
+
+def _print_results(results: dict, baseline: dict | None) -> None:
+    header = f"{'场景':<16}" + "".join(f"{title:>16}" for _, title, _ in METRICS)
+    print(header)
+    for scenario, summary in results.items():
+        cells = []
+        for key, _, fmt in METRICS:
+            value = summary.get(key)
+            cell = "-" if value is None else fmt.format(value)
+            old = ((baseline or {}).get("results", {}).get(scenario) or {}).get(key)
+            if value is not None and old:
+                cell += f" ({(value - old) / old * 100:+.0f}%)"
+            cells.append(f"{cell:>16}")
+        print(f"{scenario:<16}" + "".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hosts", type=int, default=4, help="模拟主机数量（包括本地主机）")
+    parser.add_argument("--containers", type=int, default=200)
+    parser.add_argument("--images", type=int, default=100)
+    parser.add_argument("--volumes", type=int, default=50)
+    parser.add_argument("--shared-base", type=int, default=20_000_000, help="所有镜像共享的基础层大小（字节）")
+    parser.add_argument("--latency", type=float, default=0.001, help="每个请求的模拟延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="请求随机返回500的概率")
+    parser.add_argument("--down-hosts", type=int, default=0, help="额外配置的不可达主机数量")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--save", help="把结果保存为JSON，供之后比较")
+    parser.add_argument("--baseline", help="与之前保存的结果比较")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--local-url", help=argparse.SUPPRESS)
+    parser.add_argument("--daemon-urls", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.local_url, args.daemon_urls.split(","))))
+        return
+
+    sys.path.insert(0, str(BENCH_DIR))
+    from fake_docker import FakeDockerDaemon, build_inventory
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知场景: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix="prunemate-bench-")
+    daemons = []
+    try:
+        for i in range(max(1, args.hosts)):
+            inventory = build_inventory(args.containers, args.images, args.volumes, shared_base=args.shared_base)
+            unix_path = os.path.join(workdir, "docker.sock") if i == 0 else None
+            daemons.append(FakeDockerDaemon(inventory, latency=args.latency, error_rate=args.error_rate,
+                                            unix_path=unix_path, seed=i).start())
+        external = [{"name": f"host{i}", "url": d.url, "enabled": True} for i, d in enumerate(daemons[1:], 1)]
+        external += [{"name": f"down{i}", "url": _closed_port_url(), "enabled": True} for i in range(args.down_hosts)]
+        config = {"schedule_enabled": False, "docker_hosts": external, **PRUNE_OPTIONS}
+        Path(workdir, "config.json").write_text(json.dumps(config), encoding="utf-8")
+
+        daemon_urls = [d.url for d in daemons]
+        results = {}
+        for scenario in scenarios:
+            runs = [_spawn_worker(scenario, workdir, daemons[0].url, daemon_urls) for _ in range(args.repeat)]
+            results[scenario] = _summarize(runs)
+    finally:
+        for d in daemons:
+            d.stop()
+
+    baseline = None
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+    print(
+        f"{args.hosts} 个主机（另有 {args.down_hosts} 个不可达）, 每个 {args.containers} 个容器, "
+        f"{args.images} 个镜像, {args.volumes} 个卷, 延迟 {args.latency * 1000:.1f}ms, 失败率 {args.error_rate:.0%}"
+    )
+    if baseline:
+        print(f"对比基线: {args.baseline}（{baseline['meta'].get('created')}）")
+    _print_results(results, baseline)
+
+    if args.save:
+        meta = {k: v for k, v in vars(args).items() if k not in ("worker", "local_url", "daemon_urls", "save", "baseline")}
+        meta.update({
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        })
+        Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.save).write_text(json.dumps({"meta": meta, "results": results}, indent=2, ensure_ascii=False) + "\n",
+                                   encoding="utf-8")
+        print(f"结果已保存到 {args.save}")
+
+
+if __name__ == "__main__":
+    main()
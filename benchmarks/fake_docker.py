@@ -0,0 +1,346 @@
+"""用于基准测试的最小化Docker Engine API模拟服务
+
+只实现PruneMate预览、清理和实时资源索引会用到的端点，并统计每个请求路径的调用次数和
+发送的字节数。可以监听本地TCP端口或unix套接字，支持模拟延迟和随机失败；
+清理端点会真正从模拟清单中删除资源并像Docker一样发送destroy/untag/delete事件，
+reset()恢复初始清单。/events是一个长连接，逐行发送emit()和清理产生的事件，直到stop()。
+
+基准测试进程可以通过 GET /_bench/stats 读取计数、POST /_bench/reset 清零计数，
+这两个端点本身不计入统计。
+"""
+
+import copy
+import json
+import os
+import queue
+import random
+import re
+import socketserver
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+API_VERSION = "1.43"
+_VERSION_PREFIX = re.compile(r"^/v[0-9.]+")
+# 所有镜像共享的基础层
+BASE_LAYER = "sha256:" + "b" * 64
+
+
+def build_inventory(containers: int, images: int, volumes: int, networks: int = 3, shared_base: int = 0) -> dict:
+    """生成一个主机的模拟资源清单：一半容器运行中，另一半已退出
+
+    shared_base大于0时，所有镜像共享一个该大小的基础层（SharedSize和RootFS会相应填写）。
+    """
+    image_list = [
+        {
+            "Id": f"sha256:{i:064x}",
+            "ParentId": "",
+            "RepoTags": [f"app{i}:latest"] if i % 3 else ["<none>:<none>"],
+            "Size": 50_000_000 + i + shared_base,
+            "SharedSize": shared_base if shared_base and images > 1 else -1,
+            "Containers": -1,
+            "Created": 1_700_000_000 + i,
+        }
+        for i in range(images)
+    ]
+    network_list = [{"Id": f"{i:064x}", "Name": f"net{i}", "Driver": "bridge"} for i in range(networks)]
+    network_list.append({"Id": "f" * 64, "Name": "bridge", "Driver": "bridge"})
+    volume_list = [{"Name": f"vol{i}", "Driver": "local", "Mountpoint": f"/var/lib/docker/volumes/vol{i}"} for i in range(volumes)]
+
+    container_list = []
+    for i in range(containers):
+        running = i % 2 == 0
+        image = image_list[i % len(image_list)] if image_list and i < images // 2 else None
+        mounts = []
+        if volume_list and i < volumes // 2:
+            mounts.append({"Type": "volume", "Name": volume_list[i]["Name"], "Destination": "/data"})
+        nets = {}
+        if network_list and i < networks:
+            net = network_list[i]
+            nets[net["Name"]] = {"NetworkID": net["Id"]}
+        container_list.append({
+            "Id": f"{i + 1:064x}",
+            "Names": [f"/container{i}"],
+            "Image": image["RepoTags"][0] if image else "busybox",
+            "ImageID": image["Id"] if image else "sha256:" + "e" * 64,
+            "State": "running" if running else "exited",
+            "Status": "Up 2 hours" if running else "Exited (0) 2 hours ago",
+            "Mounts": mounts,
+            "NetworkSettings": {"Networks": nets},
+            "SizeRw": 1000 + i,
+        })
+    return {
+        "containers": container_list,
+        "images": image_list,
+        "networks": network_list,
+        "volumes": volume_list,
+        "shared_base": shared_base,
+    }
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """监听unix套接字的多线程HTTP服务"""
+
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler期望客户端地址是(host, port)元组
+        return request, ("unix", 0)
+
+
+class FakeDockerDaemon:
+    """在本地TCP端口或unix套接字上运行的模拟Docker守护进程
+
+    latency为每个请求的延迟（秒），error_rate为请求随机返回500的概率。
+    """
+
+    def __init__(self, inventory: dict, latency: float = 0.0, error_rate: float = 0.0,
+                 unix_path: str | None = None, seed: int = 0):
+        self.initial_inventory = copy.deepcopy(inventory)
+        self.inventory = inventory
+        self.latency = latency
+        self.error_rate = error_rate
+        self.unix_path = unix_path
+        self.calls = Counter()
+        self.bytes_sent = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        # 每个/events连接一个队列
+        self._subscribers = []
+        if unix_path:
+            if os.path.exists(unix_path):
+                os.unlink(unix_path)
+            self._server = _UnixHTTPServer(unix_path, self._make_handler())
+        else:
+            self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+            self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        if self.unix_path:
+            return f"unix://{self.unix_path}"
+        host, port = self._server.server_address
+        return f"tcp://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._server.shutdown()
+        self._server.server_close()
+        if self.unix_path and os.path.exists(self.unix_path):
+            os.unlink(self.unix_path)
+
+    def reset(self, inventory: bool = False):
+        """清零调用计数；inventory为True时同时恢复初始资源清单"""
+        with self._lock:
+            self.calls.clear()
+            self.bytes_sent = 0
+            if inventory:
+                self.inventory = copy.deepcopy(self.initial_inventory)
+
+    def emit(self, event: dict) -> None:
+        """向所有/events连接发送一条事件"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for events in subscribers:
+            events.put(event)
+
+    def pull_image(self, image: dict, ref: str) -> None:
+        """模拟拉取镜像：加入清单并发送pull和tag事件"""
+        with self._lock:
+            self.inventory["images"].append(image)
+        self.emit({"Type": "image", "Action": "pull", "Actor": {"ID": ref, "Attributes": {"name": ref}}})
+        self.emit({"Type": "image", "Action": "tag", "Actor": {"ID": image["Id"], "Attributes": {"name": ref}}})
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def _used_image_ids(self) -> set:
+        return {c["ImageID"] for c in self.inventory["containers"]}
+
+    def _prune(self, path: str) -> tuple:
+        """执行模拟清理，返回与Docker相同格式的结果和清理产生的事件"""
+        inv = self.inventory
+        if path == "/containers/prune":
+            removed = [c for c in inv["containers"] if c["State"] != "running"]
+            inv["containers"] = [c for c in inv["containers"] if c["State"] == "running"]
+            events = [{"Type": "container", "Action": "destroy", "Actor": {"ID": c["Id"], "Attributes": {}}}
+                      for c in removed]
+            return {"ContainersDeleted": [c["Id"] for c in removed],
+                    "SpaceReclaimed": sum(c.get("SizeRw", 0) for c in removed)}, events
+        if path == "/images/prune":
+            used = self._used_image_ids()
+            removed = [i for i in inv["images"] if i["Id"] not in used]
+            inv["images"] = [i for i in inv["images"] if i["Id"] in used]
+            shared_base = inv.get("shared_base", 0)
+            space = sum(i["Size"] - shared_base for i in removed)
+            if removed and shared_base and not inv["images"]:
+                space += shared_base
+            # 与Docker相同：每个引用一条untag事件，然后一条delete事件
+            events = []
+            for image in removed:
+                for ref in image["RepoTags"]:
+                    if ref != "<none>:<none>":
+                        events.append({"Type": "image", "Action": "untag",
+                                       "Actor": {"ID": image["Id"], "Attributes": {"name": ref}}})
+                events.append({"Type": "image", "Action": "delete",
+                               "Actor": {"ID": image["Id"], "Attributes": {"name": image["Id"]}}})
+            return {"ImagesDeleted": [{"Deleted": i["Id"]} for i in removed], "SpaceReclaimed": space}, events
+        if path == "/networks/prune":
+            used = {n["NetworkID"] for c in inv["containers"] if c["State"] == "running"
+                    for n in c["NetworkSettings"]["Networks"].values()}
+            removed = [n for n in inv["networks"] if n["Name"] != "bridge" and n["Id"] not in used]
+            inv["networks"] = [n for n in inv["networks"] if n not in removed]
+            events = [{"Type": "network", "Action": "destroy", "Actor": {"ID": n["Id"], "Attributes": {"name": n["Name"]}}}
+                      for n in removed]
+            return {"NetworksDeleted": [n["Name"] for n in removed]}, events
+        if path == "/volumes/prune":
+            used = {m["Name"] for c in inv["containers"] for m in c["Mounts"] if m["Type"] == "volume"}
+            removed = [v for v in inv["volumes"] if v["Name"] not in used]
+            inv["volumes"] = [v for v in inv["volumes"] if v["Name"] in used]
+            events = [{"Type": "volume", "Action": "destroy", "Actor": {"ID": v["Name"], "Attributes": {}}}
+                      for v in removed]
+            return {"VolumesDeleted": [v["Name"] for v in removed], "SpaceReclaimed": 1024 * len(removed)}, events
+        return {"CachesDeleted": [], "SpaceReclaimed": 0}, []
+
+    def route(self, method: str, path: str):
+        """返回 (状态码, 响应体)，路径已去掉API版本前缀"""
+        inv = self.inventory
+        if path == "/_ping":
+            return 200, "OK"
+        if path == "/version":
+            return 200, {"ApiVersion": API_VERSION, "MinAPIVersion": "1.24", "Version": "24.0.0"}
+        if path == "/containers/json":
+            return 200, inv["containers"]
+        if path == "/images/json":
+            return 200, inv["images"]
+        if path == "/networks":
+            return 200, inv["networks"]
+        if path == "/volumes":
+            return 200, {"Volumes": inv["volumes"], "Warnings": None}
+        if path == "/system/df":
+            return 200, {
+                "LayersSize": sum(i["Size"] for i in inv["images"]),
+                "Images": inv["images"],
+                "Containers": [c | {"SizeRw": 4096, "SizeRootFs": 4096} for c in inv["containers"]],
+                "Volumes": [v | {"UsageData": {"Size": 1024, "RefCount": 0}} for v in inv["volumes"]],
+                "BuildCache": [],
+            }
+        m = re.match(r"^/containers/([^/]+)/json$", path)
+        if m:
+            for c in inv["containers"]:
+                if c["Id"].startswith(m.group(1)):
+                    return 200, c | {
+                        "Image": c["ImageID"],
+                        "Name": c["Names"][0],
+                        "State": {"Status": c["State"]},
+                        "Config": {"Image": c["Image"], "Labels": {}},
+                    }
+            return 404, {"message": "No such container"}
+        m = re.match(r"^/images/([^/]+)/json$", path)
+        if m:
+            for i in inv["images"]:
+                if i["Id"] == m.group(1) or i["Id"].startswith("sha256:" + m.group(1)):
+                    layers = [BASE_LAYER] if inv.get("shared_base") else []
+                    return 200, i | {"RootFS": {"Type": "layers", "Layers": layers + ["sha256:" + i["Id"][-64:]]}}
+            return 404, {"message": "No such image"}
+        if method == "POST" and path in ("/containers/prune", "/images/prune", "/networks/prune",
+                                          "/volumes/prune", "/build/prune"):
+            result, events = self._prune(path)
+            # route()在self._lock内调用，事件在锁内直接放入各连接的队列
+            for event in events:
+                for subscriber in self._subscribers:
+                    subscriber.put(event)
+            return 200, result
+        return 404, {"message": f"page not found: {path}"}
+
+    def _make_handler(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # unix套接字不支持TCP_NODELAY
+            disable_nagle_algorithm = daemon.unix_path is None
+
+            def _send(self, status, body):
+                payload = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "text/plain" if isinstance(body, str) else "application/json")
+                self.send_header("Api-Version", API_VERSION)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return len(payload)
+
+            def _stream_events(self):
+                events = queue.Queue()
+                with daemon._lock:
+                    daemon.calls[f"{self.command} /events"] += 1
+                    daemon._subscribers.append(events)
+                try:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Api-Version", API_VERSION)
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    self.wfile.flush()
+                    while not daemon._stopped.is_set():
+                        try:
+                            event = events.get(timeout=0.1)
+                        except queue.Empty:
+                            continue
+                        line = json.dumps(event).encode() + b"\n"
+                        self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                        self.wfile.flush()
+                except OSError:
+                    pass
+                finally:
+                    with daemon._lock:
+                        daemon._subscribers.remove(events)
+                    self.close_connection = True
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                path = _VERSION_PREFIX.sub("", urlparse(self.path).path)
+                if path == "/_bench/stats":
+                    with daemon._lock:
+                        self._send(200, {"calls": daemon.total_calls, "bytes": daemon.bytes_sent})
+                    return
+                if path == "/_bench/reset":
+                    daemon.reset(inventory=self.command == "POST")
+                    self._send(200, {"ok": True})
+                    return
+                if path == "/events":
+                    self._stream_events()
+                    return
+                if daemon.latency:
+                    threading.Event().wait(daemon.latency)
+                with daemon._lock:
+                    daemon.calls[f"{self.command} {path}"] += 1
+                    failed = daemon.error_rate and daemon._random.random() < daemon.error_rate
+                    if failed:
+                        status, body = 500, {"message": "simulated failure"}
+                    else:
+                        status, body = daemon.route(self.command, path)
+                sent = self._send(status, body)
+                with daemon._lock:
+                    daemon.bytes_sent += sent
+
+            do_GET = _handle
+            do_POST = _handle
+            do_HEAD = _handle
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,26 @@
+"""把PruneMate读取的所有文件路径指向临时目录（基准测试和单元测试共用）
+
+prunemate.py在导入时读取这些环境变量，必须在导入之前调用isolate_paths()。
+"""
+
+import os
+
+# prunemate.py中默认位于/config的所有路径：(环境变量, 临时目录中的文件名)
+PRUNEMATE_PATHS = (
+    ("PRUNEMATE_CONFIG", "config.json"),
+    ("PRUNEMATE_LOCK", "prunemate.lock"),
+    ("PRUNEMATE_LAST_RUN", "last_run_key"),
+    ("PRUNEMATE_STATS", "stats.json"),
+    ("PRUNEMATE_HISTORY_DB", "history.db"),
+    ("PRUNEMATE_NOTIFY_SPOOL", "notifications"),
+    ("PRUNEMATE_NOTIFY_DIGEST", "notification_digest.json"),
+    ("PRUNEMATE_RUN_ARTIFACTS", "runs"),
+)
+
+
+def isolate_paths(workdir, env=None) -> dict:
+    """在env（默认os.environ）中把所有路径设为workdir下的文件，覆盖已有的值，返回env"""
+    env = os.environ if env is None else env
+    for name, file in PRUNEMATE_PATHS:
+        env[name] = os.path.join(workdir, file)
+    return env
@@ -9,24 +9,39 @@
 """
 
 import os
+import re
+import atexit
+import gzip
 import sys
 import json
+import time
+import zlib
+import contextlib
 import logging
 import tempfile
 import datetime
-import calendar
 import base64
+import uuid
+import hashlib
+import heapq
+import queue
+import sqlite3
+import http.client
 import urllib.request
 import urllib.parse
-from logging.handlers import RotatingFileHandler
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from pathlib import Path
 
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response, make_response
 from werkzeug.security import check_password_hash, generate_password_hash
 from filelock import FileLock, Timeout
 from gunicorn.app.base import BaseApplication
+from apscheduler.events import EVENT_JOB_SUBMITTED
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.combining import OrTrigger
 from zoneinfo import ZoneInfo
 
 # 可选Docker导入（最佳尝试）
@@ -48,6 +63,15 @@ LAST_RUN_FILE = Path(os.environ.get("PRUNEMATE_LAST_RUN", "/config/last_run_key"
 LAST_RUN_LOCK = Path(str(LAST_RUN_FILE) + ".lock")
 # 用于保存历史统计数据的文件
 STATS_FILE = Path(os.environ.get("PRUNEMATE_STATS", "/config/stats.json"))
+# 清理运行历史数据库（SQLite，WAL模式），每次运行和每个主机各一行
+HISTORY_DB = Path(os.environ.get("PRUNEMATE_HISTORY_DB", "/config/history.db"))
+# 通知发送队列目录：每条待发送的通知一个JSON文件，进程重启后继续发送
+NOTIFY_SPOOL_DIR = Path(os.environ.get("PRUNEMATE_NOTIFY_SPOOL", "/config/notifications"))
+# 通知摘要：窗口内累积的运行结果，多个进程共享
+NOTIFY_DIGEST_FILE = Path(os.environ.get("PRUNEMATE_NOTIFY_DIGEST", "/config/notification_digest.json"))
+NOTIFY_DIGEST_LOCK = Path(str(NOTIFY_DIGEST_FILE) + ".lock")
+# 每次清理运行的完整Docker清理响应（gzip压缩的JSON），主日志中只记录摘要
+RUN_ARTIFACT_DIR = Path(os.environ.get("PRUNEMATE_RUN_ARTIFACTS", "/config/runs"))
 
 DEFAULT_CONFIG = {
     "schedule_enabled": True,
@@ -61,6 +85,22 @@ DEFAULT_CONFIG = {
     "prune_volumes": False,
     "prune_build_cache": False,
     "docker_hosts": [],
+    # 回收目标模式：按层级逐步加大清理力度（构建缓存 → 悬空镜像 → 超过image_age_hours小时的未使用镜像 → 全部），
+    # 每个主机回收的空间达到target_gb（主机可用reclaim_target_gb覆盖）后停止
+    "reclaim_target": {
+        "enabled": False,
+        "target_gb": 10,
+        "image_age_hours": 72,
+    },
+    # 磁盘用量触发：定期采样每个主机，超过threshold_gb时清理该主机；
+    # 降到reset_gb以下后才会再次触发（滞后），同一主机两次清理至少间隔min_interval分钟
+    "disk_trigger": {
+        "enabled": False,
+        "metric": "reclaimable",
+        "threshold_gb": 20,
+        "reset_gb": 15,
+        "min_interval": 60,
+    },
     "notifications": {
         "provider": "gotify",
         "gotify": {"enabled": False, "url": "", "token": ""},
@@ -69,6 +109,11 @@ DEFAULT_CONFIG = {
         "telegram": {"enabled": False, "bot_token": "", "chat_id": ""},
         "priority": "medium",
         "only_on_changes": True,
+        # 为True时发送到所有已启用的提供商，而不仅是provider选择的那一个
+        "send_to_all": False,
+        # 摘要模式：在digest_window分钟内合并所有运行的结果，只发送一条通知
+        "digest_enabled": False,
+        "digest_window": 60,
     },
 }
 
@@ -77,6 +122,8 @@ config = json.loads(json.dumps(DEFAULT_CONFIG))
 # 配置读写锁，确保多Worker线程安全
 import threading
 config_lock = threading.RLock()
+# 配置文件签名缓存（mtime、ctime、大小、inode），文件未变化时跳过重新解析
+config_signature = {"value": None}
 # 内存缓存上次运行时间
 last_run_key = {"value": None}
 
@@ -94,22 +141,74 @@ if len(sys.argv) > 1 and sys.argv[1] == "--gen-hash":
         sys.exit(1)
 
 
+class TextLogFormatter(logging.Formatter):
+    """控制台文本格式：log()写入的记录带时区时间戳前缀"""
+
+    def format(self, record):
+        message = super().format(record)
+        timestamp = getattr(record, "pm_time", None)
+        return f"[{timestamp}] {message}" if timestamp else message
+
+
+class JsonLogFormatter(logging.Formatter):
+    """JSON行格式：每条记录一行，包含时间、级别、消息以及run_id/host/phase等上下文字段"""
+
+    def format(self, record):
+        entry = {
+            "time": getattr(record, "pm_time", None) or datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc).isoformat(timespec="seconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "pm_fields", None) or {})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# 日志通过队列交给后台线程写入控制台和文件，调用log()的线程不会阻塞在I/O上
+log_state = {"handler": None, "listener": None, "handlers": []}
+
+
+def _start_log_listener() -> None:
+    """创建新的日志队列和写入线程（启动时以及fork后的子进程中调用）"""
+    log_queue = queue.SimpleQueue()
+    log_state["handler"].queue = log_queue
+    listener = QueueListener(log_queue, *log_state["handlers"], respect_handler_level=True)
+    listener.start()
+    log_state["listener"] = listener
+
+
 def configure_logging():
-    """配置日志记录，支持控制台和文件滚动日志"""
+    """配置日志记录：控制台和文件滚动日志（各自为文本或JSON行），均由后台线程写入"""
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
     ch = logging.StreamHandler()
-    ch.setFormatter(logging.Formatter("%(message)s"))
-    logger.addHandler(ch)
+    ch.setFormatter(JsonLogFormatter() if log_format == "json" else TextLogFormatter("%(message)s"))
+    handlers = [ch]
+    file_error = None
     try:
         Path("/var/log").mkdir(parents=True, exist_ok=True)
         fh = RotatingFileHandler("/var/log/prunemate.log", maxBytes=5_000_000, backupCount=3)
-        fh.setFormatter(logging.Formatter("%(message)s"))
-        logger.addHandler(fh)
-    except Exception:
-        logger.exception("文件日志配置失败；仅使用控制台日志继续运行。")
-
-
+        fh.setFormatter(JsonLogFormatter() if log_file_format == "json" else TextLogFormatter("%(message)s"))
+        handlers.append(fh)
+    except Exception as e:
+        file_error = e
+    log_state["handlers"] = handlers
+    log_state["handler"] = QueueHandler(queue.SimpleQueue())
+    logger.addHandler(log_state["handler"])
+    _start_log_listener()
+    # Gunicorn fork出的Worker中原写入线程不存在，重新创建队列和线程
+    os.register_at_fork(after_in_child=_start_log_listener)
+    atexit.register(lambda: log_state["listener"].stop())
+    if file_error is not None:
+        logging.warning("文件日志配置失败（%s）；仅使用控制台日志继续运行。", file_error)
+
+
+# 控制台和文件日志格式：text（默认）或json（JSON行，包含run_id/host/phase字段）
+log_format = os.environ.get("PRUNEMATE_LOG_FORMAT", "text").strip().lower()
+log_file_format = os.environ.get("PRUNEMATE_LOG_FILE_FORMAT", "text").strip().lower()
 configure_logging()
 
 
@@ -127,11 +226,69 @@ logging.info("使用时区: %s", app_timezone)
 use_24h_format = os.environ.get("PRUNEMATE_TIME_24H", "true").lower() in ("true", "1", "yes")
 logging.info("使用时间格式: %s", "24小时制" if use_24h_format else "12小时制")
 
+
+def _env_int(name: str, default: int, minimum: int = 1) -> int:
+    """读取整数型环境变量，无效时回退到默认值"""
+    raw = os.environ.get(name)
+    if raw is None or raw.strip() == "":
+        return default
+    try:
+        return max(minimum, int(raw))
+    except ValueError:
+        logging.warning("环境变量 %s='%s' 无效，使用默认值 %s", name, raw, default)
+        return default
+
+
+# 多主机并发：同时处理的最大主机数，以及清理时每个主机的超时时间（秒）
+max_host_workers = _env_int("PRUNEMATE_MAX_WORKERS", 8)
+host_prune_timeout = _env_int("PRUNEMATE_HOST_TIMEOUT", 1800)
+# 预览时每个主机的超时时间（秒），超时的主机单独标记失败，不阻塞整个响应
+host_preview_timeout = _env_int("PRUNEMATE_PREVIEW_TIMEOUT", 60)
+# 预览结果缓存时间（秒），0表示不缓存
+preview_cache_ttl = _env_int("PRUNEMATE_PREVIEW_CACHE_TTL", 30, minimum=0)
+logging.info("多主机并发数: %s，单主机清理超时: %s秒，预览超时: %s秒", max_host_workers, host_prune_timeout, host_preview_timeout)
+
+# 是否为每个主机订阅Docker事件流并维护实时资源索引（预览直接读取索引）
+live_inventory_enabled = os.environ.get("PRUNEMATE_LIVE_INVENTORY", "true").lower() in ("true", "1", "yes")
+
+# 保留的镜像与被删除的镜像共享层时，是否inspect镜像按层精确估算可回收空间（每个新镜像多一次请求）
+layer_estimate_enabled = os.environ.get("PRUNEMATE_LAYER_ESTIMATE", "false").lower() in ("true", "1", "yes")
+
+# 是否记录每次清理和预览的Docker API调用（方法、路径、状态码、字节数、耗时），清理的追踪写入运行历史
+api_trace_enabled = os.environ.get("PRUNEMATE_API_TRACE", "true").lower() in ("true", "1", "yes")
+
+# 通知发送失败时的最多尝试次数；重试间隔从NOTIFY_RETRY_BASE秒开始翻倍，最长NOTIFY_RETRY_MAX秒
+notify_max_attempts = _env_int("PRUNEMATE_NOTIFY_RETRIES", 8)
+NOTIFY_RETRY_BASE = 5
+NOTIFY_RETRY_MAX = 900
+# 每个通知提供商的超时时间（秒）；发送到多个提供商时并行发送，总耗时接近最慢的那个
+notify_provider_timeout = _env_int("PRUNEMATE_NOTIFY_TIMEOUT", 10)
+# 磁盘队列中最多保留的待发送通知数量
+MAX_SPOOLED_NOTIFICATIONS = 100
+
+# 日志中每个清理响应列表最多显示的条目数，其余只记录数量；完整响应写入运行产物文件
+prune_log_items = _env_int("PRUNEMATE_LOG_ITEMS", 5, minimum=0)
+# 保留的运行产物文件数量，超出时删除最旧的
+MAX_RUN_ARTIFACTS = 50
+
+# 同时保持的实时事件流（SSE）连接数上限；Gunicorn会为这些连接额外预留线程
+max_event_streams = _env_int("PRUNEMATE_MAX_STREAMS", 4, minimum=0)
+
+# 计划任务错过后（进程繁忙或重启）允许补跑的时间窗口（秒）
+schedule_misfire_grace = _env_int("PRUNEMATE_MISFIRE_GRACE", 3600)
+
+# 从运行历史数据库导出stats.json（兼容和备份）的间隔（秒）
+stats_export_interval = _env_int("PRUNEMATE_STATS_EXPORT_INTERVAL", 3600, minimum=60)
+
+# 磁盘用量触发的采样间隔（秒）
+disk_check_interval = _env_int("PRUNEMATE_DISK_CHECK_INTERVAL", 300, minimum=30)
+
 # 抑制APScheduler冗长的任务执行日志
 logging.getLogger("apscheduler.executors.default").setLevel(logging.WARNING)
 
 # 调度器初始化
-# 后台调度器用于每分钟心跳检查，实际任务在__main__中添加
+# 后台调度器：计划清理任务根据配置生成Cron触发器；由Worker进程的post_fork钩子启动，
+# 计划清理与/metrics、预览缓存处于同一进程
 scheduler = BackgroundScheduler(
     timezone=app_timezone,
     job_defaults={
@@ -139,14 +296,158 @@ scheduler = BackgroundScheduler(
         "misfire_grace_time": 300,
     },
 )
-scheduler.start()
 
 
-def log(message: str):
-    """带时区时间戳的日志记录"""
+# ---- 实时事件 ----
+# 清理进度和日志行写入内存环形缓冲区，由/events通过SSE推送给浏览器
+EVENT_BUFFER_SIZE = 500
+event_buffer = deque(maxlen=EVENT_BUFFER_SIZE)
+event_condition = threading.Condition()
+event_state = {"seq": 0}
+
+
+def publish_event(event_type: str, **data) -> int:
+    """发布一条实时事件并唤醒所有等待中的事件流，返回事件ID"""
+    with event_condition:
+        event_state["seq"] += 1
+        event_buffer.append({
+            "id": event_state["seq"],
+            "type": event_type,
+            "time": datetime.datetime.now(app_timezone).isoformat(timespec="seconds"),
+            "data": data,
+        })
+        event_condition.notify_all()
+        return event_state["seq"]
+
+
+def latest_event_id() -> int:
+    """返回最新事件的ID"""
+    with event_condition:
+        return event_state["seq"]
+
+
+def wait_for_events(last_id: int, timeout: float) -> list:
+    """返回ID大于last_id的事件；没有新事件时最多等待timeout秒"""
+    with event_condition:
+        if event_state["seq"] <= last_id:
+            event_condition.wait(timeout)
+        return [e for e in event_buffer if e["id"] > last_id]
+
+
+# ---- Prometheus指标 ----
+# 运行时只在内存中累加数值，文本格式仅在/metrics被抓取时生成，没有抓取时几乎没有开销
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+LATENCY_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRICS = {
+    "prunemate_runs_total": {
+        "type": "counter", "help": "清理运行次数", "labels": ("origin", "status")},
+    "prunemate_host_prune_duration_seconds": {
+        "type": "histogram", "help": "单个主机清理耗时", "labels": ("host",), "buckets": DURATION_BUCKETS},
+    "prunemate_phase_duration_seconds": {
+        "type": "histogram", "help": "单个主机每个清理阶段的耗时", "labels": ("host", "phase"), "buckets": DURATION_BUCKETS},
+    "prunemate_reclaimed_bytes_total": {
+        "type": "counter", "help": "回收的空间（字节）", "labels": ("host",)},
+    "prunemate_docker_api_errors_total": {
+        "type": "counter", "help": "Docker API调用错误次数", "labels": ("host", "operation")},
+    "prunemate_preview_duration_seconds": {
+        "type": "histogram", "help": "单个主机预览耗时（不含缓存命中）", "labels": ("host",), "buckets": LATENCY_BUCKETS},
+    "prunemate_preview_request_duration_seconds": {
+        "type": "histogram", "help": "整个预览请求的耗时", "labels": (), "buckets": LATENCY_BUCKETS},
+    "prunemate_scheduler_lag_seconds": {
+        "type": "histogram", "help": "计划时间与实际开始时间的差", "labels": (), "buckets": LATENCY_BUCKETS + (120, 300, 900, 3600)},
+    "prunemate_lock_wait_seconds": {
+        "type": "histogram", "help": "run_prune_job等待清理锁的时间", "labels": ("origin",), "buckets": LATENCY_BUCKETS + (120, 300)},
+    "prunemate_notifications_total": {
+        "type": "counter", "help": "后台通知发送结果（sent、retry、failed、dropped）", "labels": ("provider", "status")},
+}
+metric_values = {name: {} for name in METRICS}
+metrics_lock = threading.Lock()
+
+
+def inc_metric(name: str, amount: float = 1, **labels) -> None:
+    """累加计数器"""
+    key = tuple(str(labels.get(label, "")) for label in METRICS[name]["labels"])
+    with metrics_lock:
+        values = metric_values[name]
+        values[key] = values.get(key, 0) + amount
+
+
+def observe_metric(name: str, value: float, **labels) -> None:
+    """记录一次直方图观测值"""
+    buckets = METRICS[name]["buckets"]
+    key = tuple(str(labels.get(label, "")) for label in METRICS[name]["labels"])
+    with metrics_lock:
+        entry = metric_values[name].get(key)
+        if entry is None:
+            entry = metric_values[name][key] = {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                entry["buckets"][i] += 1
+        entry["sum"] += value
+        entry["count"] += 1
+
+
+def _metric_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    """格式化Prometheus标签"""
+    parts = [
+        f'{n}="' + v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") + '"'
+        for n, v in zip(names, values)
+    ]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def render_metrics() -> str:
+    """生成Prometheus文本格式的所有指标"""
+    with metrics_lock:
+        snapshot = {
+            name: [(key, dict(value, buckets=list(value["buckets"])) if isinstance(value, dict) else value)
+                   for key, value in values.items()]
+            for name, values in metric_values.items()
+        }
+    lines = []
+    for name, meta in METRICS.items():
+        lines.append(f"# HELP {name} {meta['help']}")
+        lines.append(f"# TYPE {name} {meta['type']}")
+        labels = meta["labels"]
+        for key, value in snapshot[name]:
+            if meta["type"] == "counter":
+                lines.append(f"{name}{_metric_labels(labels, key)} {value}")
+                continue
+            for bound, count in zip(meta["buckets"], value["buckets"]):
+                le = 'le="%s"' % bound
+                lines.append(f"{name}_bucket{_metric_labels(labels, key, le)} {count}")
+            le = 'le="+Inf"'
+            lines.append(f"{name}_bucket{_metric_labels(labels, key, le)} {value['count']}")
+            lines.append(f"{name}_sum{_metric_labels(labels, key)} {value['sum']}")
+            lines.append(f"{name}_count{_metric_labels(labels, key)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+# 当前线程的日志上下文（run_id、host、phase），log()自动附加到每条记录和log事件
+log_context_local = threading.local()
+
+
+@contextlib.contextmanager
+def log_context(**fields):
+    """在当前线程中为之后的log()调用附加上下文字段，值为None的字段会被移除"""
+    previous = getattr(log_context_local, "fields", {})
+    merged = dict(previous, **fields)
+    log_context_local.fields = {k: v for k, v in merged.items() if v is not None}
+    try:
+        yield
+    finally:
+        log_context_local.fields = previous
+
+
+def log(message: str, **fields):
+    """带时区时间戳的结构化日志记录；fields与当前线程的日志上下文合并后写入记录"""
     now = datetime.datetime.now(app_timezone)
     timestamp = now.isoformat(timespec="seconds")
-    logging.info("[%s] %s", timestamp, message)
+    context = dict(getattr(log_context_local, "fields", {}), **fields)
+    logging.info(message, extra={"pm_time": timestamp, "pm_fields": context})
+    publish_event("log", message=message, **context)
 
 
 def _redact_for_log(obj):
@@ -223,6 +524,11 @@ def _clear_last_run_key() -> None:
 
 # ---- 历史统计数据管理 ----
 def load_stats() -> dict:
+    """加载历史统计数据：优先使用运行历史数据库中维护的汇总，不可用时读取stats.json"""
+    return load_history_totals() or _load_stats_file()
+
+
+def _load_stats_file() -> dict:
     """从磁盘加载历史统计数据"""
     default_stats = {
         "total_space_reclaimed": 0,
@@ -283,6 +589,7 @@ def save_stats(stats: dict) -> None:
                 pass
             
             tmp_path.replace(STATS_FILE)
+            invalidate_stats_cache()
             log(f"统计数据已保存到 {STATS_FILE}")
         except Exception:
             if tmp_path and tmp_path.exists():
@@ -296,8 +603,8 @@ def save_stats(stats: dict) -> None:
 
 
 def update_stats(containers: int, images: int, networks: int, volumes: int, build_cache: int, space: int) -> None:
-    """更新历史统计数据"""
-    stats = load_stats()
+    """累加stats.json中的历史统计数据；仅在运行历史数据库写入失败时使用"""
+    stats = _load_stats_file()
     
     try:
         stats["containers_deleted"] = int(stats.get("containers_deleted") or 0) + int(containers or 0)
@@ -318,6 +625,394 @@ def update_stats(containers: int, images: int, networks: int, volumes: int, buil
     save_stats(stats)
 
 
+# ---- 运行历史数据库 ----
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    origin TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL NOT NULL,
+    duration REAL NOT NULL,
+    hosts INTEGER NOT NULL DEFAULT 0,
+    hosts_failed INTEGER NOT NULL DEFAULT 0,
+    containers INTEGER NOT NULL DEFAULT 0,
+    images INTEGER NOT NULL DEFAULT 0,
+    networks INTEGER NOT NULL DEFAULT 0,
+    volumes INTEGER NOT NULL DEFAULT 0,
+    build_cache INTEGER NOT NULL DEFAULT 0,
+    space INTEGER NOT NULL DEFAULT 0,
+    estimated_space INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_started_at ON runs (started_at);
+CREATE TABLE IF NOT EXISTS host_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    host_name TEXT NOT NULL,
+    host_url TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    duration REAL,
+    success INTEGER NOT NULL,
+    containers INTEGER NOT NULL DEFAULT 0,
+    images INTEGER NOT NULL DEFAULT 0,
+    networks INTEGER NOT NULL DEFAULT 0,
+    volumes INTEGER NOT NULL DEFAULT 0,
+    build_cache INTEGER NOT NULL DEFAULT 0,
+    space INTEGER NOT NULL DEFAULT 0,
+    estimated_space INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS host_runs_run_id ON host_runs (run_id);
+CREATE INDEX IF NOT EXISTS host_runs_host_started ON host_runs (host_url, started_at);
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    prune_runs INTEGER NOT NULL DEFAULT 0,
+    containers_deleted INTEGER NOT NULL DEFAULT 0,
+    images_deleted INTEGER NOT NULL DEFAULT 0,
+    networks_deleted INTEGER NOT NULL DEFAULT 0,
+    volumes_deleted INTEGER NOT NULL DEFAULT 0,
+    build_cache_deleted INTEGER NOT NULL DEFAULT 0,
+    total_space_reclaimed INTEGER NOT NULL DEFAULT 0,
+    first_run TEXT,
+    last_run TEXT
+);
+CREATE TABLE IF NOT EXISTS host_totals (
+    host_url TEXT PRIMARY KEY,
+    host_name TEXT NOT NULL,
+    runs INTEGER NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0,
+    containers INTEGER NOT NULL DEFAULT 0,
+    images INTEGER NOT NULL DEFAULT 0,
+    networks INTEGER NOT NULL DEFAULT 0,
+    volumes INTEGER NOT NULL DEFAULT 0,
+    build_cache INTEGER NOT NULL DEFAULT 0,
+    space INTEGER NOT NULL DEFAULT 0,
+    last_run REAL
+);
+CREATE TABLE IF NOT EXISTS run_traces (
+    run_id INTEGER PRIMARY KEY REFERENCES runs (id),
+    calls INTEGER NOT NULL DEFAULT 0,
+    api_seconds REAL NOT NULL DEFAULT 0,
+    trace BLOB NOT NULL
+);
+"""
+
+STATS_COUNTER_KEYS = (
+    "total_space_reclaimed", "containers_deleted", "images_deleted",
+    "networks_deleted", "volumes_deleted", "build_cache_deleted", "prune_runs",
+)
+HOST_COUNTER_KEYS = ("containers", "images", "networks", "volumes", "build_cache", "space")
+
+history_state = {"ready": False}
+history_lock = threading.Lock()
+# 每个主机最近一次清理的时间（Unix时间戳）：启动时由load_host_last_prune从host_totals读取，
+# 之后由_prune_host和record_run更新，预览缓存和磁盘用量触发读取时无需访问数据库
+host_last_prune = {}
+host_last_prune_lock = threading.Lock()
+
+
+def _history_connect():
+    """打开历史数据库连接，首次调用时创建表结构并从stats.json导入已有总计"""
+    conn = sqlite3.connect(str(HISTORY_DB), timeout=30)
+    conn.row_factory = sqlite3.Row
+    if history_state["ready"]:
+        return conn
+    with history_lock:
+        if not history_state["ready"]:
+            HISTORY_DB.parent.mkdir(parents=True, exist_ok=True)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(HISTORY_SCHEMA)
+            # 旧版本创建的数据库：补充后来新增的列
+            for table in ("runs", "host_runs"):
+                columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+                if "estimated_space" not in columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN estimated_space INTEGER")
+            with conn:
+                if conn.execute("SELECT 1 FROM totals WHERE id = 1").fetchone() is None:
+                    # 新数据库：以现有stats.json中的累计值作为起点
+                    legacy = _load_stats_file()
+                    conn.execute(
+                        "INSERT INTO totals (id, first_run, last_run, "
+                        + ", ".join(STATS_COUNTER_KEYS)
+                        + ") VALUES (1, ?, ?, " + ", ".join("?" for _ in STATS_COUNTER_KEYS) + ")",
+                        [legacy.get("first_run"), legacy.get("last_run")]
+                        + [int(legacy.get(k) or 0) for k in STATS_COUNTER_KEYS],
+                    )
+            try:
+                HISTORY_DB.chmod(0o600)
+            except Exception:
+                pass
+            history_state["ready"] = True
+    return conn
+
+
+def record_run(origin: str, started_at: float, finished_at: float, host_results: list, error: str | None = None,
+               trace: dict | None = None) -> int | None:
+    """将一次清理运行及其每个主机的结果追加到历史数据库，并在同一事务中更新汇总表
+
+    传入trace时，本次运行的Docker API调用追踪以zlib压缩的JSON一并保存。
+    """
+    totals = {key: sum(int(r.get(key) or 0) for r in host_results) for key in HOST_COUNTER_KEYS}
+    hosts_failed = sum(1 for r in host_results if not r.get("success"))
+    estimates = [r["estimated_space"] for r in host_results if r.get("estimated_space") is not None]
+    estimated_space = sum(estimates) if estimates else None
+    now_iso = datetime.datetime.fromtimestamp(finished_at, app_timezone).isoformat()
+    try:
+        conn = _history_connect()
+        try:
+            with conn:
+                cur = conn.execute(
+                    "INSERT INTO runs (origin, started_at, finished_at, duration, hosts, hosts_failed, "
+                    "containers, images, networks, volumes, build_cache, space, estimated_space, error) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (origin, started_at, finished_at, round(finished_at - started_at, 3), len(host_results), hosts_failed,
+                     *(totals[k] for k in HOST_COUNTER_KEYS), estimated_space, error),
+                )
+                run_id = cur.lastrowid
+                for r in host_results:
+                    counts = [int(r.get(k) or 0) for k in HOST_COUNTER_KEYS]
+                    conn.execute(
+                        "INSERT INTO host_runs (run_id, host_name, host_url, started_at, duration, success, "
+                        "containers, images, networks, volumes, build_cache, space, estimated_space, error) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (run_id, r.get("name", "未命名"), r.get("url", ""), started_at, r.get("duration"),
+                         1 if r.get("success") else 0, *counts, r.get("estimated_space"), r.get("error")),
+                    )
+                    conn.execute(
+                        "INSERT INTO host_totals (host_url, host_name, runs, failures, "
+                        "containers, images, networks, volumes, build_cache, space, last_run) "
+                        "VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (host_url) DO UPDATE SET host_name = excluded.host_name, "
+                        "runs = runs + 1, failures = failures + excluded.failures, "
+                        "containers = containers + excluded.containers, images = images + excluded.images, "
+                        "networks = networks + excluded.networks, volumes = volumes + excluded.volumes, "
+                        "build_cache = build_cache + excluded.build_cache, space = space + excluded.space, "
+                        "last_run = excluded.last_run",
+                        (r.get("url", ""), r.get("name", "未命名"), 0 if r.get("success") else 1, *counts, finished_at),
+                    )
+                conn.execute(
+                    "UPDATE totals SET prune_runs = prune_runs + 1, "
+                    "containers_deleted = containers_deleted + ?, images_deleted = images_deleted + ?, "
+                    "networks_deleted = networks_deleted + ?, volumes_deleted = volumes_deleted + ?, "
+                    "build_cache_deleted = build_cache_deleted + ?, total_space_reclaimed = total_space_reclaimed + ?, "
+                    "first_run = COALESCE(first_run, ?), last_run = ? WHERE id = 1",
+                    (*(totals[k] for k in HOST_COUNTER_KEYS), now_iso, now_iso),
+                )
+                if trace is not None:
+                    exported = export_api_trace(trace)
+                    conn.execute(
+                        "INSERT INTO run_traces (run_id, calls, api_seconds, trace) VALUES (?, ?, ?, ?)",
+                        (run_id, len(exported["calls"]) + exported["dropped"],
+                         round(sum(c["duration"] for c in exported["calls"]), 3),
+                         zlib.compress(json.dumps(exported, ensure_ascii=False).encode("utf-8"))),
+                    )
+            invalidate_stats_cache()
+            for r in host_results:
+                _bump_host_last_prune(r.get("url", ""), finished_at)
+            return run_id
+        finally:
+            conn.close()
+    except Exception as e:
+        log(f"写入运行历史 {HISTORY_DB} 时出错: {e}")
+        return None
+
+
+def load_history_totals() -> dict | None:
+    """从历史数据库的汇总表读取累计统计，数据库不可用时返回None"""
+    try:
+        conn = _history_connect()
+        try:
+            row = conn.execute("SELECT * FROM totals WHERE id = 1").fetchone()
+        finally:
+            conn.close()
+    except Exception as e:
+        log(f"读取运行历史 {HISTORY_DB} 时出错: {e}; 回退到 {STATS_FILE}")
+        return None
+    if row is None:
+        return None
+    stats = {key: int(row[key] or 0) for key in STATS_COUNTER_KEYS}
+    stats["first_run"] = row["first_run"]
+    stats["last_run"] = row["last_run"]
+    return stats
+
+
+def export_stats_file() -> None:
+    """把运行历史数据库中的累计统计导出到stats.json（兼容和备份），内容未变化时不重写
+
+    运行结束时不再重写stats.json，由计划任务每隔PRUNEMATE_STATS_EXPORT_INTERVAL秒调用。
+    """
+    stats = load_history_totals()
+    if stats is None or stats == _load_stats_file():
+        return
+    save_stats(stats)
+
+
+def load_host_last_prune() -> None:
+    """启动时从运行历史读取一次每个主机最近一次清理的时间，之后只在内存中更新"""
+    try:
+        conn = _history_connect()
+        try:
+            rows = conn.execute("SELECT host_url, last_run FROM host_totals WHERE last_run IS NOT NULL").fetchall()
+        finally:
+            conn.close()
+    except Exception as e:
+        log(f"读取运行历史 {HISTORY_DB} 时出错: {e}")
+        return
+    for row in rows:
+        _bump_host_last_prune(row["host_url"], row["last_run"])
+
+
+def _bump_host_last_prune(host_url: str, timestamp: float) -> None:
+    """记录主机的一次清理（只会向后推进）"""
+    with host_last_prune_lock:
+        if timestamp > host_last_prune.get(host_url, 0):
+            host_last_prune[host_url] = timestamp
+
+
+def _host_last_prune(host_url: str) -> float | None:
+    """返回主机最近一次清理的时间，没有记录时返回None；只读内存，不访问数据库"""
+    return host_last_prune.get(host_url)
+
+
+def load_run_trace(run_id: int) -> dict | None:
+    """读取某次运行保存的Docker API调用追踪，没有追踪时返回None"""
+    conn = _history_connect()
+    try:
+        row = conn.execute("SELECT trace FROM run_traces WHERE run_id = ?", (run_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return json.loads(zlib.decompress(row["trace"]).decode("utf-8"))
+
+
+def _history_time(ts: float | None) -> str | None:
+    """将历史记录中的Unix时间戳转换为带时区的ISO时间"""
+    if ts is None:
+        return None
+    return datetime.datetime.fromtimestamp(ts, app_timezone).isoformat(timespec="seconds")
+
+
+def query_run_history(limit: int = 50, host_url: str | None = None, since: float | None = None) -> list:
+    """返回最近的运行记录（新到旧），每条包含其主机结果"""
+    conn = _history_connect()
+    try:
+        where, params = [], []
+        if since is not None:
+            where.append("started_at >= ?")
+            params.append(since)
+        if host_url:
+            where.append("id IN (SELECT run_id FROM host_runs WHERE host_url = ?)")
+            params.append(host_url)
+        sql = ("SELECT runs.*, run_traces.calls AS api_calls, run_traces.api_seconds FROM runs "
+               "LEFT JOIN run_traces ON run_traces.run_id = runs.id")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY started_at DESC LIMIT ?"
+        params.append(limit)
+        runs = [dict(r) for r in conn.execute(sql, params).fetchall()]
+        if runs:
+            placeholders = ", ".join("?" for _ in runs)
+            hosts_by_run = {}
+            for h in conn.execute(
+                f"SELECT * FROM host_runs WHERE run_id IN ({placeholders}) ORDER BY id", [r["id"] for r in runs]
+            ).fetchall():
+                hosts_by_run.setdefault(h["run_id"], []).append(dict(h))
+            for r in runs:
+                r["hosts"] = hosts_by_run.get(r["id"], [])
+        for r in runs:
+            r["started_at"] = _history_time(r["started_at"])
+            r["finished_at"] = _history_time(r["finished_at"])
+            for h in r.get("hosts", []):
+                h["started_at"] = _history_time(h["started_at"])
+                h["success"] = bool(h["success"])
+        return runs
+    finally:
+        conn.close()
+
+
+def query_host_totals(since: float | None = None) -> list:
+    """返回每个主机的累计清理结果；指定since时只统计该时间之后的运行"""
+    conn = _history_connect()
+    try:
+        if since is None:
+            rows = conn.execute("SELECT * FROM host_totals ORDER BY space DESC").fetchall()
+            result = [dict(r) for r in rows]
+            for r in result:
+                r["last_run"] = _history_time(r["last_run"])
+            return result
+        rows = conn.execute(
+            "SELECT host_url, MAX(host_name) AS host_name, COUNT(*) AS runs, SUM(1 - success) AS failures, "
+            "SUM(containers) AS containers, SUM(images) AS images, SUM(networks) AS networks, "
+            "SUM(volumes) AS volumes, SUM(build_cache) AS build_cache, SUM(space) AS space, "
+            "MAX(started_at) AS last_run FROM host_runs WHERE started_at >= ? "
+            "GROUP BY host_url ORDER BY space DESC",
+            (since,),
+        ).fetchall()
+        result = [dict(r) for r in rows]
+        for r in result:
+            r["last_run"] = _history_time(r["last_run"])
+        return result
+    finally:
+        conn.close()
+
+
+# ---- 统计数据内存缓存 ----
+# /stats和/api/stats被仪表板频繁轮询：统计数据缓存在内存中，
+# 仅在本进程写入统计或统计文件在磁盘上发生变化时重新加载
+stats_cache = {"signature": None, "generation": -1, "stats": None, "etag": None, "last_modified": None, "bodies": {}}
+stats_generation = {"value": 0}
+stats_cache_lock = threading.Lock()
+
+
+def invalidate_stats_cache() -> None:
+    """标记统计缓存失效（save_stats和record_run写入后调用）"""
+    with stats_cache_lock:
+        stats_generation["value"] += 1
+
+
+def _stats_files_signature() -> tuple:
+    """返回统计相关文件的签名，用于发现其他进程或手动编辑造成的变化"""
+    signature = []
+    for path in (STATS_FILE, HISTORY_DB, Path(str(HISTORY_DB) + "-wal")):
+        try:
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size, st.st_ino))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def get_cached_stats() -> dict:
+    """返回缓存的统计数据条目，包含stats、etag和last_modified"""
+    signature = _stats_files_signature()
+    with stats_cache_lock:
+        generation = stats_generation["value"]
+        if stats_cache["stats"] is not None and stats_cache["signature"] == signature \
+                and stats_cache["generation"] == generation:
+            return stats_cache
+
+    stats = load_stats()
+    encoded = json.dumps(stats, sort_keys=True).encode("utf-8")
+    mtimes = [s[0] for s in signature if s is not None]
+    last_modified = (
+        datetime.datetime.fromtimestamp(max(mtimes) / 1e9, datetime.timezone.utc).replace(microsecond=0)
+        if mtimes else None
+    )
+    with stats_cache_lock:
+        # 加载期间如果又有写入，保留旧的generation以便下次重新加载
+        stats_cache.update({
+            "signature": signature,
+            "generation": generation,
+            "stats": stats,
+            "etag": hashlib.sha1(encoded).hexdigest()[:20],
+            "last_modified": last_modified,
+            "bodies": {},
+        })
+        return stats_cache
+
+
 def human_bytes(num: int) -> str:
     """将字节数转换为人类可读的格式（B, KB, MB, GB, TB, PB）"""
     n = float(num)
@@ -415,10 +1110,32 @@ def effective_config():
     return base
 
 
+def _config_file_signature():
+    """返回配置文件的签名；文件不存在时返回 "missing"，无法读取时返回None"""
+    try:
+        st = os.stat(CONFIG_PATH)
+    except FileNotFoundError:
+        return "missing"
+    except Exception:
+        return None
+    return (st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_ino)
+
+
 def load_config(silent=False):
-    """从磁盘加载配置文件"""
+    """从磁盘加载配置文件
+
+    文件的签名与上次加载时相同则直接沿用内存中的配置，
+    外部修改文件后会在下次调用时自动重新读取。
+    """
     global config
     with config_lock:
+        # 先取签名再读取：读取期间文件被修改时，下次调用签名不同会再次读取
+        signature = _config_file_signature()
+        if signature is not None and signature == config_signature["value"]:
+            if not silent:
+                log(f"从 {CONFIG_PATH} 加载配置: {_redact_for_log(effective_config())}")
+            return
+        config_signature["value"] = None
         try:
             with open(CONFIG_PATH, "r", encoding="utf-8") as f:
                 data = json.load(f)
@@ -508,21 +1225,26 @@ def load_config(silent=False):
                     host["enabled"] = True
 
             config = merged
+            config_signature["value"] = signature
             if not silent:
                 log(f"从 {CONFIG_PATH} 加载配置: {_redact_for_log(effective_config())}")
         except FileNotFoundError:
             if not silent:
                 log(f"未找到配置文件 {CONFIG_PATH}，使用默认配置。")
             config = json.loads(json.dumps(DEFAULT_CONFIG))
+            config_signature["value"] = "missing"
         except Exception as e:
             if not silent:
                 log(f"从 {CONFIG_PATH} 加载配置时出错: {e}。使用默认配置。")
             config = json.loads(json.dumps(DEFAULT_CONFIG))
+        apply_schedule()
 
 
 def save_config():
     """原子化保存配置到磁盘"""
     with config_lock:
+        # 保存后（无论成功与否）重新从磁盘读取，保证内存与文件一致
+        config_signature["value"] = None
         try:
             path = Path(CONFIG_PATH)
             parent = path.parent or Path(".")
@@ -548,6 +1270,9 @@ def save_config():
                     pass
                 tmp_path.replace(path)
                 log(f"配置已保存到 {path}: {_redact_for_log(config_to_save)}")
+                sync_docker_client_pool()
+                sync_inventory_watchers()
+                apply_schedule()
             finally:
                 if tmp_path and tmp_path.exists() and tmp_path != path:
                     try:
@@ -558,50 +1283,56 @@ def save_config():
             log(f"保存配置到 {CONFIG_PATH} 时失败: {e}")
 
 
-def _send_gotify(cfg: dict, title: str, message: str, priority: str = "medium") -> bool:
-    """通过Gotify发送通知"""
+# ---- 通知发送 ----
+# 每个提供商先生成一个HTTP请求描述，再通过按 (协议, 主机, 端口) 复用的keep-alive连接发送。
+# 清理结果的通知进入后台队列：由单独的线程发送，失败时指数退避重试，
+# 待发送的通知同时写入磁盘队列目录，进程重启后继续发送。
+NOTIFY_USER_AGENT = "PruneMate/1.3.0 (Docker清理助手)"
+NOTIFY_PROVIDER_LABELS = {"gotify": "Gotify", "ntfy": "ntfy", "discord": "Discord", "telegram": "Telegram"}
+
+
+def _gotify_request(cfg: dict, title: str, message: str, priority: str = "medium") -> dict | None:
+    """生成Gotify通知请求"""
     if not cfg.get("enabled"):
         log("Gotify已禁用；跳过通知。")
-        return False
+        return None
     url = (cfg.get("url") or "").strip()
     token = (cfg.get("token") or "").strip()
     if not url or not token:
         log("Gotify已启用但URL或令牌缺失；跳过。")
-        return False
+        return None
     
     priority_map = {"low": 2, "medium": 5, "high": 8}
     gotify_priority = priority_map.get(priority, 2)
     
-    endpoint = url.rstrip("/") + "/message?token=" + token
-    payload = json.dumps({"title": title, "message": message, "priority": gotify_priority}).encode("utf-8")
-    req = urllib.request.Request(endpoint, data=payload, headers={"Content-Type": "application/json"}, method="POST")
-    try:
-        with urllib.request.urlopen(req, timeout=5) as resp:
-            log(f"Gotify通知已发送，状态={getattr(resp, 'status', '?')}")
-            return True
-    except Exception as e:
-        log(f"发送Gotify通知失败: {e}")
-        return False
+    return {
+        "url": url.rstrip("/") + "/message?token=" + token,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps({"title": title, "message": message, "priority": gotify_priority}).encode("utf-8"),
+        "timeout": 5,
+    }
 
 
-def _send_ntfy(cfg: dict, title: str, message: str, priority: str = "medium") -> bool:
-    """通过ntfy发送通知"""
+def _ntfy_request(cfg: dict, title: str, message: str, priority: str = "medium") -> dict | None:
+    """生成ntfy通知请求"""
     if not cfg.get("enabled"):
         log("ntfy已禁用；跳过通知。")
-        return False
+        return None
     url = (cfg.get("url") or "").strip()
     topic = (cfg.get("topic") or "").strip()
     token = (cfg.get("token") or "").strip()
     
     if not url or not topic:
         log("ntfy已启用但URL或主题缺失；跳过。")
-        return False
+        return None
     
     priority_map = {"low": 2, "medium": 3, "high": 5}
     ntfy_priority = priority_map.get(priority, 2)
     
     parsed = urllib.parse.urlparse(url)
-    headers = {"Title": title, "Priority": str(ntfy_priority), "Content-Type": "text/plain"}
+    # HTTP头只能包含latin-1字符，标题按RFC 2047编码（ntfy支持）
+    encoded_title = "=?UTF-8?B?" + base64.b64encode(title.encode("utf-8")).decode("ascii") + "?="
+    headers = {"Title": encoded_title, "Priority": str(ntfy_priority), "Content-Type": "text/plain"}
     
     if token:
         headers["Authorization"] = f"Bearer {token}"
@@ -624,31 +1355,23 @@ def _send_ntfy(cfg: dict, title: str, message: str, priority: str = "medium") ->
     else:
         endpoint = url.rstrip("/") + "/" + topic.lstrip("/")
     
-    payload = message.encode("utf-8")
-    req = urllib.request.Request(endpoint, data=payload, headers=headers, method="POST")
-    try:
-        with urllib.request.urlopen(req, timeout=5) as resp:
-            log(f"ntfy通知已发送，状态={getattr(resp, 'status', '?')}")
-            return True
-    except Exception as e:
-        log(f"发送ntfy通知失败: {e}")
-        return False
+    return {"url": endpoint, "headers": headers, "body": message.encode("utf-8"), "timeout": 5}
 
 
-def _send_discord(cfg: dict, title: str, message: str, priority: str = "medium") -> bool:
-    """通过Discord Webhook发送通知"""
+def _discord_request(cfg: dict, title: str, message: str, priority: str = "medium") -> dict | None:
+    """生成Discord Webhook通知请求"""
     if not cfg.get("enabled"):
         log("Discord已禁用；跳过通知。")
-        return False
+        return None
     webhook_url = (cfg.get("webhook_url") or "").strip()
     if not webhook_url:
         log("Discord已启用但Webhook URL缺失；跳过。")
-        return False
+        return None
     
     if not webhook_url.startswith("https://discord.com/api/webhooks/") and \
        not webhook_url.startswith("https://discordapp.com/api/webhooks/"):
         log(f"Discord Webhook URL格式无效: {webhook_url[:50]}...")
-        return False
+        return None
     
     color_map = {
         "low": 0x2ECC71,     # 绿色（信息）
@@ -666,49 +1389,29 @@ def _send_discord(cfg: dict, title: str, message: str, priority: str = "medium")
         }]
     }
     
-    data = json.dumps(payload).encode("utf-8")
-    headers = {
-        "Content-Type": "application/json",
-        "User-Agent": "PruneMate/1.3.0 (Docker清理助手)"
+    return {
+        "url": webhook_url,
+        "headers": {"Content-Type": "application/json", "User-Agent": NOTIFY_USER_AGENT},
+        "body": json.dumps(payload).encode("utf-8"),
+        "timeout": 10,
     }
-    req = urllib.request.Request(webhook_url, data=data, headers=headers, method="POST")
-    try:
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            log(f"Discord通知已发送，状态={getattr(resp, 'status', '?')}")
-            return True
-    except urllib.error.HTTPError as e:
-        error_body = ""
-        try:
-            error_body = e.read().decode("utf-8")
-        except Exception:
-            pass
-        log(f"Discord Webhook HTTP错误 {e.code}: {e.reason}。响应体: {error_body[:200]}")
-        return False
-    except urllib.error.URLError as e:
-        log(f"Discord Webhook网络错误: {e.reason}")
-        return False
-    except Exception as e:
-        log(f"发送Discord通知失败: {e}")
-        return False
 
 
-def _send_telegram(cfg: dict, title: str, message: str, priority: str = "medium") -> bool:
-    """通过Telegram Bot API发送通知"""
+def _telegram_request(cfg: dict, title: str, message: str, priority: str = "medium") -> dict | None:
+    """生成Telegram Bot API通知请求"""
     if not cfg.get("enabled"):
         log("Telegram已禁用；跳过通知。")
-        return False
+        return None
     bot_token = (cfg.get("bot_token") or "").strip()
     chat_id = (cfg.get("chat_id") or "").strip()
     if not bot_token or not chat_id:
         log("Telegram已启用但bot_token或chat_id缺失；跳过。")
-        return False
+        return None
     
     disable_notification = (priority == "low")
     
     full_message = f"<b>{title}</b>\n\n{message}"
     
-    api_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    
     payload = json.dumps({
         "chat_id": chat_id,
         "text": full_message,
@@ -716,275 +1419,1839 @@ def _send_telegram(cfg: dict, title: str, message: str, priority: str = "medium"
         "disable_notification": disable_notification
     }).encode("utf-8")
     
-    req = urllib.request.Request(
-        api_url,
-        data=payload,
-        headers={
-            "Content-Type": "application/json",
-            "User-Agent": "PruneMate/1.3.0 (Docker清理助手)"
-        },
-        method="POST"
-    )
-    
+    def check(body: bytes):
+        result = json.loads(body.decode("utf-8"))
+        if not result.get("ok"):
+            return f"Telegram API返回ok=false: {result}"
+        return None
+
+    return {
+        "url": f"https://api.telegram.org/bot{bot_token}/sendMessage",
+        "headers": {"Content-Type": "application/json", "User-Agent": NOTIFY_USER_AGENT},
+        "body": payload,
+        "timeout": 10,
+        "check": check,
+    }
+
+
+NOTIFICATION_PROVIDERS = {
+    "gotify": _gotify_request,
+    "ntfy": _ntfy_request,
+    "discord": _discord_request,
+    "telegram": _telegram_request,
+}
+
+# ---- 通知HTTP连接池 ----
+notify_connections = {}
+notify_connections_lock = threading.Lock()
+# 空闲超过该秒数的连接不再复用（服务端通常在60秒左右关闭keep-alive连接）
+NOTIFY_CONNECTION_MAX_IDLE = 50
+
+
+def _notify_proxy(scheme: str, host: str):
+    """按HTTP(S)_PROXY环境变量返回 (代理主机, 代理端口, 代理请求头)，不使用代理时返回None
+
+    代理地址中的用户名和密码转换为Proxy-Authorization请求头。
+    """
+    proxy = urllib.request.getproxies().get(scheme)
+    if not proxy or urllib.request.proxy_bypass(host):
+        return None
+    proxy_url = urllib.parse.urlsplit(proxy if "://" in proxy else "http://" + proxy)
+    headers = {}
+    if proxy_url.username is not None:
+        credentials = f"{urllib.parse.unquote(proxy_url.username)}:{urllib.parse.unquote(proxy_url.password or '')}"
+        headers["Proxy-Authorization"] = "Basic " + base64.b64encode(credentials.encode()).decode("ascii")
+    return proxy_url.hostname, proxy_url.port or 8080, headers
+
+
+def _notify_connection(scheme: str, host: str, port: int, timeout: float, proxy=None):
+    """从连接池取出一个到该端点的空闲连接，没有时新建
+
+    HTTPS经代理时通过CONNECT隧道连接；HTTP经代理时直接连接代理，由调用方发送绝对URI。
+    """
+    key = (scheme, host, port)
+    now = time.monotonic()
+    with notify_connections_lock:
+        idle = notify_connections.get(key) or []
+        while idle:
+            conn, last_used = idle.pop()
+            if now - last_used < NOTIFY_CONNECTION_MAX_IDLE:
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+            conn.close()
+
+    if proxy is None:
+        conn_host, conn_port = host, port
+    else:
+        conn_host, conn_port, proxy_headers = proxy
+    if scheme == "https":
+        conn = http.client.HTTPSConnection(conn_host, conn_port, timeout=timeout)
+        if proxy is not None:
+            conn.set_tunnel(host, port, headers=proxy_headers)
+    else:
+        conn = http.client.HTTPConnection(conn_host, conn_port, timeout=timeout)
+    return conn, False
+
+
+def _release_notify_connection(scheme: str, host: str, port: int, conn) -> None:
+    """把仍可复用的连接放回连接池"""
+    with notify_connections_lock:
+        notify_connections.setdefault((scheme, host, port), []).append((conn, time.monotonic()))
+
+
+def _notify_http_post(url: str, body: bytes, headers: dict, timeout: float) -> tuple:
+    """通过池化的keep-alive连接发送POST请求，返回 (状态码, 响应体)
+
+    复用的连接可能已被服务端关闭，此时用新连接重试一次。
+    """
+    parts = urllib.parse.urlsplit(url)
+    scheme = parts.scheme or "http"
+    host = parts.hostname
+    port = parts.port or (443 if scheme == "https" else 80)
+    target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+    headers = dict(headers, **{"Content-Length": str(len(body))})
+    proxy = _notify_proxy(scheme, host)
+    if proxy is not None and scheme == "http":
+        # 普通HTTP代理不建立隧道：请求行使用绝对URI，认证头随请求发送
+        target = urllib.parse.urlunsplit((scheme, parts.netloc.rpartition("@")[2], target, "", ""))
+        headers.update(proxy[2])
+
+    for _ in range(2):
+        conn, reused = _notify_connection(scheme, host, port, timeout, proxy)
+        try:
+            conn.request("POST", target, body=body, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+        except (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if reused:
+                continue
+            raise
+        except Exception:
+            conn.close()
+            raise
+        if resp.will_close:
+            conn.close()
+        else:
+            _release_notify_connection(scheme, host, port, conn)
+        return resp.status, data
+    raise ConnectionError("连接被服务端关闭")
+
+
+def _deliver_notification(provider: str, title: str, message: str, priority: str = "medium") -> dict:
+    """向一个提供商发送通知，返回 {"ok", "retry", "error"}
+
+    提供商被禁用或配置不完整时不重试；网络错误、429和5xx响应可以重试。
+    """
+    notcfg = config.get("notifications", DEFAULT_CONFIG["notifications"])
+    build = NOTIFICATION_PROVIDERS.get(provider)
+    if build is None:
+        log(f"未知的通知提供商 '{provider}'; 跳过通知。")
+        return {"ok": False, "retry": False, "error": "未知的通知提供商"}
+    req = build(notcfg.get(provider, {}), title, message, priority)
+    if req is None:
+        return {"ok": False, "retry": False, "error": "提供商未启用或配置不完整"}
+
+    label = NOTIFY_PROVIDER_LABELS[provider]
     try:
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            result = json.loads(resp.read().decode("utf-8"))
-            if result.get("ok"):
-                log(f"Telegram通知已发送，消息ID={result.get('result', {}).get('message_id', '?')}")
-                return True
-            else:
-                log(f"Telegram API返回ok=false: {result}")
-                return False
+        status, body = _notify_http_post(req["url"], req["body"], req["headers"],
+                                         min(req["timeout"], notify_provider_timeout))
     except Exception as e:
-        log(f"发送Telegram通知失败: {e}")
-        return False
+        log(f"发送{label}通知失败: {e}")
+        return {"ok": False, "retry": True, "error": str(e)}
+    if not 200 <= status < 300:
+        log(f"{label} HTTP错误 {status}。响应体: {body.decode('utf-8', 'replace')[:200]}")
+        return {"ok": False, "retry": status == 429 or status >= 500, "error": f"HTTP {status}"}
+    check = req.get("check")
+    error = None
+    if check is not None:
+        try:
+            error = check(body)
+        except Exception as e:
+            error = f"无法解析{label}响应: {e}"
+    if error:
+        log(error)
+        return {"ok": False, "retry": False, "error": error}
+    log(f"{label}通知已发送，状态={status}")
+    return {"ok": True, "retry": False, "error": None}
+
+
+def notification_targets() -> list:
+    """返回本次通知的目标提供商：send_to_all时为所有已启用的提供商，否则为选择的提供商"""
+    notcfg = config.get("notifications", DEFAULT_CONFIG["notifications"])
+    if notcfg.get("send_to_all"):
+        return [p for p in NOTIFICATION_PROVIDERS if (notcfg.get(p) or {}).get("enabled")]
+    return [(notcfg.get("provider") or "gotify").lower()]
+
+
+def _timed_delivery(provider: str, title: str, message: str, priority: str) -> dict:
+    """发送到一个提供商并在结果中记录耗时"""
+    started = time.monotonic()
+    try:
+        result = _deliver_notification(provider, title, message, priority)
+    except Exception as e:
+        log(f"发送{NOTIFY_PROVIDER_LABELS.get(provider, provider)}通知时出现意外错误: {e}")
+        result = {"ok": False, "retry": True, "error": str(e)}
+    return dict(result, duration=round(time.monotonic() - started, 3))
+
+
+def send_notifications(title: str, message: str, priority: str = "medium") -> dict:
+    """立即并行发送到所有目标提供商（阻塞，不重试；用于测试通知），返回每个提供商的结果
+
+    每个提供商最多等待notify_provider_timeout秒，总耗时接近最慢的提供商而不是所有提供商之和。
+    """
+    targets = notification_targets()
+    if not targets:
+        log("没有已启用的通知提供商; 跳过通知。")
+        return {}
+    if len(targets) == 1:
+        return {targets[0]: _timed_delivery(targets[0], title, message, priority)}
+
+    executor = ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix="prunemate-notify-send")
+    try:
+        futures = {executor.submit(_timed_delivery, p, title, message, priority): p for p in targets}
+        done, _ = wait(list(futures), timeout=notify_provider_timeout + 1)
+        results = {}
+        for future, provider in futures.items():
+            if future in done:
+                results[provider] = future.result()
+            else:
+                log(f"{NOTIFY_PROVIDER_LABELS.get(provider, provider)}通知发送超时（{notify_provider_timeout}秒）。")
+                results[provider] = {"ok": False, "retry": True, "error": "timeout", "duration": notify_provider_timeout}
+        return results
+    finally:
+        executor.shutdown(wait=False)
 
 
 def send_notification(title: str, message: str, priority: str = "medium") -> bool:
-    """使用配置的通知提供商发送通知"""
+    """立即发送通知，至少一个提供商发送成功时返回True"""
+    return any(r["ok"] for r in send_notifications(title, message, priority).values())
+
+
+# ---- 通知后台队列 ----
+notify_pending = []
+notify_condition = threading.Condition()
+# thread负责按到期时间取出通知，executor并行发送（每个提供商一个线程），两者在首次使用时创建
+notify_state = {"thread": None, "executor": None, "seq": 0}
+# 最近的发送结果，供 /api/notifications 查看
+NOTIFY_RESULTS_SIZE = 50
+notify_results = deque(maxlen=NOTIFY_RESULTS_SIZE)
+
+
+def _spool_notification(item: dict) -> None:
+    """把待发送的通知写入磁盘队列（队列长度由_trim_notification_queue限制）"""
+    try:
+        NOTIFY_SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+        path = NOTIFY_SPOOL_DIR / f"{item['id']}.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(item, ensure_ascii=False), encoding="utf-8")
+        try:
+            tmp.chmod(0o600)
+        except Exception:
+            pass
+        tmp.replace(path)
+    except Exception as e:
+        log(f"写入通知队列 {NOTIFY_SPOOL_DIR} 时出错: {e}")
+
+
+def _unspool_notification(item: dict) -> None:
+    """从磁盘队列删除已发送或已放弃的通知"""
+    try:
+        (NOTIFY_SPOOL_DIR / f"{item['id']}.json").unlink(missing_ok=True)
+    except Exception:
+        pass
+
+
+def _trim_notification_queue(incoming: int) -> None:
+    """再加入incoming条通知会超过上限时，丢弃等待中最旧的通知
+
+    丢弃的通知同时从内存和磁盘队列中删除，两者保持一致；正在发送的通知不受影响。
+    """
+    with notify_condition:
+        excess = len(notify_pending) + incoming - MAX_SPOOLED_NOTIFICATIONS
+        if excess <= 0:
+            return
+        dropped = sorted(notify_pending, key=lambda entry: entry[2]["created_at"])[:excess]
+        dropped_ids = {item["id"] for _, _, item in dropped}
+        notify_pending[:] = [entry for entry in notify_pending if entry[2]["id"] not in dropped_ids]
+        heapq.heapify(notify_pending)
+    for _, _, item in dropped:
+        log(f"通知队列已满; 丢弃最旧的通知 {item['id']}。")
+        _unspool_notification(item)
+        inc_metric("prunemate_notifications_total", provider=item["provider"], status="dropped")
+
+
+def _ensure_notification_worker() -> None:
+    """启动通知发送线程（首次使用时，或fork后的新进程中）"""
+    with notify_condition:
+        thread = notify_state["thread"]
+        if thread is not None and thread.is_alive():
+            return
+        thread = threading.Thread(target=_notification_worker, name="prunemate-notify", daemon=True)
+        notify_state["thread"] = thread
+        notify_state["executor"] = ThreadPoolExecutor(
+            max_workers=len(NOTIFICATION_PROVIDERS), thread_name_prefix="prunemate-notify-send",
+        )
+        thread.start()
+
+
+def _schedule_notification(item: dict, due: float) -> None:
+    """把通知放入待发送堆，到期后由发送线程处理"""
+    with notify_condition:
+        notify_state["seq"] += 1
+        heapq.heappush(notify_pending, (due, notify_state["seq"], item))
+        notify_condition.notify()
+
+
+def queue_notification(title: str, message: str, priority: str = "medium", provider: str | None = None) -> list:
+    """把通知加入后台发送队列并立即返回，不阻塞调用方
+
+    不指定provider时，每个目标提供商各排队一条，分别发送和重试。
+    """
+    targets = [provider] if provider else notification_targets()
+    _trim_notification_queue(len(targets))
+    items = []
+    for target in targets:
+        item = {
+            "id": f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}",
+            "provider": target,
+            "title": title,
+            "message": message,
+            "priority": priority,
+            "attempts": 0,
+            "created_at": time.time(),
+        }
+        _spool_notification(item)
+        items.append(item)
+    if items:
+        _ensure_notification_worker()
+    for item in items:
+        _schedule_notification(item, time.monotonic())
+    return items
+
+
+def _notification_worker() -> None:
+    """调度线程：按到期时间取出通知，交给发送线程池并行发送"""
+    while True:
+        with notify_condition:
+            while not notify_pending or notify_pending[0][0] > time.monotonic():
+                timeout = notify_pending[0][0] - time.monotonic() if notify_pending else None
+                notify_condition.wait(timeout)
+            _, _, item = heapq.heappop(notify_pending)
+        notify_state["executor"].submit(_process_notification, item)
+
+
+def _process_notification(item: dict) -> None:
+    """发送一条排队的通知，失败时按指数退避重新排队"""
+    item["attempts"] += 1
+    load_config(silent=True)
+    result = _timed_delivery(item["provider"], item["title"], item["message"], item["priority"])
+
+    label = NOTIFY_PROVIDER_LABELS.get(item["provider"], item["provider"])
+    if result["ok"]:
+        status = "sent"
+        _unspool_notification(item)
+    elif result["retry"] and item["attempts"] < notify_max_attempts:
+        status = "retry"
+        delay = min(NOTIFY_RETRY_MAX, NOTIFY_RETRY_BASE * 2 ** (item["attempts"] - 1))
+        log(f"{label}通知第 {item['attempts']} 次发送失败; {delay}秒后重试。")
+        _spool_notification(item)
+        _schedule_notification(item, time.monotonic() + delay)
+    else:
+        status = "failed"
+        log(f"{label}通知在 {item['attempts']} 次尝试后放弃: {result['error']}")
+        _unspool_notification(item)
+    inc_metric("prunemate_notifications_total", provider=item["provider"], status=status)
+    notify_results.append({
+        "id": item["id"],
+        "provider": item["provider"],
+        "title": item["title"],
+        "status": status,
+        "attempts": item["attempts"],
+        "error": result["error"],
+        "duration": result["duration"],
+        "time": datetime.datetime.now(app_timezone).isoformat(timespec="seconds"),
+    })
+    publish_event("notification", provider=item["provider"], status=status, attempts=item["attempts"],
+                  error=result["error"])
+
+
+def replay_notification_spool() -> None:
+    """启动时重新发送上次退出前未发送成功的通知
+
+    只在Worker进程中（post_fork钩子）调用一次，确保每条通知只由一个进程发送。
+    """
+    try:
+        paths = sorted(NOTIFY_SPOOL_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime)
+    except Exception:
+        return
+    count = 0
+    for path in paths:
+        try:
+            item = json.loads(path.read_text(encoding="utf-8"))
+        except Exception as e:
+            log(f"通知队列文件 {path.name} 无法读取，已删除: {e}")
+            path.unlink(missing_ok=True)
+            continue
+        _trim_notification_queue(1)
+        _schedule_notification(item, time.monotonic())
+        count += 1
+    if count:
+        log(f"从通知队列恢复 {count} 条未发送的通知。")
+        _ensure_notification_worker()
+
+
+# ---- 通知摘要 ----
+# 摘要模式下，每次运行的结果先追加到磁盘上的摘要文件（多个进程共享），窗口结束时合并为
+# 一条按主机和全部主机汇总的通知；有主机失败的运行会立即发送当前摘要。
+digest_state = {"timer": None}
+digest_timer_lock = threading.Lock()
+
+
+def _digest_settings() -> tuple:
+    """返回 (是否启用摘要, 窗口秒数)"""
     notcfg = config.get("notifications", DEFAULT_CONFIG["notifications"])
-    provider = (notcfg.get("provider") or "gotify").lower()
-    if provider == "gotify":
-        return _send_gotify(notcfg.get("gotify", {}), title, message, priority)
-    if provider == "ntfy":
-        return _send_ntfy(notcfg.get("ntfy", {}), title, message, priority)
-    if provider == "discord":
-        return _send_discord(notcfg.get("discord", {}), title, message, priority)
-    if provider == "telegram":
-        return _send_telegram(notcfg.get("telegram", {}), title, message, priority)
-    log(f"未知的通知提供商 '{provider}'; 跳过通知。")
-    return False
+    try:
+        window = max(1, int(notcfg.get("digest_window") or 60))
+    except (ValueError, TypeError):
+        window = 60
+    return bool(notcfg.get("digest_enabled")), window * 60
 
 
-def create_docker_client(host_url: str):
-    """创建Docker客户端实例"""
-    if docker is None:
-        log("Docker SDK不可用。")
-        return None
-    
+def _read_digest() -> dict | None:
+    """读取摘要文件（调用方需持有摘要文件锁）"""
     try:
-        if host_url.startswith("unix://"):
-            return docker.DockerClient(base_url=host_url)
-        elif host_url.startswith("tcp://") or host_url.startswith("http://") or host_url.startswith("https://"):
-            return docker.DockerClient(base_url=host_url)
-        else:
-            return docker.DockerClient(base_url=host_url)
+        return json.loads(NOTIFY_DIGEST_FILE.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
     except Exception as e:
-        log(f"为 {host_url} 创建Docker客户端失败: {e}")
+        log(f"摘要文件 {NOTIFY_DIGEST_FILE} 无法读取，重新开始: {e}")
         return None
 
 
-def get_prune_preview() -> dict:
-    """获取清理预览，不实际执行清理"""
-    load_config(silent=True)
-    
-    if not any([
-        config.get("prune_containers"),
-        config.get("prune_images"),
-        config.get("prune_networks"),
-        config.get("prune_volumes"),
-        config.get("prune_build_cache"),
-    ]):
-        return {"error": "未选择任何清理选项", "hosts": []}
-    
+def _write_digest(digest: dict) -> None:
+    """原子化写入摘要文件（调用方需持有摘要文件锁）"""
+    NOTIFY_DIGEST_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = NOTIFY_DIGEST_FILE.with_suffix(NOTIFY_DIGEST_FILE.suffix + ".tmp")
+    tmp.write_text(json.dumps(digest, ensure_ascii=False), encoding="utf-8")
+    try:
+        tmp.chmod(0o600)
+    except Exception:
+        pass
+    tmp.replace(NOTIFY_DIGEST_FILE)
+
+
+def _arm_digest_timer(delay: float) -> None:
+    """在delay秒后检查并发送摘要；已有等待中的定时器时不重复创建
+
+    从定时器自身的线程调用时（窗口尚未结束，需要重新等待），该定时器即将结束，不算等待中。
+    """
+    with digest_timer_lock:
+        timer = digest_state["timer"]
+        if timer is not None and timer.is_alive() and timer is not threading.current_thread():
+            return
+        timer = threading.Timer(max(0.0, delay), flush_notification_digest, kwargs={"reason": "window"})
+        timer.daemon = True
+        timer.name = "prunemate-digest"
+        digest_state["timer"] = timer
+        timer.start()
+
+
+def add_to_notification_digest(origin: str, host_results: list, urgent: bool = False) -> None:
+    """把一次运行的结果加入摘要；urgent为True（有主机失败）时立即发送摘要"""
+    _, window = _digest_settings()
+    now = time.time()
+    with FileLock(str(NOTIFY_DIGEST_LOCK)):
+        digest = _read_digest() or {"opened_at": now, "runs": []}
+        digest["runs"].append({
+            "origin": origin,
+            "finished_at": now,
+            "hosts": [
+                {"name": r.get("name", "未命名"), "url": r.get("url", ""), "success": bool(r.get("success")),
+                 "error": r.get("error"), **{k: int(r.get(k) or 0) for k in HOST_COUNTER_KEYS}}
+                for r in host_results
+            ],
+        })
+        _write_digest(digest)
+        remaining = digest["opened_at"] + window - now
+    log(f"运行结果已加入通知摘要（{len(digest['runs'])} 次运行）。")
+    if urgent or remaining <= 0:
+        flush_notification_digest(reason="failure" if urgent else "window")
+    else:
+        _arm_digest_timer(remaining)
+
+
+def _format_digest(digest: dict) -> str:
+    """把摘要中的所有运行合并为按主机和全部主机汇总的通知正文"""
+    runs = digest["runs"]
+    hosts = {}
+    for run in runs:
+        for h in run["hosts"]:
+            entry = hosts.setdefault(h["url"] or h["name"], {
+                "name": h["name"], "runs": 0, "failures": 0, "error": None,
+                **{k: 0 for k in HOST_COUNTER_KEYS},
+            })
+            entry["name"] = h["name"]
+            entry["runs"] += 1
+            for k in HOST_COUNTER_KEYS:
+                entry[k] += h[k]
+            if not h["success"]:
+                entry["failures"] += 1
+                entry["error"] = h["error"]
+    totals = {k: sum(e[k] for e in hosts.values()) for k in HOST_COUNTER_KEYS}
+
+    origins = {}
+    for run in runs:
+        origins[run["origin"]] = origins.get(run["origin"], 0) + 1
+    start = datetime.datetime.fromtimestamp(digest["opened_at"], app_timezone)
+    end = datetime.datetime.fromtimestamp(runs[-1]["finished_at"], app_timezone)
+    lines = [
+        f"🕒 {format_time(start.strftime('%H:%M'))} – {format_time(end.strftime('%H:%M'))} 共 {len(runs)} 次运行"
+        f"（{', '.join(f'{o} {n}' for o, n in origins.items())}）",
+        "",
+        "📊 按主机统计结果:",
+    ]
+    for entry in hosts.values():
+        runs_text = f"{entry['runs']} 次运行" + (f"，❌ {entry['failures']} 次失败" if entry["failures"] else "")
+        deletions = _deletion_lines(entry)
+        if deletions:
+            lines.append(f"• {entry['name']}（{runs_text}）")
+            lines.extend(deletions)
+            if entry["failures"]:
+                lines.append(f"  - 最近错误: {entry['error'] or '未知错误'}")
+        elif entry["failures"]:
+            lines.append(f"• {entry['name']}（{runs_text}）: {entry['error'] or '未知错误'}")
+        else:
+            lines.append(f"• {entry['name']}（{runs_text}）: ✅ 无资源需要清理")
+    lines.append("")
+    lines.append("📈 所有主机总计:")
+    lines.extend(_fleet_total_lines(totals) or ["✅ 本窗口内无资源需要清理"])
+    return "\n".join(lines)
+
+
+def flush_notification_digest(reason: str = "window") -> bool:
+    """发送并清空当前摘要；窗口未到期（reason为window时）或摘要为空时不发送"""
+    enabled, window = _digest_settings()
+    with FileLock(str(NOTIFY_DIGEST_LOCK)):
+        digest = _read_digest()
+        if digest is None or not digest.get("runs"):
+            return False
+        remaining = digest["opened_at"] + window - time.time()
+        if reason == "window" and enabled and remaining > 0:
+            # 其他进程已发送并重新开始了摘要
+            _arm_digest_timer(remaining)
+            return False
+        try:
+            NOTIFY_DIGEST_FILE.unlink()
+        except FileNotFoundError:
+            pass
+
+    failed = any(not h["success"] for run in digest["runs"] for h in run["hosts"])
+    notcfg = config.get("notifications", DEFAULT_CONFIG["notifications"])
+    priority = "high" if failed else notcfg.get("priority", "medium")
+    title = "PruneMate 清理摘要" + ("（有主机失败）" if failed else "")
+    log(f"发送通知摘要: {len(digest['runs'])} 次运行（{reason}）。")
+    queue_notification(title, _format_digest(digest), priority=priority)
+    return True
+
+
+def resume_notification_digest() -> None:
+    """启动时为上次退出前未发送的摘要重新设置定时器"""
+    with FileLock(str(NOTIFY_DIGEST_LOCK)):
+        digest = _read_digest()
+    if digest and digest.get("runs"):
+        _, window = _digest_settings()
+        _arm_digest_timer(digest["opened_at"] + window - time.time())
+
+
+# ---- Docker API调用追踪 ----
+# 每个Docker客户端的requests传输层被包装：当前线程处于追踪范围内时，记录每次调用的
+# 方法、路径、状态码、响应字节数和耗时。不在追踪范围内时只多一次线程局部变量读取。
+api_trace_local = threading.local()
+# 单次追踪最多保留的调用数，超出部分只计数
+MAX_TRACE_CALLS = 20000
+# 最近一次预览的追踪记录（预览不写入运行历史）
+last_preview_trace = {"value": None}
+_API_VERSION_PREFIX = re.compile(r"^/v[0-9.]+(?=/)")
+_API_PATH_ID = re.compile(r"/(?:sha256:)?[0-9a-f]{12,64}(?=/|$)")
+
+
+def new_api_trace() -> dict:
+    """创建一个空的追踪记录"""
+    return {"started_at": time.time(), "origin": time.monotonic(), "calls": [], "spans": [], "dropped": 0}
+
+
+@contextlib.contextmanager
+def api_trace_span(trace: dict | None, host: str, phase: str | None = None):
+    """在当前线程中把Docker API调用归入 (主机, 阶段)，结束时记录该阶段的时间段"""
+    if trace is None:
+        yield
+        return
+    previous = getattr(api_trace_local, "scope", None)
+    api_trace_local.scope = (trace, host, phase)
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        api_trace_local.scope = previous
+        trace["spans"].append({
+            "host": host,
+            "phase": phase,
+            "start": round(started - trace["origin"], 6),
+            "duration": round(time.monotonic() - started, 6),
+        })
+
+
+def _trace_docker_transport(client) -> None:
+    """包装客户端的requests会话send()，在追踪范围内记录每次调用"""
+    send = client.api.send
+
+    def traced_send(prepared, **kwargs):
+        scope = getattr(api_trace_local, "scope", None)
+        if scope is None:
+            return send(prepared, **kwargs)
+        trace, host, phase = scope
+        started = time.monotonic()
+        status = size = error = None
+        try:
+            response = send(prepared, **kwargs)
+            status = response.status_code
+            # 非流式响应在send()返回前已读完，流式响应（日志、事件）只能取Content-Length
+            if kwargs.get("stream"):
+                size = int(response.headers.get("Content-Length") or 0) or None
+            else:
+                size = len(response.content or b"")
+            return response
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if len(trace["calls"]) < MAX_TRACE_CALLS:
+                path = urllib.parse.urlsplit(prepared.url).path
+                trace["calls"].append({
+                    "host": host,
+                    "phase": phase,
+                    "method": prepared.method,
+                    "path": _API_VERSION_PREFIX.sub("", path),
+                    "status": status,
+                    "bytes": size,
+                    "start": round(started - trace["origin"], 6),
+                    "duration": round(time.monotonic() - started, 6),
+                    "error": error,
+                })
+            else:
+                trace["dropped"] += 1
+
+    client.api.send = traced_send
+
+
+def export_api_trace(trace: dict) -> dict:
+    """返回可序列化的追踪记录，附带按 (主机, 阶段, 方法, 路径模板) 汇总的耗时"""
+    summary = {}
+    for call in trace["calls"]:
+        key = (call["host"], call["phase"], call["method"], _API_PATH_ID.sub("/{id}", call["path"]))
+        entry = summary.setdefault(key, {"calls": 0, "seconds": 0.0, "bytes": 0, "errors": 0})
+        entry["calls"] += 1
+        entry["seconds"] += call["duration"]
+        entry["bytes"] += call["bytes"] or 0
+        if call["error"] or (call["status"] or 0) >= 400:
+            entry["errors"] += 1
+    return {
+        "started_at": trace["started_at"],
+        "calls": list(trace["calls"]),
+        "spans": list(trace["spans"]),
+        "dropped": trace["dropped"],
+        "summary": sorted(
+            (
+                {"host": k[0], "phase": k[1], "method": k[2], "path": k[3], **v, "seconds": round(v["seconds"], 6)}
+                for k, v in summary.items()
+            ),
+            key=lambda e: e["seconds"], reverse=True,
+        ),
+    }
+
+
+def api_trace_flame(trace: dict) -> dict:
+    """把追踪记录转换为Chrome Trace Event格式（可在Perfetto、speedscope或chrome://tracing中以火焰图查看）
+
+    每个主机一条轨道：主机和阶段为外层时间段，Docker API调用嵌套在其中。
+    """
+    hosts = []
+    for item in trace["spans"] + trace["calls"]:
+        if item["host"] not in hosts:
+            hosts.append(item["host"])
+    events = [
+        {"name": "thread_name", "ph": "M", "pid": 1, "tid": i + 1, "args": {"name": host}}
+        for i, host in enumerate(hosts)
+    ]
+    for span in trace["spans"]:
+        events.append({
+            "name": span["phase"] or span["host"],
+            "cat": "phase" if span["phase"] else "host",
+            "ph": "X",
+            "pid": 1,
+            "tid": hosts.index(span["host"]) + 1,
+            "ts": round(span["start"] * 1e6),
+            "dur": round(span["duration"] * 1e6),
+        })
+    for call in trace["calls"]:
+        events.append({
+            "name": f"{call['method']} {_API_PATH_ID.sub('/{id}', call['path'])}",
+            "cat": "docker_api",
+            "ph": "X",
+            "pid": 1,
+            "tid": hosts.index(call["host"]) + 1,
+            "ts": round(call["start"] * 1e6),
+            "dur": round(call["duration"] * 1e6),
+            "args": {k: call[k] for k in ("path", "status", "bytes", "error", "phase")},
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"started_at": trace["started_at"]}}
+
+
+def log_api_trace_summary(trace: dict, top: int = 5) -> None:
+    """在日志中输出一次运行的Docker API调用总数和耗时最多的调用类型"""
+    summary = export_api_trace(trace)["summary"]
+    total = sum(e["calls"] for e in summary) + trace["dropped"]
+    seconds = sum(e["seconds"] for e in summary)
+    log(f"Docker API调用: {total} 次，合计 {seconds:.2f} 秒")
+    for e in summary[:top]:
+        log(f"  [{e['host']}] {e['phase'] or '-'} {e['method']} {e['path']}: "
+            f"{e['calls']} 次，{e['seconds']:.2f} 秒，{human_bytes(e['bytes'])}")
+
+
+def create_docker_client(host_url: str):
+    """创建Docker客户端实例"""
     if docker is None:
-        return {"error": "Docker SDK不可用", "hosts": []}
+        log("Docker SDK不可用。")
+        return None
     
-    docker_hosts = config.get("docker_hosts", [])
-    enabled_external_hosts = [
-        h for h in docker_hosts 
-        if h.get("enabled", True) and h.get("name") != "Local" and "unix://" not in h.get("url", "")
-    ]
+    try:
+        if host_url.startswith("unix://"):
+            client = docker.DockerClient(base_url=host_url)
+        elif host_url.startswith("tcp://") or host_url.startswith("http://") or host_url.startswith("https://"):
+            client = docker.DockerClient(base_url=host_url)
+        else:
+            client = docker.DockerClient(base_url=host_url)
+        _trace_docker_transport(client)
+        return client
+    except Exception as e:
+        log(f"为 {host_url} 创建Docker客户端失败: {e}")
+        return None
+
+
+# ---- Docker客户端连接池 ----
+# 按主机URL复用DockerClient：避免每次预览/清理都重新协商API版本、
+# 建立TCP/TLS连接和创建requests会话
+docker_clients = {}
+# 已移出连接池但仍被租用的客户端，按id(client)索引，最后一个持有者归还时关闭
+retired_docker_clients = {}
+docker_clients_lock = threading.Lock()
+# 空闲超过该秒数的客户端在取用前和后台检查时先ping一次
+DOCKER_CLIENT_PING_AFTER = 60
+# 空闲超过该秒数的客户端由后台检查关闭
+DOCKER_CLIENT_MAX_IDLE = 1800
+
+
+def _close_docker_client(client) -> None:
+    """关闭Docker客户端，忽略错误"""
+    try:
+        client.close()
+    except Exception:
+        pass
+
+
+def _ping_docker_client(client) -> bool:
+    """检查客户端的连接是否仍然可用"""
+    try:
+        return bool(client.ping())
+    except Exception:
+        return False
+
+
+def get_docker_client(host_url: str):
+    """从连接池租用主机的Docker客户端，不存在或已失效时新建
+
+    返回的客户端由连接池持有，调用方不应关闭它，用完后必须调用
+    release_docker_client归还；如果使用过程中发现连接已损坏，
+    应调用discard_docker_client将其移出连接池（之后仍需归还）。
+    """
+    with docker_clients_lock:
+        entry = docker_clients.get(host_url)
+        if entry is not None:
+            # 先计入租用，ping期间不会被其他线程关闭
+            entry["leases"] += 1
+
+    if entry is not None:
+        if time.monotonic() - entry["last_used"] < DOCKER_CLIENT_PING_AFTER or _ping_docker_client(entry["client"]):
+            entry["last_used"] = time.monotonic()
+            return entry["client"]
+        log(f"{host_url} 的Docker客户端已失效; 重新连接。")
+        discard_docker_client(host_url, entry["client"], leased=True)
+        release_docker_client(host_url, entry["client"])
+
+    client = create_docker_client(host_url)
+    if client is None:
+        return None
+
+    with docker_clients_lock:
+        entry = docker_clients.get(host_url)
+        if entry is None:
+            docker_clients[host_url] = {"client": client, "last_used": time.monotonic(), "leases": 1}
+            return client
+        # 其他线程已经创建了该主机的客户端，使用已有的那个
+        entry["last_used"] = time.monotonic()
+        entry["leases"] += 1
+        existing = entry["client"]
+    _close_docker_client(client)
+    return existing
+
+
+def release_docker_client(host_url: str, client) -> None:
+    """归还get_docker_client租用的客户端
+
+    已被移出连接池的客户端在最后一个持有者归还时关闭。
+    """
+    if client is None:
+        return
+    with docker_clients_lock:
+        entry = docker_clients.get(host_url)
+        if entry is not None and entry["client"] is client:
+            entry["leases"] = max(0, entry["leases"] - 1)
+            entry["last_used"] = time.monotonic()
+            return
+        entry = retired_docker_clients.get(id(client))
+        if entry is None:
+            return
+        entry["leases"] -= 1
+        if entry["leases"] > 0:
+            return
+        del retired_docker_clients[id(client)]
+    _close_docker_client(client)
+
+
+def discard_docker_client(host_url: str, client=None, leased: bool = False) -> None:
+    """把主机的客户端移出连接池，之后的调用方会重新连接
+
+    传入client时，仅当连接池中仍是该客户端时才移除，避免误删已替换的新客户端。
+    客户端只在没有其他持有者时立即关闭，否则由最后一个持有者归还时关闭，
+    不会中断同一主机上其他预览或清理正在进行的请求。leased为True表示其中一次
+    租用属于调用方自己（或被放弃的主机线程），这次租用不计为其他持有者。
+    """
+    with docker_clients_lock:
+        entry = docker_clients.get(host_url)
+        if entry is not None and (client is None or entry["client"] is client):
+            del docker_clients[host_url]
+        elif client is not None:
+            # 已经移出连接池的客户端，或不在连接池中的客户端
+            entry = retired_docker_clients.pop(id(client), None) or {"client": client, "leases": 0}
+        else:
+            return
+        others = entry["leases"] - (1 if leased else 0)
+        if others > 0:
+            retired_docker_clients[id(entry["client"])] = entry
+            return
+    _close_docker_client(entry["client"])
+
+
+def _configured_host_urls() -> set:
+    """返回当前配置中所有已启用主机的URL（包括本地主机）"""
+    urls = {"unix:///var/run/docker.sock"}
+    for h in config.get("docker_hosts", []):
+        if h.get("enabled", True) and h.get("url"):
+            urls.add(h["url"])
+    return urls
+
+
+def sync_docker_client_pool() -> None:
+    """关闭已删除、已禁用或URL已修改的主机的客户端"""
+    valid_urls = _configured_host_urls()
+    with docker_clients_lock:
+        stale = [url for url in docker_clients if url not in valid_urls]
+    for url in stale:
+        log(f"主机 {url} 已不在配置中; 关闭其Docker客户端。")
+        discard_docker_client(url)
+
+
+def check_docker_clients() -> None:
+    """后台健康检查：ping空闲的客户端，移除失效或长时间未使用的客户端"""
+    load_config(silent=True)
+    sync_docker_client_pool()
+    sync_inventory_watchers()
+
+    now = time.monotonic()
+    with docker_clients_lock:
+        entries = list(docker_clients.items())
+    for url, entry in entries:
+        idle = now - entry["last_used"]
+        if idle >= DOCKER_CLIENT_MAX_IDLE and entry["leases"] == 0:
+            discard_docker_client(url, entry["client"])
+        elif idle >= DOCKER_CLIENT_PING_AFTER and not _ping_docker_client(entry["client"]):
+            log(f"{url} 的Docker客户端健康检查失败; 已移出连接池。")
+            discard_docker_client(url, entry["client"])
+
+
+def _run_per_host(all_hosts: list, worker, on_failure, timeout: int, on_result=None) -> list:
+    """在有界线程池中并发处理所有主机，按原主机顺序返回结果
+
+    worker(host, holder) 负责单个主机的全部工作，并应把租用的客户端放入
+    holder["client"]。超时从该主机实际开始执行时计算；超时后将其客户端
+    移出连接池（没有其他调用方使用时立即关闭，以中断正在进行的请求），并用 on_failure(host, "timeout") 生成该主机的结果；
+    worker抛出的异常同样交给 on_failure(host, str(e)) 处理。
+    传入on_result时，每个主机得到结果后立即调用 on_result(index, result)。
+    """
+    if not all_hosts:
+        return []
+
+    results = [None] * len(all_hosts)
+    holders = [{} for _ in all_hosts]
+
+    def task(index, host):
+        holders[index]["index"] = index
+        holders[index]["started"] = time.monotonic()
+        return worker(host, holders[index])
+
+    executor = ThreadPoolExecutor(
+        max_workers=min(max_host_workers, len(all_hosts)),
+        thread_name_prefix="prunemate-host",
+    )
+    try:
+        pending = {executor.submit(task, i, host): i for i, host in enumerate(all_hosts)}
+        while pending:
+            now = time.monotonic()
+            deadlines = [
+                holders[i]["started"] + timeout
+                for i in pending.values() if "started" in holders[i]
+            ]
+            wait_for = max(0.0, min(deadlines) - now) if deadlines else 1.0
+            done, _ = wait(list(pending), timeout=min(wait_for, 1.0), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                i = pending.pop(future)
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    host_name = all_hosts[i].get("name", "未命名")
+                    log(f"[{host_name}] 处理主机时出现意外错误: {e}")
+                    results[i] = on_failure(all_hosts[i], str(e))
+                if on_result is not None:
+                    on_result(i, results[i])
+
+            now = time.monotonic()
+            for future, i in list(pending.items()):
+                started = holders[i].get("started")
+                if started is None or now - started < timeout:
+                    continue
+                pending.pop(future)
+                future.cancel()
+                host_name = all_hosts[i].get("name", "未命名")
+                log(f"[{host_name}] 处理超时（{timeout}秒）; 放弃此主机。")
+                client = holders[i].get("client")
+                if client is not None:
+                    # 让下次使用时重新连接；没有其他调用方在使用该客户端时立即关闭它，以中断仍在进行的请求
+                    discard_docker_client(all_hosts[i].get("url", "unix:///var/run/docker.sock"), client, leased=True)
+                results[i] = on_failure(all_hosts[i], "timeout")
+                if on_result is not None:
+                    on_result(i, results[i])
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results
+
+
+def _short_id(resource_id: str) -> str:
+    """生成与Docker SDK模型一致的短ID"""
+    resource_id = resource_id or ""
+    if resource_id.startswith("sha256:"):
+        return resource_id[:17]
+    return resource_id[:12]
+
+
+def _list_host_inventory(client, options: dict, host_name: str) -> dict:
+    """为单个主机获取一次资源快照（容器、镜像、网络、卷），供所有预览类别共用
+
+    直接使用list端点返回的原始字典，而不是SDK模型对象：SDK的
+    containers.list()/images.list()会对每个资源再发一次inspect请求，
+    这里每类资源只需一次HTTP请求。列出失败的类别为None，依赖它的
+    预览类别会被跳过。
+    """
+    inventory = {"containers": None, "images": None, "networks": None, "volumes": None}
     
-    all_hosts = [
-        {"name": "本地", "url": "unix:///var/run/docker.sock", "enabled": True}
-    ] + enabled_external_hosts
+    if any(options.get(k) for k in ("prune_containers", "prune_images", "prune_networks", "prune_volumes")):
+        try:
+            inventory["containers"] = client.api.containers(all=True) or []
+        except Exception as e:
+            log(f"[{host_name}] 列出容器时出错: {e}")
+            inc_metric("prunemate_docker_api_errors_total", host=host_name, operation="list_containers")
+    
+    if options.get("prune_images"):
+        try:
+            inventory["images"] = _list_images(client)
+        except Exception as e:
+            log(f"[{host_name}] 列出镜像时出错: {e}")
+            inc_metric("prunemate_docker_api_errors_total", host=host_name, operation="list_images")
     
-    preview_results = []
-    total_containers = 0
-    total_images = 0
-    total_networks = 0
-    total_volumes = 0
-    total_build_cache = 0
+    if options.get("prune_networks"):
+        try:
+            inventory["networks"] = client.api.networks() or []
+        except Exception as e:
+            log(f"[{host_name}] 列出网络时出错: {e}")
+            inc_metric("prunemate_docker_api_errors_total", host=host_name, operation="list_networks")
     
-    for host in all_hosts:
-        host_name = host.get("name", "未命名")
-        host_url = host.get("url", "unix:///var/run/docker.sock")
-        
-        client = None
+    if options.get("prune_volumes"):
+        try:
+            inventory["volumes"] = (client.api.volumes() or {}).get("Volumes") or []
+        except Exception as e:
+            log(f"[{host_name}] 列出卷时出错: {e}")
+            inc_metric("prunemate_docker_api_errors_total", host=host_name, operation="list_volumes")
+    
+    return inventory
+
+
+# /images/json的shared-size参数从API 1.42开始提供
+SHARED_SIZE_API_VERSION = "1.42"
+
+
+def _list_images(client) -> list:
+    """列出镜像；守护进程支持时让Docker同时计算每个镜像的SharedSize
+
+    SDK的images()不支持shared-size参数，不带该参数时SharedSize恒为-1。
+    这里是唯一直接使用SDK内部请求方法的地方：API版本低于1.42，或SDK
+    内部接口发生变化时，回退到公开的images()（此时SharedSize未知，估算按镜像完整大小计算）。
+    """
+    api = client.api
+    try:
+        if docker.utils.version_gte(api.api_version, SHARED_SIZE_API_VERSION):
+            return api._result(api._get(api._url("/images/json"), params={"shared-size": 1}), True) or []
+    except (AttributeError, TypeError) as e:
+        log(f"SDK不支持带shared-size列出镜像，改用images(): {e}")
+    return api.images() or []
+
+
+# ---- 可回收空间估算 ----
+# 镜像ID → RootFS层列表；镜像内容不可变，按ID缓存，只有新镜像才需要inspect
+image_layers_cache = {}
+image_layers_lock = threading.Lock()
+IMAGE_LAYERS_CACHE_SIZE = 5000
+
+
+def _image_layers(client, image_id: str) -> tuple | None:
+    """返回镜像的RootFS层；未缓存且没有客户端时返回None"""
+    with image_layers_lock:
+        layers = image_layers_cache.get(image_id)
+    if layers is not None or client is None:
+        return layers
+    layers = tuple((client.api.inspect_image(image_id).get("RootFS") or {}).get("Layers") or [])
+    with image_layers_lock:
+        if len(image_layers_cache) >= IMAGE_LAYERS_CACHE_SIZE:
+            image_layers_cache.clear()
+        image_layers_cache[image_id] = layers
+    return layers
+
+
+def _in_use_image_ids(images: list, used_ids: set) -> set:
+    """返回正在使用的镜像及其所有父镜像（沿ParentId链），这些镜像都不会被清理"""
+    parents = {img.get("Id"): img.get("ParentId") for img in images}
+    keep = set()
+    for image_id in used_ids:
+        while image_id and image_id not in keep:
+            keep.add(image_id)
+            image_id = parents.get(image_id)
+    return keep
+
+
+def estimate_image_reclaim(client, images: list, removed_ids: set) -> int:
+    """估算删除removed_ids中的镜像后实际释放的字节数
+
+    默认只使用列表中已有的Size和SharedSize，不额外请求Docker：镜像独有的
+    部分（Size - SharedSize）一定会被释放；保留的镜像都没有共享层时，被删除
+    镜像的共享层也会全部释放，其总大小至少为其中最大的SharedSize。保留的镜像
+    也有共享层时无法从列表判断归属，只计算独有部分（保守下限）。
+    启用PRUNEMATE_LAYER_ESTIMATE后，这种情况再按镜像层精确估算。
+    """
+    unique = 0
+    removed_shared = 0
+    kept_shared = False
+    for img in images:
+        shared = int(img.get("SharedSize") or 0)
+        if img.get("Id") not in removed_ids:
+            kept_shared = kept_shared or shared > 0
+            continue
+        size = int(img.get("Size") or 0)
+        unique += max(0, size - max(0, shared))
+        removed_shared = max(removed_shared, shared)
+    if removed_shared <= 0:
+        return unique
+    if not kept_shared:
+        return unique + removed_shared
+    if not layer_estimate_enabled:
+        return unique
+    return unique + _estimate_shared_layer_reclaim(client, images, removed_ids)
+
+
+def _estimate_shared_layer_reclaim(client, images: list, removed_ids: set) -> int:
+    """按镜像层估算被删除镜像的共享层中会释放的字节数
+
+    Docker不提供单层大小，因此把每个镜像的SharedSize平均分摊到它的共享层上，
+    并取各镜像分摊值中的最小值。每个有共享层的镜像首次出现时需要inspect一次
+    （按ID缓存）；缺少层信息时返回0。
+    """
+    sharing = [img for img in images if int(img.get("SharedSize") or 0) > 0]
+    image_layers = {}
+    layer_holders = {}
+    try:
+        for img in sharing:
+            layers = _image_layers(client, img.get("Id"))
+            if layers is None:
+                return 0
+            image_layers[img.get("Id")] = layers
+            for layer in layers:
+                layer_holders.setdefault(layer, set()).add(img.get("Id"))
+    except Exception as e:
+        log(f"读取镜像层信息时出错，仅计算独有部分: {e}")
+        return 0
+
+    layer_size = {}
+    for img in sharing:
+        shared_layers = [layer for layer in image_layers[img.get("Id")] if len(layer_holders[layer]) > 1]
+        if not shared_layers:
+            continue
+        per_layer = int(img.get("SharedSize")) / len(shared_layers)
+        for layer in shared_layers:
+            layer_size[layer] = min(layer_size.get(layer, per_layer), per_layer)
+    return int(sum(size for layer, size in layer_size.items() if layer_holders[layer] <= removed_ids))
+
+
+def _use_df_preview(options: dict) -> bool:
+    """选择了多个可由/system/df提供的类别时，改用一次df请求生成预览"""
+    selected = [k for k in ("prune_containers", "prune_images", "prune_volumes", "prune_build_cache") if options.get(k)]
+    return len(selected) > 1
+
+
+def _df_host_inventory(client, options: dict, host_name: str, live: tuple | None = None) -> tuple:
+    """通过一次/system/df请求获取容器、镜像、卷和构建缓存的快照
+
+    df返回的容器带有SizeRw，卷带有UsageData.Size，因此预览可以显示真实大小。
+    df不包含网络：有实时索引时从索引读取，否则单独列出。
+    返回 (inventory, df_result)。
+    """
+    df_result = client.api.df() or {}
+    inventory = {
+        "containers": df_result.get("Containers") or [],
+        "images": df_result.get("Images") or [],
+        "networks": None,
+        "volumes": df_result.get("Volumes") or [],
+    }
+    if options.get("prune_networks"):
+        if live is not None:
+            inventory["networks"] = live[0]["networks"]
+        else:
+            try:
+                inventory["networks"] = client.api.networks() or []
+            except Exception as e:
+                log(f"[{host_name}] 列出网络时出错: {e}")
+    return inventory, df_result
+
+
+def _container_refs(container: dict) -> tuple:
+    """返回容器引用的镜像ID、卷名集合和网络ID集合
+
+    镜像和卷被任意容器（包括已停止的）引用即视为使用中；
+    网络仅在被运行中的容器连接时视为使用中，与Docker的prune行为一致。
+    """
+    volume_names = {
+        mount.get("Name") for mount in container.get("Mounts") or []
+        if mount.get("Type") == "volume" and mount.get("Name")
+    }
+    network_ids = set()
+    if container.get("State") == "running":
+        networks = (container.get("NetworkSettings") or {}).get("Networks") or {}
+        for net_info in networks.values():
+            if net_info.get("NetworkID"):
+                network_ids.add(net_info["NetworkID"])
+    return container.get("ImageID"), volume_names, network_ids
+
+
+def _index_container_usage(containers: list) -> dict:
+    """单次遍历容器列表，建立已使用的镜像、卷和网络索引"""
+    image_ids = set()
+    volume_names = set()
+    network_ids = set()
+    for container in containers:
+        img_id, volumes, networks = _container_refs(container)
+        if img_id:
+            image_ids.add(img_id)
+        volume_names |= volumes
+        network_ids |= networks
+    return {"image_ids": image_ids, "volume_names": volume_names, "network_ids": network_ids}
+
+
+# ---- 实时资源索引 ----
+# 每个主机一个后台线程订阅Docker /events，在内存中维护容器、镜像、网络和卷的索引，
+# 以及镜像/卷/网络 → 容器的引用计数。预览直接读取仍然有效的索引，不再重新列出资源；
+# 事件流断开时索引标记为失效，重连后完整重新同步。
+host_inventories = {}
+host_inventories_lock = threading.Lock()
+inventory_state = {"active": False}
+# 事件流断开后重连的退避时间（秒）
+INVENTORY_RETRY_MIN = 5
+INVENTORY_RETRY_MAX = 120
+# 需要重新读取容器信息的容器事件（状态、挂载或名称可能变化）
+CONTAINER_REFRESH_ACTIONS = {"create", "start", "die", "pause", "unpause", "rename", "update"}
+# 需要重新列出镜像的镜像事件（事件ID是镜像引用，或新镜像尚不在索引中）；untag和delete增量处理
+IMAGE_REFRESH_ACTIONS = {"pull", "tag", "import", "load"}
+# 最后一条镜像事件之后等待的秒数，同一批拉取/导入事件只重新列出一次镜像
+IMAGE_RELIST_DELAY = 1.0
+
+
+def _new_host_inventory(host_url: str) -> dict:
+    """创建空的（尚未同步的）主机资源索引"""
+    return {
+        "url": host_url,
+        "valid": False,
+        "synced_at": None,
+        "stale_since": time.time(),
+        "error": None,
+        "containers": {},
+        "images": {},
+        "networks": {},
+        "volumes": {},
+        "image_refs": {},
+        "volume_refs": {},
+        "network_refs": {},
+        # 镜像事件之后、重新列出镜像之前，索引中的镜像不可用，预览回退到直接列出
+        "images_pending": False,
+        # 需要重新列出镜像的事件计数和计划的列出时间（monotonic），由_inventory_relist_images处理
+        "image_events": 0,
+        "relist_due": None,
+        "lock": threading.Lock(),
+        "stop": threading.Event(),
+        "stream": None,
+        "thread": None,
+    }
+
+
+def _inventory_drop_container(inv: dict, container_id: str) -> None:
+    """从索引中移除容器及其引用（调用方需持有inv["lock"]）"""
+    old = inv["containers"].pop(container_id, None)
+    if old is None:
+        return
+    img_id, volumes, networks = _container_refs(old)
+    for refs, keys in ((inv["image_refs"], [img_id] if img_id else []),
+                       (inv["volume_refs"], volumes),
+                       (inv["network_refs"], networks)):
+        for key in keys:
+            holders = refs.get(key)
+            if holders is not None:
+                holders.discard(container_id)
+                if not holders:
+                    del refs[key]
+
+
+def _inventory_put_container(inv: dict, container: dict) -> None:
+    """新增或替换索引中的容器并更新引用计数（调用方需持有inv["lock"]）"""
+    container_id = container.get("Id")
+    _inventory_drop_container(inv, container_id)
+    inv["containers"][container_id] = container
+    img_id, volumes, networks = _container_refs(container)
+    if img_id:
+        inv["image_refs"].setdefault(img_id, set()).add(container_id)
+    for name in volumes:
+        inv["volume_refs"].setdefault(name, set()).add(container_id)
+    for network_id in networks:
+        inv["network_refs"].setdefault(network_id, set()).add(container_id)
+
+
+def _inventory_resync(inv: dict, client) -> None:
+    """完整列出主机上的所有资源并重建索引"""
+    containers = client.api.containers(all=True) or []
+    images = _list_images(client)
+    networks = client.api.networks() or []
+    volumes = (client.api.volumes() or {}).get("Volumes") or []
+    with inv["lock"]:
+        inv["containers"] = {}
+        inv["image_refs"] = {}
+        inv["volume_refs"] = {}
+        inv["network_refs"] = {}
+        for container in containers:
+            _inventory_put_container(inv, container)
+        inv["images"] = {img.get("Id"): img for img in images}
+        inv["images_pending"] = False
+        inv["networks"] = {net.get("Id"): net for net in networks}
+        inv["volumes"] = {vol.get("Name"): vol for vol in volumes}
+        inv["valid"] = True
+        inv["synced_at"] = time.time()
+        inv["stale_since"] = None
+        inv["error"] = None
+
+
+def _inventory_refresh_container(inv: dict, client, container_id: str | None) -> None:
+    """重新读取单个容器（已删除时从索引移除）"""
+    if not container_id:
+        return
+    found = [
+        c for c in client.api.containers(all=True, filters={"id": container_id}) or []
+        if c.get("Id") == container_id
+    ]
+    with inv["lock"]:
+        if found:
+            _inventory_put_container(inv, found[0])
+        else:
+            _inventory_drop_container(inv, container_id)
+
+
+def _inventory_untag_image(inv: dict, image_id: str | None, ref: str | None) -> None:
+    """从索引中的镜像移除一个引用；引用为镜像ID时表示移除所有引用（调用方需持有inv["lock"]）"""
+    image = inv["images"].get(image_id)
+    if image is None:
+        return
+    if not ref or ref == image_id:
+        tags, digests = [], []
+    else:
+        tags = [t for t in image.get("RepoTags") or [] if t != ref]
+        digests = [d for d in image.get("RepoDigests") or [] if d != ref]
+    # 替换而不是修改原字典，已经交给预览的快照不受影响
+    inv["images"][image_id] = {**image, "RepoTags": tags, "RepoDigests": digests}
+
+
+def _inventory_schedule_image_relist(inv: dict) -> None:
+    """在镜像事件停止IMAGE_RELIST_DELAY秒后重新列出一次镜像，期间索引中的镜像不可用"""
+    with inv["lock"]:
+        inv["images_pending"] = True
+        inv["image_events"] += 1
+        start = inv["relist_due"] is None
+        inv["relist_due"] = time.monotonic() + IMAGE_RELIST_DELAY
+    if start:
+        threading.Thread(target=_inventory_relist_images, args=(inv,), name="prunemate-images", daemon=True).start()
+
+
+def _inventory_relist_images(inv: dict) -> None:
+    """后台线程：等到镜像事件平静下来，用连接池中的客户端重新列出镜像"""
+    while True:
+        with inv["lock"]:
+            wait_for = inv["relist_due"] - time.monotonic()
+            if wait_for <= 0:
+                inv["relist_due"] = None
+                events_seen = inv["image_events"]
+        if wait_for > 0:
+            if inv["stop"].wait(wait_for):
+                return
+            continue
+
+        client = get_docker_client(inv["url"])
         try:
-            client = create_docker_client(host_url)
             if client is None:
-                preview_results.append({
-                    "name": host_name,
-                    "url": host_url,
-                    "success": False,
-                    "error": "连接失败",
-                    "containers": [],
-                    "images": [],
-                    "networks": [],
-                    "volumes": [],
-                    "build_cache": []
-                })
+                raise RuntimeError("连接失败")
+            images = _list_images(client)
+        except Exception as e:
+            log(f"{inv['url']} 重新列出镜像时出错: {e}")
+            with inv["lock"]:
+                if inv["relist_due"] is not None:
+                    # 列出期间又有新事件，已由新的线程处理
+                    return
+                inv["relist_due"] = time.monotonic() + INVENTORY_RETRY_MIN
+            continue
+        finally:
+            release_docker_client(inv["url"], client)
+        with inv["lock"]:
+            inv["images"] = {img.get("Id"): img for img in images}
+            # 列出期间又收到镜像事件时，索引仍不可用，等待下一次列出
+            if inv["image_events"] == events_seen:
+                inv["images_pending"] = False
+        return
+
+
+def _inventory_apply_event(inv: dict, client, event: dict) -> None:
+    """把一条Docker事件增量应用到索引；读取失败时抛出异常，由调用方重新同步"""
+    kind = event.get("Type")
+    action = (event.get("Action") or event.get("status") or "").split(":", 1)[0]
+    actor = event.get("Actor") or {}
+    actor_id = actor.get("ID") or event.get("id")
+    attributes = actor.get("Attributes") or {}
+
+    if kind == "container":
+        if action == "destroy":
+            with inv["lock"]:
+                _inventory_drop_container(inv, actor_id)
+        elif action in CONTAINER_REFRESH_ACTIONS:
+            _inventory_refresh_container(inv, client, actor_id)
+    elif kind == "image":
+        if action == "delete":
+            with inv["lock"]:
+                inv["images"].pop(actor_id, None)
+        elif action == "untag":
+            with inv["lock"]:
+                _inventory_untag_image(inv, actor_id, attributes.get("name"))
+        elif action in IMAGE_REFRESH_ACTIONS:
+            # pull事件的ID是镜像引用而不是镜像ID，新镜像的大小和父镜像也不在事件中；
+            # 一次拉取或导入会产生一批事件，合并为一次重新列出
+            _inventory_schedule_image_relist(inv)
+    elif kind == "network":
+        if action == "destroy":
+            with inv["lock"]:
+                inv["networks"].pop(actor_id, None)
+        elif action == "create":
+            networks = client.api.networks(ids=[actor_id]) or []
+            with inv["lock"]:
+                for net in networks:
+                    inv["networks"][net.get("Id")] = net
+        elif action in ("connect", "disconnect"):
+            _inventory_refresh_container(inv, client, attributes.get("container"))
+    elif kind == "volume":
+        if action == "destroy":
+            with inv["lock"]:
+                inv["volumes"].pop(actor_id, None)
+        elif action == "create":
+            volume = client.api.inspect_volume(actor_id)
+            with inv["lock"]:
+                inv["volumes"][volume.get("Name")] = volume
+        elif action in ("mount", "unmount"):
+            _inventory_refresh_container(inv, client, attributes.get("container"))
+
+
+def _inventory_mark_stale(inv: dict, error: str) -> None:
+    """把索引标记为失效，预览回退到直接列出资源"""
+    with inv["lock"]:
+        was_valid = inv["valid"]
+        inv["valid"] = False
+        inv["error"] = error
+        if inv["stale_since"] is None:
+            inv["stale_since"] = time.time()
+    if was_valid:
+        log(f"{inv['url']} 的实时资源索引已失效: {error}")
+
+
+def _inventory_watch(inv: dict) -> None:
+    """后台线程：订阅主机的事件流并维护索引，断开后按退避时间重连并完整重新同步"""
+    delay = INVENTORY_RETRY_MIN
+    while not inv["stop"].is_set():
+        # 事件流会长期占用一个连接，使用独立的客户端而不是连接池中的客户端
+        client = create_docker_client(inv["url"])
+        stream = None
+        try:
+            if client is None:
+                raise RuntimeError("连接失败")
+            # 先订阅再列出资源，同步期间发生的事件不会丢失
+            stream = client.api.events(decode=True)
+            inv["stream"] = stream
+            if inv["stop"].is_set():
                 continue
-            
-            containers_list = []
-            images_list = []
-            networks_list = []
-            volumes_list = []
-            build_cache_list = []
-            
-            if config.get("prune_containers"):
-                try:
-                    all_containers = client.containers.list(all=True)
-                    stopped_containers = [c for c in all_containers if c.status in ["exited", "dead", "created"]]
-                    containers_list = [
-                        {"id": c.short_id, "name": c.name, "status": c.status}
-                        for c in stopped_containers
-                    ]
-                except Exception as e:
-                    log(f"[{host_name}] 列出容器时出错: {e}")
-            
-            if config.get("prune_images"):
-                try:
-                    all_images = client.images.list()
-                    used_image_ids = set()
-                    for container in client.containers.list(all=True):
-                        img_id = container.attrs.get("Image")
-                        if img_id:
-                            used_image_ids.add(img_id)
-                    
-                    unused_images = [img for img in all_images if img.id not in used_image_ids]
-                    images_list = [
-                        {
-                            "id": img.short_id,
-                            "tags": img.tags[:3] if img.tags else ["<none>"],
-                            "size": human_bytes(img.attrs.get("Size", 0))
-                        }
-                        for img in unused_images
-                    ]
-                except Exception as e:
-                    log(f"[{host_name}] 列出镜像时出错: {e}")
-            
-            if config.get("prune_networks"):
-                try:
-                    networks = client.networks.list()
-                    unused_networks = []
-                    
-                    running_network_ids = set()
-                    for container in client.containers.list(filters={"status": "running"}):
-                        network_settings = container.attrs.get("NetworkSettings", {}).get("Networks", {})
-                        for net_name, net_info in network_settings.items():
-                            if net_info.get("NetworkID"):
-                                running_network_ids.add(net_info["NetworkID"])
-                    
-                    for net in networks:
-                        if net.name in ["bridge", "host", "none"]:
-                            continue
-                        if net.id in running_network_ids:
-                            continue
-                        unused_networks.append(net)
-                    
-                    networks_list = [
-                        {"id": net.short_id, "name": net.name}
-                        for net in unused_networks
-                    ]
-                except Exception as e:
-                    log(f"[{host_name}] 列出网络时出错: {e}")
-            
-            if config.get("prune_volumes"):
-                try:
-                    all_volumes_result = client.volumes.list()
-                    all_volumes = all_volumes_result if all_volumes_result else []
-                    used_volume_names = set()
-                    for container in client.containers.list(all=True):
-                        for mount in container.attrs.get("Mounts", []):
-                            if mount.get("Type") == "volume":
-                                used_volume_names.add(mount.get("Name"))
-                    
-                    unused_volumes = [v for v in all_volumes if v.name not in used_volume_names]
-                    volumes_list = [
-                        {"name": v.name, "driver": v.attrs.get("Driver", "local")}
-                        for v in unused_volumes
-                    ]
-                except Exception as e:
-                    log(f"[{host_name}] 列出卷时出错: {e}")
-            
-            if config.get("prune_build_cache"):
-                try:
-                    df_result = client.api.df()
-                    build_cache_info = df_result.get("BuildCache", [])
-                    
-                    reclaimable_cache = []
-                    for c in build_cache_info:
-                        if "Reclaimable" in c:
-                            if c["Reclaimable"]:
-                                reclaimable_cache.append(c)
-                        elif not c.get("InUse", False):
-                            reclaimable_cache.append(c)
-                    
-                    build_cache_list = [
-                        {
-                            "id": c.get("ID", "")[:12],
-                            "type": c.get("Type", "unknown"),
-                            "size": human_bytes(c.get("Size", 0)),
-                            "reclaimable": c.get("Reclaimable", True),
-                            "inUse": c.get("InUse", False)
-                        }
-                        for c in reclaimable_cache
-                    ]
-                    
-                    if build_cache_list:
-                        log(f"[{host_name}] 预览发现 {len(build_cache_list)} 个可回收的构建缓存条目")
-                except Exception as e:
-                    log(f"[{host_name}] 列出构建缓存时出错: {e}")
-            
-            total_containers += len(containers_list)
-            total_images += len(images_list)
-            total_networks += len(networks_list)
-            total_volumes += len(volumes_list)
-            total_build_cache += len(build_cache_list)
-            
-            preview_results.append({
-                "name": host_name,
-                "url": host_url,
-                "success": True,
-                "containers": containers_list,
-                "images": images_list,
-                "networks": networks_list,
-                "volumes": volumes_list,
-                "build_cache": build_cache_list,
-                "totals": {
-                    "containers": len(containers_list),
-                    "images": len(images_list),
-                    "networks": len(networks_list),
-                    "volumes": len(volumes_list),
-                    "build_cache": len(build_cache_list)
-                }
-            })
-            
+            _inventory_resync(inv, client)
+            log(f"{inv['url']} 的实时资源索引已同步（{len(inv['containers'])} 个容器，{len(inv['images'])} 个镜像）。")
+            delay = INVENTORY_RETRY_MIN
+            for event in stream:
+                if inv["stop"].is_set():
+                    break
+                _inventory_apply_event(inv, client, event)
+            if not inv["stop"].is_set():
+                _inventory_mark_stale(inv, "事件流已断开")
         except Exception as e:
-            log(f"[{host_name}] 获取预览时出错: {e}")
-            preview_results.append({
-                "name": host_name,
-                "url": host_url,
-                "success": False,
-                "error": str(e),
-                "containers": [],
-                "images": [],
-                "networks": [],
-                "volumes": [],
-                "build_cache": []
-            })
+            _inventory_mark_stale(inv, str(e))
         finally:
-            if client is not None:
+            inv["stream"] = None
+            if stream is not None:
                 try:
-                    client.close()
+                    stream.close()
                 except Exception:
                     pass
+            if client is not None:
+                _close_docker_client(client)
+        inv["stop"].wait(delay)
+        delay = min(delay * 2, INVENTORY_RETRY_MAX)
+
+
+def _stop_inventory_watch(inv: dict) -> None:
+    """停止主机的事件订阅线程"""
+    inv["stop"].set()
+    stream = inv.get("stream")
+    if stream is not None:
+        try:
+            stream.close()
+        except Exception:
+            pass
+    _inventory_mark_stale(inv, "已停止")
+
+
+def sync_inventory_watchers() -> None:
+    """为每个已启用的主机启动事件订阅，停止已删除或已禁用主机的订阅"""
+    if not inventory_state["active"] or not live_inventory_enabled or docker is None:
+        return
+    valid_urls = _configured_host_urls()
+    with host_inventories_lock:
+        removed = [host_inventories.pop(url) for url in list(host_inventories) if url not in valid_urls]
+        for url in valid_urls:
+            if url in host_inventories:
+                continue
+            inv = _new_host_inventory(url)
+            inv["thread"] = threading.Thread(target=_inventory_watch, args=(inv,), name="prunemate-events", daemon=True)
+            host_inventories[url] = inv
+            inv["thread"].start()
+    for inv in removed:
+        _stop_inventory_watch(inv)
+
+
+def live_inventory_snapshot(host_url: str) -> tuple | None:
+    """返回主机有效索引的快照 (inventory, usage)；索引不存在或已失效时返回None"""
+    with host_inventories_lock:
+        inv = host_inventories.get(host_url)
+    if inv is None:
+        return None
+    with inv["lock"]:
+        if not inv["valid"] or inv["images_pending"]:
+            return None
+        inventory = {
+            "containers": list(inv["containers"].values()),
+            "images": list(inv["images"].values()),
+            "networks": list(inv["networks"].values()),
+            "volumes": list(inv["volumes"].values()),
+        }
+        usage = {
+            "image_ids": set(inv["image_refs"]),
+            "volume_names": set(inv["volume_refs"]),
+            "network_ids": set(inv["network_refs"]),
+        }
+    return inventory, usage
+
+
+def _failed_preview_result(host: dict, error: str) -> dict:
+    """生成预览失败主机的结果记录"""
+    return {
+        "name": host.get("name", "未命名"),
+        "url": host.get("url", "unix:///var/run/docker.sock"),
+        "success": False,
+        "error": error,
+        "containers": [],
+        "images": [],
+        "networks": [],
+        "volumes": [],
+        "build_cache": []
+    }
+
+
+def _preview_host(host: dict, options: dict, holder: dict) -> dict:
+    """收集单个主机上将被清理的资源"""
+    host_name = host.get("name", "未命名")
+    host_url = host.get("url", "unix:///var/run/docker.sock")
+    
+    client = None
+    try:
+        # 实时索引有效时直接使用；只有构建缓存或索引失效时才需要访问Docker
+        live = live_inventory_snapshot(host_url)
+        if live is None or options.get("prune_build_cache"):
+            client = get_docker_client(host_url)
+            if client is None:
+                inc_metric("prunemate_docker_api_errors_total", host=host_name, operation="connect")
+                return _failed_preview_result(host, "连接失败")
+            holder["client"] = client
+        
+        containers_list = []
+        images_list = []
+        networks_list = []
+        volumes_list = []
+        build_cache_list = []
+        # 各类别预计实际释放的字节数
+        reclaimable = {"containers": 0, "images": 0, "volumes": 0, "build_cache": 0}
+        
+        # 反正要调用df（索引失效或需要构建缓存）且选择了多个类别时，所有类别都从同一次df生成
+        df_result = None
+        if _use_df_preview(options) and client is not None:
+            try:
+                inventory, df_result = _df_host_inventory(client, options, host_name, live)
+            except Exception as e:
+                log(f"[{host_name}] 获取磁盘使用数据时出错，改为逐类列出: {e}")
+                inc_metric("prunemate_docker_api_errors_total", host=host_name, operation="df")
+        if df_result is not None:
+            source = "df"
+            usage = _index_container_usage(inventory["containers"])
+        elif live is not None:
+            source = "live"
+            inventory, usage = live
+        else:
+            source = "list"
+            inventory = _list_host_inventory(client, options, host_name)
+            usage = _index_container_usage(inventory["containers"] or [])
+        
+        if options.get("prune_containers") and inventory["containers"] is not None:
+            stopped_containers = [c for c in inventory["containers"] if c.get("State") in ["exited", "dead", "created"]]
+            containers_list = []
+            for c in stopped_containers:
+                item = {"id": _short_id(c.get("Id")), "name": (c.get("Names") or [""])[0].lstrip("/"), "status": c.get("State")}
+                if c.get("SizeRw") is not None:
+                    item["size"] = human_bytes(c["SizeRw"])
+                    reclaimable["containers"] += int(c["SizeRw"])
+                containers_list.append(item)
+        
+        if options.get("prune_images") and inventory["images"] is not None and inventory["containers"] is not None:
+            in_use_images = _in_use_image_ids(inventory["images"], usage["image_ids"])
+            unused_images = [img for img in inventory["images"] if img.get("Id") not in in_use_images]
+            reclaimable["images"] = estimate_image_reclaim(
+                client, inventory["images"], {img.get("Id") for img in unused_images}
+            )
+            images_list = []
+            for img in unused_images:
+                tags = [t for t in img.get("RepoTags") or [] if t != "<none>:<none>"]
+                images_list.append({
+                    "id": _short_id(img.get("Id")),
+                    "tags": tags[:3] if tags else ["<none>"],
+                    "size": human_bytes(img.get("Size", 0))
+                })
+        
+        if options.get("prune_networks") and inventory["networks"] is not None and inventory["containers"] is not None:
+            unused_networks = [
+                net for net in inventory["networks"]
+                if net.get("Name") not in ["bridge", "host", "none"] and net.get("Id") not in usage["network_ids"]
+            ]
+            networks_list = [
+                {"id": _short_id(net.get("Id")), "name": net.get("Name")}
+                for net in unused_networks
+            ]
+        
+        if options.get("prune_volumes") and inventory["volumes"] is not None and inventory["containers"] is not None:
+            unused_volumes = [v for v in inventory["volumes"] if v.get("Name") not in usage["volume_names"]]
+            volumes_list = []
+            for v in unused_volumes:
+                item = {"name": v.get("Name"), "driver": v.get("Driver", "local")}
+                # UsageData.Size为-1表示Docker未计算该卷的大小
+                volume_size = (v.get("UsageData") or {}).get("Size", -1)
+                if volume_size >= 0:
+                    item["size"] = human_bytes(volume_size)
+                    reclaimable["volumes"] += volume_size
+                volumes_list.append(item)
+        
+        if options.get("prune_build_cache"):
+            try:
+                if df_result is None:
+                    df_result = client.api.df()
+                build_cache_info = df_result.get("BuildCache") or []
+                
+                reclaimable_cache = []
+                for c in build_cache_info:
+                    if "Reclaimable" in c:
+                        if c["Reclaimable"]:
+                            reclaimable_cache.append(c)
+                    elif not c.get("InUse", False):
+                        reclaimable_cache.append(c)
+                
+                build_cache_list = [
+                    {
+                        "id": c.get("ID", "")[:12],
+                        "type": c.get("Type", "unknown"),
+                        "size": human_bytes(c.get("Size", 0)),
+                        "reclaimable": c.get("Reclaimable", True),
+                        "inUse": c.get("InUse", False)
+                    }
+                    for c in reclaimable_cache
+                ]
+                reclaimable["build_cache"] = sum(int(c.get("Size") or 0) for c in reclaimable_cache)
+                
+                if build_cache_list:
+                    log(f"[{host_name}] 预览发现 {len(build_cache_list)} 个可回收的构建缓存条目")
+            except Exception as e:
+                log(f"[{host_name}] 列出构建缓存时出错: {e}")
+                inc_metric("prunemate_docker_api_errors_total", host=host_name, operation="df")
+        
+        return {
+            "name": host_name,
+            "url": host_url,
+            "success": True,
+            "containers": containers_list,
+            "images": images_list,
+            "networks": networks_list,
+            "volumes": volumes_list,
+            "build_cache": build_cache_list,
+            "source": source,
+            "reclaimable": reclaimable,
+            "estimated_space": sum(reclaimable.values()),
+            "estimated_space_human": human_bytes(sum(reclaimable.values())),
+            "totals": {
+                "containers": len(containers_list),
+                "images": len(images_list),
+                "networks": len(networks_list),
+                "volumes": len(volumes_list),
+                "build_cache": len(build_cache_list)
+            }
+        }
+        
+    except Exception as e:
+        log(f"[{host_name}] 获取预览时出错: {e}")
+        inc_metric("prunemate_docker_api_errors_total", host=host_name, operation="preview")
+        if client is not None:
+            discard_docker_client(host_url, client, leased=True)
+        return _failed_preview_result(host, str(e))
+    finally:
+        release_docker_client(host_url, client)
+
+
+# ---- 预览缓存 ----
+# 按 (主机URL, 已选清理选项) 缓存预览结果；相同的并发请求等待正在进行的计算（singleflight），
+# 主机清理结束后清除该主机的缓存。每个缓存条目还记录生成时该主机最近一次清理的时间
+# （内存中的host_last_prune），之后记录的清理同样使条目失效
+preview_cache = {}
+preview_inflight = {}
+# 每个主机的缓存代数：清理结束时递增，防止清理前开始的预览在清理后写入缓存
+preview_generation = {}
+preview_cache_lock = threading.Lock()
+
+
+def _preview_options_key(options: dict) -> tuple:
+    """返回已选清理选项的缓存键"""
+    return tuple(sorted(k for k, v in options.items() if v))
+
+
+def invalidate_preview_cache(host_url: str) -> None:
+    """清除某个主机的缓存预览"""
+    with preview_cache_lock:
+        preview_generation[host_url] = preview_generation.get(host_url, 0) + 1
+        for key in [k for k in preview_cache if k[0] == host_url]:
+            del preview_cache[key]
+
+
+def _timed_preview_host(host: dict, options: dict, holder: dict) -> dict:
+    """计算单主机预览并记录耗时（不包括缓存命中）"""
+    started = time.monotonic()
+    try:
+        return _preview_host(host, options, holder)
+    finally:
+        observe_metric("prunemate_preview_duration_seconds", time.monotonic() - started,
+                       host=host.get("name", "未命名"))
+
+
+def _cached_preview_host(host: dict, options: dict, holder: dict) -> dict:
+    """带缓存和singleflight的单主机预览"""
+    if preview_cache_ttl <= 0:
+        return _timed_preview_host(host, options, holder)
+
+    host_url = host.get("url", "unix:///var/run/docker.sock")
+    key = (host_url, _preview_options_key(options))
+    last_prune = _host_last_prune(host_url)
+    with preview_cache_lock:
+        entry = preview_cache.get(key)
+        if entry is not None and entry["expires"] > time.monotonic() and entry["last_prune"] == last_prune:
+            return dict(entry["result"], cached=True)
+        flight = preview_inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = {"event": threading.Event(), "result": None}
+            preview_inflight[key] = flight
+            generation = preview_generation.get(host_url, 0)
+
+    if not leader:
+        if not flight["event"].wait(host_preview_timeout):
+            return _failed_preview_result(host, "timeout")
+        if flight["result"] is None:
+            return _failed_preview_result(host, "预览失败")
+        return dict(flight["result"], cached=True)
+
+    result = None
+    try:
+        result = _timed_preview_host(host, options, holder)
+        return result
+    finally:
+        now = time.monotonic()
+        with preview_cache_lock:
+            preview_inflight.pop(key, None)
+            for stale_key in [k for k, v in preview_cache.items() if v["expires"] <= now]:
+                del preview_cache[stale_key]
+            if result is not None and result.get("success") and preview_generation.get(host_url, 0) == generation:
+                preview_cache[key] = {"result": result, "expires": now + preview_cache_ttl, "last_prune": last_prune}
+        flight["result"] = result
+        flight["event"].set()
+
+
+def _peek_preview_cache(host: dict, options: dict) -> dict | None:
+    """只读取仍有效的预览缓存条目，不发起列出请求；没有时返回None"""
+    host_url = host.get("url", "unix:///var/run/docker.sock")
+    key = (host_url, _preview_options_key(options))
+    last_prune = _host_last_prune(host_url)
+    with preview_cache_lock:
+        entry = preview_cache.get(key)
+        if entry is not None and entry["expires"] > time.monotonic() and entry["last_prune"] == last_prune:
+            return entry["result"]
+    return None
+
+
+# 预览中包含资源明细列表的类别
+PREVIEW_CATEGORIES = ("containers", "images", "networks", "volumes", "build_cache")
+
+
+def _preview_hosts() -> list:
+    """返回参与预览和清理的主机：本地主机加上所有已启用的外部主机"""
+    docker_hosts = config.get("docker_hosts", [])
+    enabled_external_hosts = [
+        h for h in docker_hosts 
+        if h.get("enabled", True) and h.get("name") != "Local" and "unix://" not in h.get("url", "")
+    ]
+    return [{"name": "本地", "url": "unix:///var/run/docker.sock", "enabled": True}] + enabled_external_hosts
+
+
+def _selected_prune_options() -> dict:
+    """返回当前配置中的清理选项"""
+    return {
+        key: bool(config.get(key))
+        for key in ("prune_containers", "prune_images", "prune_networks", "prune_volumes", "prune_build_cache")
+    }
+
+
+def _preview_host_summary(result: dict) -> dict:
+    """去掉主机预览结果中的资源明细，只保留状态、数量和预计释放空间"""
+    return {k: v for k, v in result.items() if k not in PREVIEW_CATEGORIES}
+
+
+def get_prune_preview(totals_only: bool = False, on_host=None) -> dict:
+    """获取清理预览，不实际执行清理
+
+    totals_only为True时只返回每个主机的数量和预计释放空间，不包含资源明细；
+    传入on_host时，每个主机的预览完成后立即调用 on_host(result)。
+    """
+    load_config(silent=True)
+    
+    if not any([
+        config.get("prune_containers"),
+        config.get("prune_images"),
+        config.get("prune_networks"),
+        config.get("prune_volumes"),
+        config.get("prune_build_cache"),
+    ]):
+        return {"error": "未选择任何清理选项", "hosts": []}
+    
+    if docker is None:
+        return {"error": "Docker SDK不可用", "hosts": []}
+    
+    all_hosts = _preview_hosts()
+    prune_options = _selected_prune_options()
+
+    trace = new_api_trace() if api_trace_enabled else None
+
+    def preview_worker(host, holder):
+        with api_trace_span(trace, host.get("name", "未命名"), "preview"):
+            return _cached_preview_host(host, prune_options, holder)
+
+    started = time.monotonic()
+    preview_results = _run_per_host(
+        all_hosts,
+        preview_worker,
+        _failed_preview_result,
+        host_preview_timeout,
+        on_result=(lambda index, result: on_host(result)) if on_host is not None else None,
+    )
+
+    total_containers = sum(len(r["containers"]) for r in preview_results)
+    total_images = sum(len(r["images"]) for r in preview_results)
+    total_networks = sum(len(r["networks"]) for r in preview_results)
+    total_volumes = sum(len(r["volumes"]) for r in preview_results)
+    total_build_cache = sum(len(r["build_cache"]) for r in preview_results)
+    estimated_space = sum(r.get("estimated_space", 0) for r in preview_results)
+    observe_metric("prunemate_preview_request_duration_seconds", time.monotonic() - started)
+    if trace is not None:
+        last_preview_trace["value"] = trace
+    if totals_only:
+        preview_results = [_preview_host_summary(r) for r in preview_results]
     
     return {
         "hosts": preview_results,
+        "estimated_space": estimated_space,
+        "estimated_space_human": human_bytes(estimated_space),
         "totals": {
             "containers": total_containers,
             "images": total_images,
@@ -995,12 +3262,330 @@ def get_prune_preview() -> dict:
     }
 
 
-def run_prune_job(origin: str = "unknown", wait: bool = False) -> bool:
-    """执行Docker清理任务"""
+# 正在清理的主机URL；超时后放弃等待的主机线程仍可能在执行，直到线程退出才移除，期间后续运行跳过该主机
+pruning_hosts = set()
+pruning_hosts_lock = threading.Lock()
+
+
+def _claim_prune_host(host_url: str) -> bool:
+    """把主机标记为正在清理；上一次运行的清理线程仍未退出时返回False"""
+    with pruning_hosts_lock:
+        if host_url in pruning_hosts:
+            return False
+        pruning_hosts.add(host_url)
+        return True
+
+
+def _release_prune_host(host_url: str) -> None:
+    with pruning_hosts_lock:
+        pruning_hosts.discard(host_url)
+
+
+def _failed_prune_result(host: dict, error: str) -> dict:
+    """生成清理失败主机的结果记录"""
+    return {
+        "name": host.get("name", "未命名"),
+        "url": host.get("url", "unix:///var/run/docker.sock"),
+        "success": False,
+        "error": error,
+        "containers": 0,
+        "images": 0,
+        "networks": 0,
+        "volumes": 0,
+        "build_cache": 0,
+        "space": 0,
+    }
+
+
+# 清理阶段：(阶段名, 配置开关, 开始日志, 资源名称, 删除列表字段, 执行函数)
+PRUNE_PHASES = (
+    ("containers", "prune_containers", "清理容器…", "容器", "ContainersDeleted",
+     lambda client: client.containers.prune()),
+    ("images", "prune_images", "清理所有未使用的镜像…", "镜像", "ImagesDeleted",
+     lambda client: client.images.prune(filters={"dangling": False})),
+    ("networks", "prune_networks", "清理网络…", "网络", "NetworksDeleted",
+     lambda client: client.networks.prune()),
+    ("volumes", "prune_volumes", "清理所有未使用的卷（包括命名卷）…", "卷", "VolumesDeleted",
+     lambda client: client.volumes.prune(filters={"all": True})),
+    ("build_cache", "prune_build_cache", "清理构建缓存…", "构建缓存", "CachesDeleted",
+     lambda client: client.api.prune_builds()),
+)
+
+# 回收目标模式中额外的镜像清理阶段，删除数量计入对应的资源类别
+PHASE_CATEGORIES = {"images_dangling": "images", "images_old": "images"}
+RECLAIM_TIER_LABELS = {
+    "build_cache": "构建缓存",
+    "dangling_images": "悬空镜像",
+    "old_images": "旧的未使用镜像",
+    "everything": "全部未使用资源",
+}
+
+
+def _reclaim_target_settings(host: dict) -> dict | None:
+    """返回主机的回收目标（字节）和旧镜像的最小存在时间，未启用回收目标模式时返回None"""
+    settings = config.get("reclaim_target") or {}
+    if not settings.get("enabled"):
+        return None
+    try:
+        target_gb = max(0.0, float(host.get("reclaim_target_gb", settings.get("target_gb", 10))))
+    except (TypeError, ValueError):
+        target_gb = 10.0
+    try:
+        image_age_hours = max(1, int(settings.get("image_age_hours", 72)))
+    except (TypeError, ValueError):
+        image_age_hours = 72
+    return {"target": int(target_gb * 1024 ** 3), "image_age_hours": image_age_hours}
+
+
+def _prune_plan(options: dict, reclaim: dict | None) -> list:
+    """返回按顺序执行的清理层级 [(层级, [阶段, …])]
+
+    普通模式只有一个层级，包含所有已启用的阶段；回收目标模式从对后续拉取影响最小的资源开始，
+    只包含已启用类别的层级，最后一层执行其余所有已启用的阶段。
+    """
+    phases = {phase[0]: phase for phase in PRUNE_PHASES if options.get(phase[1])}
+    if reclaim is None:
+        return [(None, list(phases.values()))]
+    tiers = []
+    if "build_cache" in phases:
+        tiers.append(("build_cache", [phases.pop("build_cache")]))
+    if "images" in phases:
+        age = reclaim["image_age_hours"]
+        tiers.append(("dangling_images", [
+            ("images_dangling", "prune_images", "清理悬空镜像…", "悬空镜像", "ImagesDeleted",
+             lambda client: client.images.prune(filters={"dangling": True})),
+        ]))
+        tiers.append(("old_images", [
+            ("images_old", "prune_images", f"清理创建超过{age}小时的未使用镜像…", "旧镜像", "ImagesDeleted",
+             lambda client: client.images.prune(filters={"dangling": False, "until": f"{age}h"})),
+        ]))
+    if phases:
+        tiers.append(("everything", list(phases.values())))
+    return tiers
+
+
+def _summarize_prune_response(response: dict, limit: int | None = None) -> dict:
+    """返回用于日志的清理响应摘要：列表只保留前limit项，其余以"… (+N)"表示"""
+    limit = prune_log_items if limit is None else limit
+    summary = {}
+    for key, value in (response or {}).items():
+        if isinstance(value, list):
+            # ImagesDeleted的条目形如 {"Deleted": "sha256:…"}，日志中只保留值
+            items = [next(iter(v.values())) if isinstance(v, dict) and len(v) == 1 else v for v in value[:limit]]
+            if len(value) > limit:
+                items.append(f"… (+{len(value) - limit})")
+            summary[key] = items
+        else:
+            summary[key] = value
+    return summary
+
+
+def _run_artifact_path(run_id) -> Path:
+    return RUN_ARTIFACT_DIR / f"{run_id}.json.gz"
+
+
+def write_run_artifact(run_id, artifact: dict) -> Path | None:
+    """将一次运行的完整清理响应写入gzip压缩的JSON文件，并只保留最近MAX_RUN_ARTIFACTS个"""
+    try:
+        RUN_ARTIFACT_DIR.mkdir(parents=True, exist_ok=True)
+        path = _run_artifact_path(run_id)
+        fd, tmp_path = tempfile.mkstemp(dir=str(RUN_ARTIFACT_DIR), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                f.write(json.dumps(artifact, ensure_ascii=False, default=str).encode("utf-8"))
+            os.replace(tmp_path, path)
+        except Exception:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+        artifacts = sorted(RUN_ARTIFACT_DIR.glob("*.json.gz"), key=lambda p: p.stat().st_mtime)
+        for old in artifacts[:-MAX_RUN_ARTIFACTS]:
+            with contextlib.suppress(OSError):
+                old.unlink()
+        return path
+    except Exception as e:
+        log(f"写入运行产物 {RUN_ARTIFACT_DIR} 时出错: {e}")
+        return None
+
+
+def load_run_artifact(run_id) -> dict | None:
+    """读取某次运行保存的完整清理响应，没有产物文件时返回None"""
+    path = _run_artifact_path(run_id)
+    if not path.exists():
+        return None
+    with gzip.open(path, "rb") as f:
+        return json.loads(f.read().decode("utf-8"))
+
+
+def _prune_host(host: dict, options: dict, holder: dict, job: dict | None = None, run_id: str | None = None,
+                trace: dict | None = None, responses: list | None = None) -> dict:
+    """对单个主机执行所有已启用的清理操作；传入trace时按阶段（connect、各清理阶段）记录Docker API调用
+
+    传入responses时，每个阶段的完整清理响应追加到该列表（写入运行产物），日志中只记录摘要。
+    """
+    host_name = host.get("name", "未命名")
+    host_url = host.get("url", "unix:///var/run/docker.sock")
+    index = holder.get("index")
+
+    log(f"--- 处理主机: {host_name} ({host_url}) ---")
+    publish_event("host_started", run_id=run_id, host=host_name, url=host_url)
+    _job_host_update(job, index, status="running")
+
+    started = time.monotonic()
+    client = None
+    try:
+        with api_trace_span(trace, host_name, "connect"):
+            client = get_docker_client(host_url)
+        if client is None:
+            log(f"无法连接到 {host_name}; 跳过此主机。")
+            publish_event("error", run_id=run_id, host=host_name, phase=None, error="连接失败")
+            inc_metric("prunemate_docker_api_errors_total", host=host_name, operation="connect")
+            return _failed_prune_result(host, "连接失败")
+        holder["client"] = client
+
+        reclaim = _reclaim_target_settings(host)
+        estimated_space = None
+        if reclaim is not None:
+            # 逐层清理可能提前停止，覆盖所有类别的估算与实际结果不可比，因此不做估算
+            log(f"[{host_name}] 回收目标模式: 目标 {human_bytes(reclaim['target'])}，逐层清理直到达到目标")
+        else:
+            # 清理前的可回收空间估算，与实际结果一起写入运行历史，用于检验估算准确度；
+            # 只取界面预览留下的缓存，不在主机超时内重新列出资源，缓存未命中时不做估算
+            estimate = _peek_preview_cache(host, options)
+            estimated_space = estimate.get("estimated_space") if estimate is not None else None
+
+        deleted_counts = {phase[0]: 0 for phase in PRUNE_PHASES}
+        space_reclaimed = 0
+
+        reclaim_tier = None
+        for tier, tier_phases in _prune_plan(options, reclaim):
+            reclaim_tier = tier
+            for phase, option, start_message, label, deleted_key, prune in tier_phases:
+                _job_host_update(job, index, phase=phase)
+                phase_started = time.monotonic()
+                try:
+                    with log_context(phase=phase):
+                        log(f"[{host_name}] {start_message}")
+                    publish_event("phase_started", run_id=run_id, host=host_name, phase=phase)
+                    with api_trace_span(trace, host_name, phase):
+                        r = prune(client)
+                    deleted = len(r.get(deleted_key) or [])
+                    space = int(r.get("SpaceReclaimed") or 0)
+                    if responses is not None:
+                        responses.append({"host": host_name, "url": host_url, "phase": phase, "response": r})
+                    with log_context(phase=phase):
+                        log(f"[{host_name}] {label}清理结果: {_summarize_prune_response(r)}", deleted=deleted, space=space)
+                    deleted_counts[PHASE_CATEGORIES.get(phase, phase)] += deleted
+                    space_reclaimed += space
+                    _job_phase_update(job, index, phase, {"status": "done", "deleted": deleted, "space": space})
+                    publish_event("phase_finished", run_id=run_id, host=host_name, phase=phase, deleted=deleted, space=space)
+                except Exception as e:
+                    log(f"[{host_name}] 清理{label}时出错: {e}", phase=phase)
+                    _job_phase_update(job, index, phase, {"status": "error", "error": str(e)})
+                    publish_event("error", run_id=run_id, host=host_name, phase=phase, error=str(e))
+                    inc_metric("prunemate_docker_api_errors_total", host=host_name, operation=f"prune_{phase}")
+                observe_metric("prunemate_phase_duration_seconds", time.monotonic() - phase_started, host=host_name, phase=phase)
+            if reclaim is not None and space_reclaimed >= reclaim["target"]:
+                log(f"[{host_name}] 已回收 {human_bytes(space_reclaimed)}，达到目标; 在“{RECLAIM_TIER_LABELS[tier]}”层级后停止。")
+                break
+        else:
+            if reclaim is not None:
+                log(f"[{host_name}] 所有层级已执行，回收 {human_bytes(space_reclaimed)}，未达到目标 {human_bytes(reclaim['target'])}。")
+        _job_host_update(job, index, phase=None)
+        inc_metric("prunemate_reclaimed_bytes_total", space_reclaimed, host=host_name)
+
+        containers_deleted = deleted_counts["containers"]
+        images_deleted = deleted_counts["images"]
+        networks_deleted = deleted_counts["networks"]
+        volumes_deleted = deleted_counts["volumes"]
+        build_cache_deleted = deleted_counts["build_cache"]
+
+        log(f"[{host_name}] 清理完成: 容器={containers_deleted}, 镜像={images_deleted}, 网络={networks_deleted}, 卷={volumes_deleted}, 构建缓存={build_cache_deleted}, 空间={human_bytes(space_reclaimed)}")
+        if estimated_space is not None:
+            log(f"[{host_name}] 预计释放 {human_bytes(estimated_space)}，实际释放 {human_bytes(space_reclaimed)}")
+        publish_event("host_finished", run_id=run_id, host=host_name, success=True, space=space_reclaimed,
+                      estimated_space=estimated_space, reclaim_tier=reclaim_tier)
+
+        return {
+            "name": host_name,
+            "url": host_url,
+            "success": True,
+            "containers": containers_deleted,
+            "images": images_deleted,
+            "networks": networks_deleted,
+            "volumes": volumes_deleted,
+            "build_cache": build_cache_deleted,
+            "space": space_reclaimed,
+            "estimated_space": estimated_space,
+            # 回收目标模式下最后执行的层级
+            "reclaim_tier": reclaim_tier,
+            "duration": round(time.monotonic() - started, 3),
+        }
+
+    except Exception as e:
+        log(f"[{host_name}] 清理过程中出现意外错误: {e}")
+        publish_event("error", run_id=run_id, host=host_name, phase=None, error=str(e))
+        inc_metric("prunemate_docker_api_errors_total", host=host_name, operation="prune")
+        if client is not None:
+            discard_docker_client(host_url, client, leased=True)
+        return _failed_prune_result(host, str(e))
+    finally:
+        release_docker_client(host_url, client)
+        observe_metric("prunemate_host_prune_duration_seconds", time.monotonic() - started, host=host_name)
+        # 主机清理结束后，该主机的缓存预览已不再准确
+        _bump_host_last_prune(host_url, time.time())
+        invalidate_preview_cache(host_url)
+
+
+def _deletion_lines(result: dict) -> list:
+    """通知中单个主机的删除数量和回收空间行"""
+    lines = []
+    if result.get('containers'):
+        lines.append(f"  - 🗑️ {result['containers']} 个容器")
+    if result.get('images'):
+        lines.append(f"  - 💿 {result['images']} 个镜像")
+    if result.get('networks'):
+        lines.append(f"  - 🌐 {result['networks']} 个网络")
+    if result.get('volumes'):
+        lines.append(f"  - 📦 {result['volumes']} 个卷")
+    if result.get('build_cache'):
+        lines.append(f"  - 🏗️ {result['build_cache']} 个构建缓存")
+    if result.get('space'):
+        lines.append(f"  - 💾 回收空间 {human_bytes(result['space'])}")
+    return lines
+
+
+def _fleet_total_lines(totals: dict) -> list:
+    """通知中所有主机总计的行"""
+    lines = []
+    if totals.get("containers"):
+        lines.append(f"  - 🗑️ 容器: {totals['containers']}")
+    if totals.get("images"):
+        lines.append(f"  - 💿 镜像: {totals['images']}")
+    if totals.get("networks"):
+        lines.append(f"  - 🌐 网络: {totals['networks']}")
+    if totals.get("volumes"):
+        lines.append(f"  - 📦 卷: {totals['volumes']}")
+    if totals.get("build_cache"):
+        lines.append(f"  - 🏗️ 构建缓存: {totals['build_cache']}")
+    if totals.get("space"):
+        lines.append(f"  - 💾 回收空间: {human_bytes(totals['space'])}")
+    return lines
+
+
+def run_prune_job(origin: str = "unknown", wait: bool = False, job: dict | None = None,
+                  host_urls: list | None = None) -> bool:
+    """执行Docker清理任务；传入job时把每个主机和阶段的进度写入该后台任务
+
+    传入host_urls时只清理这些URL对应的主机（例如磁盘用量触发的主机）。
+    """
     load_config(silent=True)
     
     lock = FileLock(str(LOCK_FILE))
     acquired = False
+    # 供 prunemate_runs_total 使用的运行结果
+    status = "skipped"
+    lock_wait_started = time.monotonic()
     try:
         if wait:
             try:
@@ -1014,6 +3599,7 @@ def run_prune_job(origin: str = "unknown", wait: bool = False) -> bool:
                     acquired = True
                 except Timeout:
                     log(f"{origin.capitalize()} 触发: 已等待300秒; 跳过本次运行。")
+                    _job_update(job, message="等待正在运行的清理任务超时（300秒）")
                     return False
         else:
             try:
@@ -1021,7 +3607,9 @@ def run_prune_job(origin: str = "unknown", wait: bool = False) -> bool:
                 acquired = True
             except Timeout:
                 log(f"{origin.capitalize()} 触发: 清理任务已在进行中; 跳过本次运行。")
+                _job_update(job, message="清理任务已在进行中")
                 return False
+        observe_metric("prunemate_lock_wait_seconds", time.monotonic() - lock_wait_started, origin=origin)
 
         log("开始清理任务，配置如下:")
         log(str(_redact_for_log(effective_config())))
@@ -1034,234 +3622,173 @@ def run_prune_job(origin: str = "unknown", wait: bool = False) -> bool:
             config.get("prune_build_cache"),
         ]):
             log("未选择任何清理选项。任务跳过。")
+            _job_update(job, message="未选择任何清理选项")
             return False
 
         if docker is None:
             log("Docker SDK不可用; 终止清理任务。")
+            _job_update(job, message="Docker SDK不可用")
             return False
 
-        docker_hosts = config.get("docker_hosts", [])
-        enabled_external_hosts = [
-            h for h in docker_hosts 
-            if h.get("enabled", True) and h.get("name") != "Local" and "unix://" not in h.get("url", "")
-        ]
-        
-        all_hosts = [
-            {"name": "本地", "url": "unix:///var/run/docker.sock", "enabled": True}
-        ] + enabled_external_hosts
-        
-        log(f"处理 {len(all_hosts)} 个主机 (1个本地 + {len(enabled_external_hosts)} 个外部)...")
-        
-        total_containers_deleted = 0
-        total_images_deleted = 0
-        total_networks_deleted = 0
-        total_volumes_deleted = 0
-        total_build_cache_deleted = 0
-        total_space_reclaimed = 0
-        
-        host_results = []
+        all_hosts = _preview_hosts()
+        if host_urls is not None:
+            all_hosts = [h for h in all_hosts if h.get("url") in host_urls]
+            if not all_hosts:
+                log("指定的主机均未启用; 任务跳过。")
+                _job_update(job, message="指定的主机均未启用")
+                return False
+            log(f"处理 {len(all_hosts)} 个主机: {', '.join(h.get('name', '未命名') for h in all_hosts)}...")
+        else:
+            log(f"处理 {len(all_hosts)} 个主机 (1个本地 + {len(all_hosts) - 1} 个外部)...")
+        run_started_at = time.time()
+        run_id = job["id"] if job else uuid.uuid4().hex[:12]
+        publish_event("run_started", run_id=run_id, origin=origin, hosts=[h.get("name", "未命名") for h in all_hosts])
+        _job_update(job, hosts=[
+            {"name": h.get("name", "未命名"), "url": h.get("url", ""), "status": "pending", "phase": None, "phases": {}}
+            for h in all_hosts
+        ])
         
-        for host in all_hosts:
+        prune_options = {
+            key: bool(config.get(key))
+            for key in ("prune_containers", "prune_images", "prune_networks", "prune_volumes", "prune_build_cache")
+        }
+
+        trace = new_api_trace() if api_trace_enabled else None
+        # 每个主机每个阶段的完整清理响应，运行结束后写入运行产物文件
+        responses = []
+
+        def prune_worker(host, holder):
             host_name = host.get("name", "未命名")
             host_url = host.get("url", "unix:///var/run/docker.sock")
-            
-            log(f"--- 处理主机: {host_name} ({host_url}) ---")
-            
-            client = None
+            # 清理锁在超时后就会释放，因此由主机线程自己标记和解除占用，避免与上次超时仍在运行的线程重叠
+            if not _claim_prune_host(host_url):
+                log(f"[{host_name}] 上次超时的清理仍在进行; 跳过此主机。")
+                return _failed_prune_result(host, "busy")
             try:
-                client = create_docker_client(host_url)
-                if client is None:
-                    log(f"无法连接到 {host_name}; 跳过此主机。")
-                    host_results.append({
-                        "name": host_name,
-                        "url": host_url,
-                        "success": False,
-                        "error": "连接失败",
-                        "containers": 0,
-                        "images": 0,
-                        "networks": 0,
-                        "volumes": 0,
-                        "build_cache": 0,
-                        "space": 0,
-                    })
-                    continue
-                
-                containers_deleted = images_deleted = networks_deleted = volumes_deleted = build_cache_deleted = 0
-                space_reclaimed = 0
-
-                if config.get("prune_containers"):
-                    try:
-                        log(f"[{host_name}] 清理容器…")
-                        r = client.containers.prune()
-                        log(f"[{host_name}] 容器清理结果: {r}")
-                        containers_deleted = len(r.get("ContainersDeleted") or [])
-                        space_reclaimed += int(r.get("SpaceReclaimed") or 0)
-                    except Exception as e:
-                        log(f"[{host_name}] 清理容器时出错: {e}")
-
-                if config.get("prune_images"):
-                    try:
-                        log(f"[{host_name}] 清理所有未使用的镜像…")
-                        r = client.images.prune(filters={"dangling": False})
-                        log(f"[{host_name}] 镜像清理结果: {r}")
-                        deleted_list = r.get("ImagesDeleted") or []
-                        images_deleted = len(deleted_list)
-                        space_reclaimed += int(r.get("SpaceReclaimed") or 0)
-                    except Exception as e:
-                        log(f"[{host_name}] 清理镜像时出错: {e}")
-
-                if config.get("prune_networks"):
-                    try:
-                        log(f"[{host_name}] 清理网络…")
-                        r = client.networks.prune()
-                        log(f"[{host_name}] 网络清理结果: {r}")
-                        networks_deleted = len(r.get("NetworksDeleted") or [])
-                    except Exception as e:
-                        log(f"[{host_name}] 清理网络时出错: {e}")
-
-                if config.get("prune_volumes"):
-                    try:
-                        log(f"[{host_name}] 清理所有未使用的卷（包括命名卷）…")
-                        r = client.volumes.prune(filters={"all": True})
-                        log(f"[{host_name}] 卷清理结果: {r}")
-                        volumes_deleted_list = r.get("VolumesDeleted") or []
-                        volumes_deleted = len(volumes_deleted_list) if volumes_deleted_list else 0
-                        space_reclaimed += int(r.get("SpaceReclaimed") or 0)
-                    except Exception as e:
-                        log(f"[{host_name}] 清理卷时出错: {e}")
-
-                if config.get("prune_build_cache"):
-                    try:
-                        log(f"[{host_name}] 清理构建缓存…")
-                        r = client.api.prune_builds()
-                        log(f"[{host_name}] 构建缓存清理结果: {r}")
-                        cache_ids_deleted = r.get("CachesDeleted") or []
-                        build_cache_deleted = len(cache_ids_deleted) if cache_ids_deleted else 0
-                        space_reclaimed += int(r.get("SpaceReclaimed") or 0)
-                    except Exception as e:
-                        log(f"[{host_name}] 清理构建缓存时出错: {e}")
-
-                log(f"[{host_name}] 清理完成: 容器={containers_deleted}, 镜像={images_deleted}, 网络={networks_deleted}, 卷={volumes_deleted}, 构建缓存={build_cache_deleted}, 空间={human_bytes(space_reclaimed)}")
-                
-                total_containers_deleted += containers_deleted
-                total_images_deleted += images_deleted
-                total_networks_deleted += networks_deleted
-                total_volumes_deleted += volumes_deleted
-                total_build_cache_deleted += build_cache_deleted
-                total_space_reclaimed += space_reclaimed
-                
-                host_results.append({
-                    "name": host_name,
-                    "url": host_url,
-                    "success": True,
-                    "containers": containers_deleted,
-                    "images": images_deleted,
-                    "networks": networks_deleted,
-                    "volumes": volumes_deleted,
-                    "build_cache": build_cache_deleted,
-                    "space": space_reclaimed,
-                })
-                
-            except Exception as e:
-                log(f"[{host_name}] 清理过程中出现意外错误: {e}")
-                host_results.append({
-                    "name": host_name,
-                    "url": host_url,
-                    "success": False,
-                    "error": str(e),
-                    "containers": 0,
-                    "images": 0,
-                    "networks": 0,
-                    "volumes": 0,
-                    "build_cache": 0,
-                    "space": 0,
-                })
+                with log_context(run_id=run_id, host=host_name), api_trace_span(trace, host_name):
+                    return _prune_host(host, prune_options, holder, job, run_id, trace, responses)
             finally:
-                if client is not None:
-                    try:
-                        client.close()
-                    except Exception:
-                        pass
-
+                _release_prune_host(host_url)
+
+        host_results = _run_per_host(all_hosts, prune_worker, _failed_prune_result, host_prune_timeout)
+        if trace is not None:
+            log_api_trace_summary(trace)
+
+        total_containers_deleted = sum(r["containers"] for r in host_results)
+        total_images_deleted = sum(r["images"] for r in host_results)
+        total_networks_deleted = sum(r["networks"] for r in host_results)
+        total_volumes_deleted = sum(r["volumes"] for r in host_results)
+        total_build_cache_deleted = sum(r["build_cache"] for r in host_results)
+        total_space_reclaimed = sum(r["space"] for r in host_results)
+
+        for i, result in enumerate(host_results):
+            _job_host_update(
+                job, i,
+                status="done" if result.get("success") else "failed",
+                phase=None,
+                error=result.get("error"),
+                result={k: result.get(k, 0) for k in HOST_COUNTER_KEYS},
+            )
+        run_totals = {
+            "containers": total_containers_deleted,
+            "images": total_images_deleted,
+            "networks": total_networks_deleted,
+            "volumes": total_volumes_deleted,
+            "build_cache": total_build_cache_deleted,
+            "space": total_space_reclaimed,
+        }
+        _job_update(job, totals=run_totals)
+
         log("所有主机的清理任务已完成。")
-
+        publish_event(
+            "run_finished", run_id=run_id, origin=origin,
+            totals=run_totals,
+            failed_hosts=[r["name"] for r in host_results if not r.get("success")],
+        )
+
         anything_deleted = any([
             total_containers_deleted, total_images_deleted, total_networks_deleted,
             total_volumes_deleted, total_build_cache_deleted, total_space_reclaimed > 0
         ])
-
-        update_stats(
-            containers=total_containers_deleted,
-            images=total_images_deleted,
-            networks=total_networks_deleted,
-            volumes=total_volumes_deleted,
-            build_cache=total_build_cache_deleted,
-            space=total_space_reclaimed
-        )
-
+
+        history_id = record_run(origin, run_started_at, time.time(), host_results, trace=trace)
+        _job_update(job, history_id=history_id)
+        # 产物文件以历史记录ID命名，历史数据库不可用时使用本次运行ID
+        artifact_path = write_run_artifact(history_id if history_id is not None else run_id, {
+            "run_id": run_id,
+            "history_id": history_id,
+            "origin": origin,
+            "started_at": _history_time(run_started_at),
+            "responses": list(responses),
+        })
+        if artifact_path is not None:
+            log(f"完整清理响应已写入 {artifact_path}", run_id=run_id)
+        status = "completed" if all(r.get("success") for r in host_results) else "partial"
+        if history_id is None:
+            # 累计统计由record_run写入历史数据库，stats.json由定时导出；数据库不可用时才直接累加stats.json
+            update_stats(
+                containers=total_containers_deleted,
+                images=total_images_deleted,
+                networks=total_networks_deleted,
+                volumes=total_volumes_deleted,
+                build_cache=total_build_cache_deleted,
+                space=total_space_reclaimed
+            )
+
+        failed_hosts = [r for r in host_results if not r.get("success")]
+        digest_enabled, _ = _digest_settings()
+        if digest_enabled and (anything_deleted or failed_hosts
+                               or not config.get("notifications", {}).get("only_on_changes", True)):
+            add_to_notification_digest(origin, host_results, urgent=bool(failed_hosts))
+            return True
+
         if not anything_deleted and config.get("notifications", {}).get("only_on_changes", True):
             log("未清理任何资源; 跳过通知。")
             return True
-
+
         summary_lines = [
-            f"📅 {describe_schedule()}",
+            "💽 磁盘用量超过阈值触发" if origin == "disk" else f"📅 {describe_schedule()}",
             "",
-        ]
-        
-        if len(all_hosts) > 1:
-            summary_lines.append("📊 按主机统计结果:")
-        
+        ]
+        
+        if len(all_hosts) > 1:
+            summary_lines.append("📊 按主机统计结果:")
+        
         for result in host_results:
             if result.get("success"):
-                has_deletions = any([result.get('containers'), result.get('images'), result.get('networks'), result.get('volumes'), result.get('build_cache')])
-                
-                if has_deletions:
-                    summary_lines.append(f"• {result['name']}")
-                    if result.get('containers'):
-                        summary_lines.append(f"  - 🗑️ {result['containers']} 个容器")
-                    if result.get('images'):
-                        summary_lines.append(f"  - 💿 {result['images']} 个镜像")
-                    if result.get('networks'):
-                        summary_lines.append(f"  - 🌐 {result['networks']} 个网络")
-                    if result.get('volumes'):
-                        summary_lines.append(f"  - 📦 {result['volumes']} 个卷")
-                    if result.get('build_cache'):
-                        summary_lines.append(f"  - 🏗️ {result['build_cache']} 个构建缓存")
-                    if result['space']:
-                        summary_lines.append(f"  - 💾 回收空间 {human_bytes(result['space'])}")
-                else:
-                    summary_lines.append(f"• {result['name']}: ✅ 无资源需要清理")
-            else:
-                summary_lines.append(f"• {result['name']}: ❌ {result.get('error', '未知错误')}")
-        
-        if len(all_hosts) > 1:
-            summary_lines.append("")
-        
-        if len(all_hosts) > 1:
-            summary_lines.append("📈 所有主机总计:")
-        if anything_deleted:
-            if total_containers_deleted:
-                summary_lines.append(f"  - 🗑️ 容器: {total_containers_deleted}")
-            if total_images_deleted:
-                summary_lines.append(f"  - 💿 镜像: {total_images_deleted}")
-            if total_networks_deleted:
-                summary_lines.append(f"  - 🌐 网络: {total_networks_deleted}")
-            if total_volumes_deleted:
-                summary_lines.append(f"  - 📦 卷: {total_volumes_deleted}")
-            if total_build_cache_deleted:
-                summary_lines.append(f"  - 🏗️ 构建缓存: {total_build_cache_deleted}")
-            if total_space_reclaimed:
-                summary_lines.append(f"  - 💾 回收空间: {human_bytes(total_space_reclaimed)}")
-        else:
-            summary_lines.append("✅ 本次运行无资源需要清理")
-
-        message = "\n".join(summary_lines)
-        notif_priority = config.get("notifications", {}).get("priority", "medium")
-        send_notification("PruneMate 清理完成", message, priority=notif_priority)
-        
-        return True
-    
+                has_deletions = any([result.get('containers'), result.get('images'), result.get('networks'), result.get('volumes'), result.get('build_cache')])
+                
+                if has_deletions:
+                    summary_lines.append(f"• {result['name']}")
+                    summary_lines.extend(_deletion_lines(result))
+                else:
+                    summary_lines.append(f"• {result['name']}: ✅ 无资源需要清理")
+            else:
+                summary_lines.append(f"• {result['name']}: ❌ {result.get('error', '未知错误')}")
+        
+        if len(all_hosts) > 1:
+            summary_lines.append("")
+        
+        if len(all_hosts) > 1:
+            summary_lines.append("📈 所有主机总计:")
+        if anything_deleted:
+            summary_lines.extend(_fleet_total_lines(run_totals))
+        else:
+            summary_lines.append("✅ 本次运行无资源需要清理")
+
+        message = "\n".join(summary_lines)
+        notif_priority = config.get("notifications", {}).get("priority", "medium")
+        # 通知在后台队列中发送，不在持有清理锁时等待提供商响应
+        queue_notification("PruneMate 清理完成", message, priority=notif_priority)
+        
+        return True
+    
+    except Exception:
+        if status == "skipped":
+            status = "failed"
+        raise
     finally:
+        inc_metric("prunemate_runs_total", origin=origin, status=status)
         if acquired:
             try:
                 lock.release()
@@ -1269,6 +3796,97 @@ def run_prune_job(origin: str = "unknown", wait: bool = False) -> bool:
                 pass
 
 
+# ---- 后台清理任务 ----
+# 手动清理在后台线程中排队执行，请求立即返回任务ID，前端轮询进度
+prune_jobs = {}
+prune_jobs_lock = threading.Lock()
+prune_job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prunemate-job")
+# 内存中保留的已结束任务数量
+MAX_FINISHED_JOBS = 20
+
+
+def _job_update(job: dict | None, **fields) -> None:
+    """更新后台任务的字段"""
+    if job is None:
+        return
+    with prune_jobs_lock:
+        job.update(fields)
+
+
+def _job_host_update(job: dict | None, index: int | None, **fields) -> None:
+    """更新后台任务中某个主机的进度"""
+    if job is None or index is None:
+        return
+    with prune_jobs_lock:
+        if index < len(job["hosts"]):
+            job["hosts"][index].update(fields)
+
+
+def _job_phase_update(job: dict | None, index: int | None, phase: str, result: dict) -> None:
+    """记录后台任务中某个主机某个清理阶段的结果"""
+    if job is None or index is None:
+        return
+    with prune_jobs_lock:
+        if index < len(job["hosts"]):
+            job["hosts"][index]["phases"][phase] = result
+
+
+def _job_snapshot(job: dict) -> dict:
+    """返回后台任务的只读副本，用于JSON响应"""
+    with prune_jobs_lock:
+        snapshot = json.loads(json.dumps(job))
+    snapshot["active"] = snapshot["status"] in ("queued", "running")
+    return snapshot
+
+
+def _trim_prune_jobs() -> None:
+    """只保留最近的已结束任务（调用方需持有prune_jobs_lock）"""
+    finished = [j for j in prune_jobs.values() if j["status"] not in ("queued", "running")]
+    finished.sort(key=lambda j: j["created_at"])
+    for j in finished[:-MAX_FINISHED_JOBS]:
+        del prune_jobs[j["id"]]
+
+
+def _run_background_job(job: dict) -> None:
+    """在后台线程中执行清理任务并记录最终状态"""
+    _job_update(job, status="running", started_at=datetime.datetime.now(app_timezone).isoformat())
+    status = "failed"
+    try:
+        ran = run_prune_job(origin=job["origin"], wait=True, job=job)
+        status = "finished" if ran else "skipped"
+        if not ran and not job.get("message"):
+            _job_update(job, message="清理任务跳过（另一个清理正在运行或等待锁超时）。")
+    except Exception as e:
+        log(f"后台清理任务 {job['id']} 失败: {e}")
+        _job_update(job, message=str(e))
+    finally:
+        _job_update(job, status=status, finished_at=datetime.datetime.now(app_timezone).isoformat())
+        publish_event("job_finished", run_id=job["id"], status=status, message=job.get("message"))
+        with prune_jobs_lock:
+            _trim_prune_jobs()
+
+
+def submit_prune_job(origin: str = "manual") -> dict:
+    """将清理任务加入后台队列并返回任务记录"""
+    job = {
+        "id": uuid.uuid4().hex[:12],
+        "origin": origin,
+        "status": "queued",
+        "created_at": datetime.datetime.now(app_timezone).isoformat(),
+        "started_at": None,
+        "finished_at": None,
+        "hosts": [],
+        "totals": None,
+        "message": None,
+    }
+    with prune_jobs_lock:
+        prune_jobs[job["id"]] = job
+    job["event_id"] = latest_event_id()
+    prune_job_executor.submit(_run_background_job, job)
+    log(f"清理任务 {job['id']} 已加入后台队列（{origin}）。")
+    return job
+
+
 def compute_run_key(now: datetime.datetime) -> str:
     """为当前计划任务生成唯一键"""
     freq = config.get("frequency", "daily")
@@ -1285,48 +3903,55 @@ def compute_run_key(now: datetime.datetime) -> str:
         return f"daily-{date_str}-{time_str}"
 
 
-def check_and_run_scheduled_job():
-    """检查是否到达计划清理时间并执行清理"""
-    load_config(silent=True)
-    
-    if not config.get("schedule_enabled", True):
-        return
-    
-    now = datetime.datetime.now(app_timezone)
-    freq = config.get("frequency", "daily")
+SCHEDULE_JOB_ID = "scheduled_prune"
+SCHEDULE_KEYS = ("schedule_enabled", "frequency", "time", "day_of_week", "day_of_month")
+# 计划任务状态：active在Worker的post_fork钩子中启用；signature为当前已应用的计划配置
+schedule_state = {"active": False, "signature": None}
+schedule_lock = threading.RLock()
+
+
+def build_schedule_trigger(cfg: dict):
+    """根据配置生成计划清理的触发器"""
     try:
-        time_str = config.get("time", "03:00")
-        hour_cfg, minute_cfg = [int(x) for x in time_str.split(":", 1)]
+        hour, minute = [int(x) for x in validate_time(cfg.get("time", "03:00")).split(":", 1)]
     except Exception:
-        hour_cfg, minute_cfg = 3, 0
-
-    hour_now = now.hour
-    minute_now = now.minute
-    should_run = False
-
-    if freq == "daily":
-        if hour_now == hour_cfg and minute_now == minute_cfg:
-            should_run = True
-    elif freq == "weekly":
-        day_map = {"mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6}
-        cfg_dow = day_map.get(config.get("day_of_week", "mon"), 0)
-        if now.weekday() == cfg_dow and hour_now == hour_cfg and minute_now == minute_cfg:
-            should_run = True
-    elif freq == "monthly":
+        hour, minute = 3, 0
+    freq = cfg.get("frequency", "daily")
+
+    if freq == "weekly":
+        day_of_week = cfg.get("day_of_week", "mon")
+        if day_of_week not in ("mon", "tue", "wed", "thu", "fri", "sat", "sun"):
+            day_of_week = "mon"
+        return CronTrigger(day_of_week=day_of_week, hour=hour, minute=minute, timezone=app_timezone)
+
+    if freq == "monthly":
         try:
-            dom_cfg = int(config.get("day_of_month", 1))
+            dom = int(cfg.get("day_of_month", 1))
         except Exception:
-            dom_cfg = 1
-        dom_cfg = max(1, min(31, dom_cfg))
-        _, last_day = calendar.monthrange(now.year, now.month)
-        actual_dom = min(dom_cfg, last_day)
-        if now.day == actual_dom and hour_now == hour_cfg and minute_now == minute_cfg:
-            should_run = True
-
-    if not should_run:
+            dom = 1
+        dom = max(1, min(31, dom))
+        trigger = CronTrigger(day=dom, hour=hour, minute=minute, timezone=app_timezone)
+        if dom <= 28:
+            return trigger
+        # 当月天数不足时在最后一天运行（例如31号在4月为30号，在2月为28/29号）
+        short_months = ["2"] + (["4", "6", "9", "11"] if dom == 31 else [])
+        last_day = CronTrigger(month=",".join(short_months), day="last", hour=hour, minute=minute, timezone=app_timezone)
+        return OrTrigger([trigger, last_day])
+
+    return CronTrigger(hour=hour, minute=minute, timezone=app_timezone)
+
+
+def scheduled_prune_job(scheduled_time: datetime.datetime | None = None):
+    """由Cron触发器调用的计划清理任务"""
+    load_config(silent=True)
+    if not config.get("schedule_enabled", True):
         return
-
-    key = compute_run_key(now)
+
+    now = datetime.datetime.now(app_timezone)
+    if scheduled_time is not None:
+        # 补跑任务：计划时间与实际开始时间之差（常规触发由_record_scheduler_lag记录）
+        observe_metric("prunemate_scheduler_lag_seconds", max(0.0, (now - scheduled_time).total_seconds()))
+    key = compute_run_key(scheduled_time or now)
     if last_run_key["value"] == key:
         log(f"计划任务已跳过: 已为键 '{key}' 执行过（内存检查）")
         return
@@ -1335,19 +3960,214 @@ def check_and_run_scheduled_job():
         last_run_key["value"] = key
         log(f"计划任务已跳过: 已为键 '{key}' 执行过（磁盘检查）")
         return
-
-    log(f"到达计划时间 ({freq}) 在 {hour_now:02d}:{minute_now:02d}，执行清理。")
+
+    delay = ""
+    if scheduled_time is not None and (now - scheduled_time).total_seconds() >= 60:
+        delay = f"（补跑，计划时间 {scheduled_time.isoformat(timespec='minutes')}）"
+    log(f"到达计划时间 ({config.get('frequency', 'daily')})，执行清理{delay}。")
     last_run_key["value"] = key
     _write_last_run_key(key)
-    ran = run_prune_job(origin="scheduled", wait=False)
-    if not ran:
-        pass
+    run_prune_job(origin="scheduled", wait=False)
+
+
+def _record_scheduler_lag(event) -> None:
+    """调度器提交计划清理任务时，记录计划时间与实际提交时间之差"""
+    if event.job_id != SCHEDULE_JOB_ID or not event.scheduled_run_times:
+        return
+    lag = datetime.datetime.now(app_timezone) - max(event.scheduled_run_times)
+    observe_metric("prunemate_scheduler_lag_seconds", max(0.0, lag.total_seconds()))
+
+
+scheduler.add_listener(_record_scheduler_lag, EVENT_JOB_SUBMITTED)
+
+
+def apply_schedule(force: bool = False) -> None:
+    """根据当前配置创建、更新或移除计划清理任务
+
+    配置中的计划字段未变化时不做任何操作，可在每次加载配置后调用。
+    """
+    if not schedule_state["active"]:
+        return
+    with schedule_lock:
+        signature = tuple(config.get(k) for k in SCHEDULE_KEYS)
+        if not force and signature == schedule_state["signature"]:
+            return
+        schedule_state["signature"] = signature
+
+        if not config.get("schedule_enabled", True):
+            if scheduler.get_job(SCHEDULE_JOB_ID):
+                scheduler.remove_job(SCHEDULE_JOB_ID)
+            log("自动计划已禁用; 已移除计划清理任务。")
+            return
+
+        trigger = build_schedule_trigger(config)
+        scheduler.add_job(
+            scheduled_prune_job,
+            trigger,
+            id=SCHEDULE_JOB_ID,
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+            misfire_grace_time=schedule_misfire_grace,
+        )
+        next_run = get_next_run_time()
+        log(f"计划清理任务已更新: {describe_schedule()}，下次运行: {next_run.isoformat(timespec='minutes') if next_run else '无'}")
+
+
+def get_next_run_time() -> datetime.datetime | None:
+    """返回计划清理任务的下次运行时间，未启用时返回None"""
+    if schedule_state["active"]:
+        job = scheduler.get_job(SCHEDULE_JOB_ID)
+        return job.next_run_time if job else None
+    if not config.get("schedule_enabled", True):
+        return None
+    # 调度器未启用任务时（例如在测试或工具中导入），直接从触发器计算
+    now = datetime.datetime.now(app_timezone)
+    return build_schedule_trigger(config).get_next_fire_time(None, now)
+
+
+def catch_up_missed_run() -> None:
+    """启动时补跑在宽限窗口内错过的计划清理（例如进程在计划时间重启）"""
+    if not config.get("schedule_enabled", True):
+        return
+    now = datetime.datetime.now(app_timezone)
+    window_start = now - datetime.timedelta(seconds=schedule_misfire_grace)
+    trigger = build_schedule_trigger(config)
+    missed = None
+    fire_time = trigger.get_next_fire_time(None, window_start)
+    while fire_time is not None and fire_time <= now:
+        missed = fire_time
+        fire_time = trigger.get_next_fire_time(fire_time, fire_time + datetime.timedelta(seconds=1))
+    if missed is None:
+        return
+    key = compute_run_key(missed)
+    if key in (last_run_key["value"], _read_last_run_key()):
+        return
+    log(f"检测到错过的计划清理（{missed.isoformat(timespec='minutes')}）; 在宽限窗口内补跑。")
+    scheduler.add_job(scheduled_prune_job, args=[missed], id="scheduled_prune_catch_up", replace_existing=True)
+
+
+# ---- 磁盘用量触发 ----
+# 计划任务进程每隔PRUNEMATE_DISK_CHECK_INTERVAL秒采样所有主机的磁盘用量，
+# 超过阈值的主机立即清理。触发后该主机进入“已触发”状态，直到用量降到reset_gb以下才重新启用，
+# 避免用量在阈值附近波动时反复清理；两次清理（任何来源）之间至少间隔min_interval分钟。
+disk_trigger_state = {}
+DISK_TRIGGER_METRICS = {"reclaimable": "可回收空间", "used": "已用空间"}
+
+
+def _disk_trigger_settings() -> dict:
+    """返回校验后的磁盘用量触发配置（阈值换算为字节）"""
+    settings = config.get("disk_trigger") or {}
+    metric = settings.get("metric")
+    if metric not in DISK_TRIGGER_METRICS:
+        metric = "reclaimable"
+    try:
+        threshold = max(0.1, float(settings.get("threshold_gb", 20)))
+    except (TypeError, ValueError):
+        threshold = 20.0
+    try:
+        reset = max(0.0, min(threshold, float(settings.get("reset_gb", threshold))))
+    except (TypeError, ValueError):
+        reset = threshold
+    try:
+        min_interval = max(0, int(settings.get("min_interval", 60)))
+    except (TypeError, ValueError):
+        min_interval = 60
+    return {
+        "enabled": bool(settings.get("enabled")),
+        "metric": metric,
+        "threshold": int(threshold * 1024 ** 3),
+        "reset": int(reset * 1024 ** 3),
+        "min_interval": min_interval * 60,
+    }
+
+
+def _df_used_bytes(df_result: dict) -> int:
+    """/system/df中镜像层、容器可写层、卷和构建缓存占用的总字节数"""
+    used = int(df_result.get("LayersSize") or 0)
+    used += sum(max(0, int(c.get("SizeRw") or 0)) for c in df_result.get("Containers") or [])
+    used += sum(max(0, int((v.get("UsageData") or {}).get("Size") or 0)) for v in df_result.get("Volumes") or [])
+    used += sum(max(0, int(b.get("Size") or 0)) for b in df_result.get("BuildCache") or [])
+    return used
+
+
+def _sample_disk_usage(host: dict, metric: str, options: dict, holder: dict) -> dict:
+    """采样单个主机的磁盘用量：reclaimable使用预览的预计释放空间，used使用/system/df"""
+    if metric == "reclaimable":
+        preview = _cached_preview_host(host, options, holder)
+        if not preview.get("success"):
+            return {"value": None, "error": preview.get("error", "预览失败")}
+        return {"value": int(preview.get("estimated_space") or 0)}
+    host_url = host.get("url", "unix:///var/run/docker.sock")
+    client = get_docker_client(host_url)
+    if client is None:
+        return {"value": None, "error": "连接失败"}
+    holder["client"] = client
+    try:
+        return {"value": _df_used_bytes(client.api.df() or {})}
+    finally:
+        release_docker_client(host_url, client)
+
 
+def check_disk_triggers() -> None:
+    """采样所有主机的磁盘用量，对超过阈值、已重新启用且满足最小间隔的主机执行清理"""
+    load_config(silent=True)
+    settings = _disk_trigger_settings()
+    if not settings["enabled"] or docker is None:
+        return
+    options = _selected_prune_options()
+    if not any(options.values()):
+        return
+    metric = settings["metric"]
+    metric_label = DISK_TRIGGER_METRICS[metric]
+    hosts = _preview_hosts()
+    samples = _run_per_host(
+        hosts,
+        lambda host, holder: _sample_disk_usage(host, metric, options, holder),
+        lambda host, error: {"value": None, "error": error},
+        host_preview_timeout,
+    )
+
+    now = time.time()
+    due = []
+    for host, sample in zip(hosts, samples):
+        host_name = host.get("name", "未命名")
+        host_url = host.get("url", "unix:///var/run/docker.sock")
+        value = sample.get("value")
+        if value is None:
+            log(f"[{host_name}] 磁盘用量采样失败: {sample.get('error')}")
+            continue
+        state = disk_trigger_state.setdefault(host_url, {"armed": True, "triggered_at": None})
+        state.update(value=value, sampled_at=now)
+        if not state["armed"]:
+            if value < settings["reset"]:
+                state["armed"] = True
+                log(f"[{host_name}] {metric_label} {human_bytes(value)} 已低于 {human_bytes(settings['reset'])}; 磁盘用量触发已重新启用。")
+            continue
+        if value < settings["threshold"]:
+            continue
+        last_prune = max(state["triggered_at"] or 0, _host_last_prune(host_url) or 0)
+        if now - last_prune < settings["min_interval"]:
+            continue
+        log(f"[{host_name}] {metric_label} {human_bytes(value)} 超过阈值 {human_bytes(settings['threshold'])}。")
+        due.append(host)
+
+    if not due:
+        return
+    for host in due:
+        disk_trigger_state[host["url"]].update(armed=False, triggered_at=now)
+    if not run_prune_job(origin="disk", wait=False, host_urls=[h["url"] for h in due]):
+        # 清理未执行（例如另一个清理正在进行），下次采样时重新判断
+        for host in due:
+            disk_trigger_state[host["url"]].update(armed=True, triggered_at=None)
 
-def heartbeat():
-    """心跳函数，每分钟检查一次计划任务"""
-    log("心跳: 调度器运行正常。")
-    check_and_run_scheduled_job()
+
+def format_next_run(dt: datetime.datetime | None) -> str | None:
+    """格式化下次运行时间，遵循12/24小时制设置"""
+    if dt is None:
+        return None
+    dt = dt.astimezone(app_timezone)
+    return f"{dt.strftime('%Y-%m-%d')} {format_time(dt.strftime('%H:%M'))}"
 
 
 # ---- 认证逻辑 ----
@@ -1390,7 +4210,7 @@ def require_auth():
     if not is_auth_enabled():
         return
 
-    if request.endpoint in ('static', 'login', 'logout', 'stats', 'api_stats'):
+    if request.endpoint in ('static', 'login', 'logout', 'stats', 'api_stats', 'metrics'):
         return
 
     if session.get('logged_in'):
@@ -1400,17 +4220,17 @@ def require_auth():
     if auth:
         if check_auth(auth.username, auth.password):
             return
-    
+    
     ua = request.user_agent.string.lower()
     is_browser = any(x in ua for x in ['mozilla', 'chrome', 'safari', 'edge']) and 'curl' not in ua and 'python' not in ua
-    
+    
     if not is_browser or request_wants_json() or request.path.startswith('/api/'):
         return Response(
             '无法验证您的访问权限。\n'
             '您需要使用正确的凭据登录。', 401,
             {'WWW-Authenticate': 'Basic realm="PruneMate 登录"'}
         )
-    
+    
     return redirect(url_for('login'))
 
 
@@ -1422,23 +4242,23 @@ def login():
 
     if not is_auth_enabled():
         return redirect(url_for("index"))
-        
+        
     if request.method == "POST":
         username = request.form.get("username")
         password = request.form.get("password")
-        
+        
         if check_auth(username, password):
             session['logged_in'] = True
             session['user'] = username
-            
+            
             next_url = request.args.get('next')
             if not next_url or next_url.startswith('//') or ':' in next_url:
                 next_url = url_for('index')
-            
+            
             return redirect(next_url)
         else:
             flash("无效的凭据", "error")
-            
+            
     return render_template("login.html")
 
 
@@ -1453,7 +4273,8 @@ def logout():
 def index():
     """主页配置页面"""
     load_config(silent=True)
-    return render_template("index.html", config=config, timezone=tz_name, config_path=CONFIG_PATH, use_24h=use_24h_format)
+    next_run = format_next_run(get_next_run_time())
+    return render_template("index.html", config=config, timezone=tz_name, config_path=CONFIG_PATH, use_24h=use_24h_format, next_run=next_run)
 
 
 @app.route("/update", methods=["POST"])
@@ -1471,15 +4292,15 @@ def update():
             hour_12 = int(request.form.get("time_hour", "3"))
             minute = int(request.form.get("time_minute", "0"))
             period = request.form.get("time_period", "AM")
-            
+            
             hour_12 = max(1, min(12, hour_12))
             minute = max(0, min(59, minute))
-            
+            
             if period == "AM":
                 hour_24 = 0 if hour_12 == 12 else hour_12
             else:
                 hour_24 = 12 if hour_12 == 12 else hour_12 + 12
-            
+            
             time_value = f"{hour_24:02d}:{minute:02d}"
         except Exception:
             time_value = "03:00"
@@ -1516,6 +4337,37 @@ def update():
     if notification_priority not in ["low", "medium", "high"]:
         notification_priority = "medium"
     only_on_changes = "notifications_only_on_changes" in request.form
+    send_to_all = "notifications_send_to_all" in request.form
+    digest_enabled = "notifications_digest_enabled" in request.form
+    try:
+        digest_window = max(1, min(1440, int(request.form.get("notifications_digest_window", "60"))))
+    except ValueError:
+        digest_window = 60
+
+    try:
+        reclaim_target_gb = max(0.0, float(request.form.get("reclaim_target_gb", "10")))
+    except ValueError:
+        reclaim_target_gb = 10.0
+    try:
+        reclaim_image_age = max(1, min(8760, int(request.form.get("reclaim_image_age_hours", "72"))))
+    except ValueError:
+        reclaim_image_age = 72
+
+    disk_trigger_metric = request.form.get("disk_trigger_metric", "reclaimable")
+    if disk_trigger_metric not in DISK_TRIGGER_METRICS:
+        disk_trigger_metric = "reclaimable"
+    try:
+        disk_trigger_threshold = max(0.1, float(request.form.get("disk_trigger_threshold_gb", "20")))
+    except ValueError:
+        disk_trigger_threshold = 20.0
+    try:
+        disk_trigger_reset = max(0.0, min(disk_trigger_threshold, float(request.form.get("disk_trigger_reset_gb", "15"))))
+    except ValueError:
+        disk_trigger_reset = min(15.0, disk_trigger_threshold)
+    try:
+        disk_trigger_interval = max(0, min(10080, int(request.form.get("disk_trigger_min_interval", "60"))))
+    except ValueError:
+        disk_trigger_interval = 60
 
     if provider == "gotify" and not gotify_enabled and gotify_url and gotify_token:
         gotify_enabled = True
@@ -1547,6 +4399,21 @@ def update():
             "telegram": {"enabled": telegram_enabled, "bot_token": telegram_bot_token, "chat_id": telegram_chat_id},
             "priority": notification_priority,
             "only_on_changes": only_on_changes,
+            "send_to_all": send_to_all,
+            "digest_enabled": digest_enabled,
+            "digest_window": digest_window,
+        },
+        "reclaim_target": {
+            "enabled": "reclaim_target_enabled" in request.form,
+            "target_gb": reclaim_target_gb,
+            "image_age_hours": reclaim_image_age,
+        },
+        "disk_trigger": {
+            "enabled": "disk_trigger_enabled" in request.form,
+            "metric": disk_trigger_metric,
+            "threshold_gb": disk_trigger_threshold,
+            "reset_gb": disk_trigger_reset,
+            "min_interval": disk_trigger_interval,
         },
     }
 
@@ -1569,18 +4436,17 @@ def run_now():
     """立即执行清理"""
     load_config(silent=True)
     log("手动清理触发已收到。")
-    ran = run_prune_job(origin="manual", wait=True)
-    flash("手动清理已执行。" if ran else "清理任务跳过（忙或超时）。", "info")
+    job = submit_prune_job(origin="manual")
+    flash(f"手动清理已在后台开始（任务 {job['id']}）。", "info")
     return redirect(url_for("index"))
 
 
-@app.route("/preview-prune", methods=["POST"])
-def preview_prune():
-    """获取清理预览"""
+def _save_preview_options() -> dict:
+    """读取预览请求体，其中包含清理选项时保存到配置，返回请求体"""
     load_config(silent=True)
-    
+    data = {}
     try:
-        data = request.get_json() or {}
+        data = request.get_json(silent=True) or {}
         if any(k in data for k in ["prune_containers", "prune_images", "prune_networks", "prune_volumes", "prune_build_cache"]):
             config["prune_containers"] = data.get("prune_containers", False)
             config["prune_images"] = data.get("prune_images", False)
@@ -1591,17 +4457,115 @@ def preview_prune():
             log("清理预览请求已收到并保存更新后的配置。")
     except Exception as e:
         log(f"解析清理预览请求体时出错: {e}")
+    return data
+
+
+@app.route("/preview-prune", methods=["POST"])
+def preview_prune():
+    """获取清理预览（?totals=1 或请求体中 "totals_only": true 时只返回数量）"""
+    data = _save_preview_options()
+    totals_only = request.args.get("totals") in ("1", "true", "yes") or bool(data.get("totals_only"))
     
     log("清理预览请求已收到。")
-    preview = get_prune_preview()
+    preview = get_prune_preview(totals_only=totals_only)
     return jsonify(preview)
 
 
+# 流式预览中每行最多包含的资源条目数
+PREVIEW_STREAM_CHUNK = 500
+
+
+@app.route("/preview-prune/stream", methods=["POST"])
+def preview_prune_stream():
+    """以NDJSON流式返回清理预览：每个主机完成后立即发送其摘要和各类别明细
+
+    与SSE事件流共用长连接槽位，响应关闭时归还。
+    """
+    rejected = _acquire_stream_slot("流式连接数已达上限，请稍后重试或使用 /preview-prune")
+    if rejected is not None:
+        return rejected
+    try:
+        _save_preview_options()
+    except Exception:
+        event_stream_slots.release()
+        raise
+    log("流式清理预览请求已收到。")
+    results = queue.Queue()
+
+    def produce():
+        try:
+            preview = get_prune_preview(totals_only=True, on_host=lambda result: results.put(("host", result)))
+            results.put(("done", preview))
+        except Exception as e:
+            log(f"流式预览出错: {e}")
+            results.put(("done", {"error": str(e), "hosts": []}))
+
+    threading.Thread(target=produce, name="prunemate-preview-stream", daemon=True).start()
+
+    def generate():
+        while True:
+            kind, payload = results.get()
+            if kind == "done":
+                payload.pop("hosts", None)
+                yield json.dumps({"type": "totals", **payload}, ensure_ascii=False) + "\n"
+                return
+            yield json.dumps({"type": "host", **_preview_host_summary(payload)}, ensure_ascii=False) + "\n"
+            for category in PREVIEW_CATEGORIES:
+                items = payload.get(category) or []
+                for offset in range(0, len(items), PREVIEW_STREAM_CHUNK):
+                    yield json.dumps({
+                        "type": "items",
+                        "host": payload.get("name"),
+                        "url": payload.get("url"),
+                        "category": category,
+                        "offset": offset,
+                        "items": items[offset:offset + PREVIEW_STREAM_CHUNK],
+                    }, ensure_ascii=False) + "\n"
+
+    response = Response(generate(), mimetype="application/x-ndjson")
+    response.call_on_close(event_stream_slots.release)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@app.route("/preview-prune/host")
+def preview_prune_host():
+    """分页返回单个主机某个类别的预览明细（使用预览缓存，翻页期间结果一致）"""
+    load_config(silent=True)
+    host_url = request.args.get("url", "unix:///var/run/docker.sock")
+    category = request.args.get("category", "")
+    if category not in PREVIEW_CATEGORIES:
+        return jsonify({"error": f"无效的类别，可选: {', '.join(PREVIEW_CATEGORIES)}"}), 400
+    offset = max(0, request.args.get("offset", 0, type=int))
+    limit = min(max(1, request.args.get("limit", 100, type=int)), 1000)
+
+    host = next((h for h in _preview_hosts() if h.get("url") == host_url), None)
+    if host is None:
+        return jsonify({"error": "主机不存在或未启用"}), 404
+    if docker is None:
+        return jsonify({"error": "Docker SDK不可用"}), 503
+
+    result = _cached_preview_host(host, _selected_prune_options(), {})
+    if not result.get("success"):
+        return jsonify({"name": result.get("name"), "url": host_url, "error": result.get("error")}), 502
+    items = result.get(category) or []
+    return jsonify({
+        "name": result.get("name"),
+        "url": host_url,
+        "category": category,
+        "total": len(items),
+        "offset": offset,
+        "limit": limit,
+        "items": items[offset:offset + limit],
+    })
+
+
 @app.route("/run-confirmed", methods=["POST"])
 def run_confirmed():
     """确认后执行清理"""
     load_config(silent=True)
-    
+    
     try:
         data = request.get_json() or {}
         if any(k in data for k in ["prune_containers", "prune_images", "prune_networks", "prune_volumes", "prune_build_cache"]):
@@ -1616,11 +4580,95 @@ def run_confirmed():
         log(f"解析确认清理请求体时出错: {e}")
     
     log("确认手动清理触发已收到。")
-    ran = run_prune_job(origin="manual", wait=True)
+    job = submit_prune_job(origin="manual")
     return jsonify({
-        "success": ran,
-        "message": "清理任务已成功执行。" if ran else "清理任务跳过（忙或超时）。"
-    })
+        "success": True,
+        "job_id": job["id"],
+        "status_url": url_for("job_status", job_id=job["id"]),
+        "events_url": url_for("event_stream", last_id=job["event_id"]),
+        "message": "清理任务已加入后台队列。"
+    }), 202
+
+
+@app.route("/jobs")
+def list_jobs():
+    """列出后台清理任务（?active=1 仅返回排队中和运行中的任务）"""
+    with prune_jobs_lock:
+        jobs = list(prune_jobs.values())
+    snapshots = [_job_snapshot(j) for j in jobs]
+    if request.args.get("active") in ("1", "true", "yes"):
+        snapshots = [j for j in snapshots if j["active"]]
+    snapshots.sort(key=lambda j: j["created_at"], reverse=True)
+    return jsonify({"jobs": snapshots})
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """返回后台清理任务的状态及每个主机和阶段的进度"""
+    with prune_jobs_lock:
+        job = prune_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "任务不存在"}), 404
+    return jsonify(_job_snapshot(job))
+
+
+# 长连接槽位（SSE事件流和NDJSON流式预览共用）：Gunicorn额外预留同样数量的线程，长连接不会占用其他路由需要的线程
+event_stream_slots = threading.BoundedSemaphore(max_event_streams) if max_event_streams else None
+# 无事件时发送保活注释的间隔，以及单个连接的最长时间（之后浏览器按Last-Event-ID自动重连）
+EVENT_KEEPALIVE_SECONDS = 15
+EVENT_STREAM_MAX_AGE = 300
+
+
+def _acquire_stream_slot(message: str):
+    """占用一个长连接槽位，成功时返回None；已满时返回503响应"""
+    if event_stream_slots is not None and event_stream_slots.acquire(blocking=False):
+        return None
+    response = jsonify({"error": message})
+    response.status_code = 503
+    response.headers["Retry-After"] = "10"
+    return response
+
+
+def _format_sse(event: dict) -> str:
+    """把事件编码为SSE消息"""
+    data = json.dumps({"time": event["time"], **event["data"]}, ensure_ascii=False)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+@app.route("/events")
+def event_stream():
+    """通过Server-Sent Events实时推送清理进度和日志行"""
+    rejected = _acquire_stream_slot("实时事件流连接数已达上限")
+    if rejected is not None:
+        return rejected
+
+    raw_last_id = request.headers.get("Last-Event-ID") or request.args.get("last_id")
+    try:
+        last_id = int(raw_last_id) if raw_last_id is not None else latest_event_id()
+    except ValueError:
+        last_id = latest_event_id()
+    types = set(filter(None, request.args.get("types", "").split(",")))
+
+    def generate():
+        nonlocal last_id
+        deadline = time.monotonic() + EVENT_STREAM_MAX_AGE
+        yield "retry: 3000\n\n"
+        while time.monotonic() < deadline:
+            events = wait_for_events(last_id, EVENT_KEEPALIVE_SECONDS)
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for event in events:
+                last_id = event["id"]
+                if not types or event["type"] in types:
+                    yield _format_sse(event)
+
+    response = Response(generate(), mimetype="text/event-stream")
+    # 客户端断开或流结束时由WSGI服务器调用close()，归还连接槽位
+    response.call_on_close(event_stream_slots.release)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
 
 
 @app.route("/test-notification", methods=["POST"])
@@ -1638,15 +4686,15 @@ def test_notification():
             hour_12 = int(request.form.get("time_hour", "3"))
             minute = int(request.form.get("time_minute", "0"))
             period = request.form.get("time_period", "AM")
-            
+            
             hour_12 = max(1, min(12, hour_12))
             minute = max(0, min(59, minute))
-            
+            
             if period == "AM":
                 hour_24 = 0 if hour_12 == 12 else hour_12
             else:
                 hour_24 = 12 if hour_12 == 12 else hour_12 + 12
-            
+            
             time_value = f"{hour_24:02d}:{minute:02d}"
         except Exception:
             time_value = "03:00"
@@ -1682,6 +4730,12 @@ def test_notification():
     if notification_priority not in ["low", "medium", "high"]:
         notification_priority = "medium"
     only_on_changes = "notifications_only_on_changes" in request.form
+    send_to_all = "notifications_send_to_all" in request.form
+    digest_enabled = "notifications_digest_enabled" in request.form
+    try:
+        digest_window = max(1, min(1440, int(request.form.get("notifications_digest_window", "60"))))
+    except ValueError:
+        digest_window = 60
 
     if provider == "gotify" and not gotify_enabled and gotify_url and gotify_token:
         gotify_enabled = True
@@ -1712,6 +4766,9 @@ def test_notification():
             "telegram": {"enabled": telegram_enabled, "bot_token": telegram_bot_token, "chat_id": telegram_chat_id},
             "priority": notification_priority,
             "only_on_changes": only_on_changes,
+            "send_to_all": send_to_all,
+            "digest_enabled": digest_enabled,
+            "digest_window": digest_window,
         },
     }
 
@@ -1725,41 +4782,69 @@ def test_notification():
         _clear_last_run_key()
 
     save_config()
-    
+    
     log("从UI请求通知测试。")
     test_priority = config.get("notifications", {}).get("priority", "medium")
-    ok = send_notification(
+    results = send_notifications(
         "PruneMate 测试通知",
         "这是来自 PruneMate 的测试消息。\n\n如果您看到此消息，说明您的通知提供商配置工作正常。",
         priority=test_priority,
     )
-    flash("配置已保存。 " + ("测试通知已发送。" if ok else "测试通知发送失败（请检查设置和日志）。"), "info")
+    if len(results) > 1:
+        report = "，".join(
+            f"{NOTIFY_PROVIDER_LABELS.get(p, p)} " + ("✅" if r["ok"] else f"❌ {r['error']}")
+            for p, r in results.items()
+        )
+        flash(f"配置已保存。 测试通知结果: {report}", "info")
+    else:
+        ok = any(r["ok"] for r in results.values())
+        flash("配置已保存。 " + ("测试通知已发送。" if ok else "测试通知发送失败（请检查设置和日志）。"), "info")
     return redirect(url_for("index"))
 
 
-@app.route("/stats")
-def stats():
-    """返回历史统计数据"""
-    return jsonify(load_stats())
+def _stats_response(name: str, build_payload, variant: str = ""):
+    """返回带ETag/Last-Modified的统计响应，条件请求命中时返回304
 
+    响应体按 (端点, 变体) 缓存，统计未变化时不再重复编码JSON。
+    """
+    cached = get_cached_stats()
+    etag = hashlib.sha1(f"{cached['etag']}:{name}:{variant}".encode("utf-8")).hexdigest()[:20]
 
-@app.route("/api/stats")
-def api_stats():
-    """返回格式化的统计数据"""
-    stats = load_stats()
-    
+    if request.if_none_match and etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        body = cached["bodies"].get((name, variant))
+        if body is None:
+            body = app.json.dumps(build_payload(cached["stats"])) + "\n"
+            if len(cached["bodies"]) >= 32:
+                cached["bodies"].clear()
+            cached["bodies"][(name, variant)] = body
+        response = Response(body, mimetype="application/json")
+
+    response.set_etag(etag)
+    if cached["last_modified"] is not None:
+        response.last_modified = cached["last_modified"]
+    response.cache_control.public = True
+    response.cache_control.max_age = 10
+    if response.status_code == 200:
+        response.make_conditional(request)
+    return response
+
+
+def _describe_last_run(stats: dict) -> tuple:
+    """返回上次运行的相对时间描述和Unix时间戳"""
     last_run_text = "从未"
     last_run_timestamp = None
     if stats.get("last_run"):
         try:
             last_run_dt = datetime.datetime.fromisoformat(stats["last_run"])
             now = datetime.datetime.now(app_timezone)
-            
+            
             if last_run_dt.tzinfo is None:
                 last_run_dt = last_run_dt.replace(tzinfo=app_timezone)
-            
+            
             delta = now - last_run_dt
-            
+            
             if delta.days > 0:
                 last_run_text = f"{delta.days}天前"
             elif delta.seconds >= 3600:
@@ -1770,7 +4855,7 @@ def api_stats():
                 last_run_text = f"{minutes}分钟前"
             else:
                 last_run_text = "刚刚"
-            
+            
             last_run_timestamp = int(last_run_dt.timestamp())
         except (ValueError, TypeError, OSError) as e:
             log(f"解析上次运行时间戳时出错: {e}")
@@ -1778,8 +4863,21 @@ def api_stats():
         except Exception as e:
             log(f"/api/stats 时间戳计算中出现意外错误: {e}")
             last_run_text = "未知"
-    
-    return jsonify({
+    return last_run_text, last_run_timestamp
+
+
+@app.route("/stats")
+def stats():
+    """返回历史统计数据"""
+    return _stats_response("stats", lambda stats: stats)
+
+
+@app.route("/api/stats")
+def api_stats():
+    """返回格式化的统计数据"""
+    last_run_text, last_run_timestamp = _describe_last_run(get_cached_stats()["stats"])
+    
+    return _stats_response("api_stats", lambda stats: {
         "pruneRuns": stats.get("prune_runs", 0),
         "containersDeleted": stats.get("containers_deleted", 0),
         "imagesDeleted": stats.get("images_deleted", 0),
@@ -1792,6 +4890,127 @@ def api_stats():
         "lastRun": stats.get("last_run"),
         "lastRunText": last_run_text,
         "lastRunTimestamp": last_run_timestamp
+    }, variant=last_run_text)
+
+
+@app.route("/metrics")
+def metrics():
+    """以Prometheus文本格式导出运行指标（与/stats一样无需登录）"""
+    return Response(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.route("/api/history")
+def api_history():
+    """返回最近的清理运行记录及每个主机的结果"""
+    try:
+        limit = max(1, min(500, int(request.args.get("limit", 50))))
+    except ValueError:
+        limit = 50
+    host_url = (request.args.get("host") or "").strip() or None
+    since = None
+    if request.args.get("days"):
+        try:
+            since = time.time() - float(request.args["days"]) * 86400
+        except ValueError:
+            return jsonify({"error": "days参数无效"}), 400
+    try:
+        return jsonify({"runs": query_run_history(limit=limit, host_url=host_url, since=since)})
+    except Exception as e:
+        log(f"/api/history 查询出错: {e}")
+        return jsonify({"error": str(e), "runs": []}), 500
+
+
+@app.route("/api/history/hosts")
+def api_history_hosts():
+    """返回每个主机的累计清理结果，可用days参数限定时间范围"""
+    since = None
+    if request.args.get("days"):
+        try:
+            since = time.time() - float(request.args["days"]) * 86400
+        except ValueError:
+            return jsonify({"error": "days参数无效"}), 400
+    try:
+        return jsonify({"hosts": query_host_totals(since=since)})
+    except Exception as e:
+        log(f"/api/history/hosts 查询出错: {e}")
+        return jsonify({"error": str(e), "hosts": []}), 500
+
+
+def _trace_response(trace: dict):
+    """按format参数返回追踪记录：默认为调用列表和汇总，flame为Chrome Trace Event格式"""
+    if request.args.get("format") == "flame":
+        response = jsonify(api_trace_flame(trace))
+        if request.args.get("download") in ("1", "true", "yes"):
+            response.headers["Content-Disposition"] = "attachment; filename=prunemate-trace.json"
+        return response
+    return jsonify(trace)
+
+
+@app.route("/api/history/<int:run_id>/trace")
+def api_history_trace(run_id):
+    """返回某次清理运行的Docker API调用追踪（?format=flame 导出火焰图）"""
+    try:
+        trace = load_run_trace(run_id)
+    except Exception as e:
+        log(f"/api/history/{run_id}/trace 查询出错: {e}")
+        return jsonify({"error": str(e)}), 500
+    if trace is None:
+        return jsonify({"error": "该运行没有追踪记录"}), 404
+    return _trace_response(trace)
+
+
+@app.route("/api/history/<run_id>/responses")
+def api_history_responses(run_id):
+    """返回某次清理运行的完整Docker清理响应（?download=1 下载gzip文件）"""
+    if not re.fullmatch(r"[0-9A-Za-z]+", run_id):
+        return jsonify({"error": "运行ID无效"}), 400
+    if request.args.get("download") in ("1", "true", "yes"):
+        path = _run_artifact_path(run_id)
+        if not path.exists():
+            return jsonify({"error": "该运行没有保存清理响应"}), 404
+        response = make_response(path.read_bytes())
+        response.headers["Content-Type"] = "application/gzip"
+        response.headers["Content-Disposition"] = f"attachment; filename=prunemate-run-{run_id}.json.gz"
+        return response
+    try:
+        artifact = load_run_artifact(run_id)
+    except Exception as e:
+        log(f"/api/history/{run_id}/responses 读取出错: {e}")
+        return jsonify({"error": str(e)}), 500
+    if artifact is None:
+        return jsonify({"error": "该运行没有保存清理响应"}), 404
+    return jsonify(artifact)
+
+
+@app.route("/api/preview/trace")
+def api_preview_trace():
+    """返回最近一次预览的Docker API调用追踪（?format=flame 导出火焰图）"""
+    trace = last_preview_trace["value"]
+    if trace is None:
+        return jsonify({"error": "尚无预览追踪记录"}), 404
+    return _trace_response(export_api_trace(trace))
+
+
+@app.route("/api/notifications")
+def api_notifications():
+    """返回最近的后台通知发送结果和等待发送（含等待重试）的数量"""
+    with notify_condition:
+        pending = [
+            {"provider": item["provider"], "title": item["title"], "attempts": item["attempts"]}
+            for _, _, item in sorted(notify_pending, key=lambda e: e[0])
+        ]
+    with FileLock(str(NOTIFY_DIGEST_LOCK)):
+        digest = _read_digest()
+    digest_enabled, window = _digest_settings()
+    return jsonify({
+        "targets": notification_targets(),
+        "digest": {
+            "enabled": digest_enabled,
+            "runs": len(digest["runs"]) if digest else 0,
+            "flush_at": _history_time(digest["opened_at"] + window) if digest else None,
+        },
+        "pending": pending,
+        "results": list(reversed(notify_results)),
     })
 
 
@@ -1800,44 +5019,58 @@ def list_hosts():
     """返回Docker主机列表"""
     load_config(silent=True)
     external_hosts = config.get("docker_hosts", [])
-    
+    
     all_hosts = [
         {"name": "本地", "url": "unix:///var/run/docker.sock", "enabled": True}
     ] + external_hosts
-    
+    
     return jsonify({"hosts": all_hosts})
 
 
+def _host_reclaim_target_from_form():
+    """解析主机表单中的回收目标（GB），与全局回收目标同样校验；留空或无效时返回None（使用全局目标）"""
+    value = (request.form.get("reclaim_target_gb") or "").strip()
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
 @app.route("/hosts/add", methods=["POST"])
 def add_host():
     """添加新的Docker主机"""
     load_config(silent=True)
-    
+    
     name = (request.form.get("name") or "").strip()
     url = (request.form.get("url") or "").strip()
     enabled = "enabled" in request.form
-    
+    
     if not name or not url:
         flash("主机名称和URL是必填项。", "warn")
         return redirect(url_for("index"))
-    
+    
     valid_protocols = ["tcp://", "http://", "https://"]
     if not any(url.startswith(proto) for proto in valid_protocols):
         flash("URL必须以 tcp://, http://, 或 https:// 开头", "warn")
         return redirect(url_for("index"))
-    
+    
     new_host = {
         "name": name,
         "url": url,
         "enabled": enabled
     }
-    
+    reclaim_target_gb = _host_reclaim_target_from_form()
+    if reclaim_target_gb is not None:
+        new_host["reclaim_target_gb"] = reclaim_target_gb
+    
     if "docker_hosts" not in config:
         config["docker_hosts"] = []
-    
+    
     config["docker_hosts"].append(new_host)
     save_config()
-    
+    
     flash(f"Docker主机 '{name}' 添加成功。", "info")
     return redirect(url_for("index"))
 
@@ -1846,34 +5079,37 @@ def add_host():
 def update_host(index):
     """更新现有的Docker主机"""
     load_config(silent=True)
-    
+    
     hosts = config.get("docker_hosts", [])
     if index < 0 or index >= len(hosts):
         flash("无效的主机索引。", "warn")
         return redirect(url_for("index"))
-    
+    
     name = (request.form.get("name") or "").strip()
     url = (request.form.get("url") or "").strip()
     enabled = "enabled" in request.form
-    
+    
     if not name or not url:
         flash("主机名称和URL是必填项。", "warn")
         return redirect(url_for("index"))
-    
+    
     valid_protocols = ["tcp://", "http://", "https://"]
     if not any(url.startswith(proto) for proto in valid_protocols):
         flash("URL必须以 tcp://, http://, 或 https:// 开头", "warn")
         return redirect(url_for("index"))
-    
-    hosts[index] = {
-        "name": name,
-        "url": url,
-        "enabled": enabled
-    }
-    
+    
+    # 保留表单中没有的字段
+    host = dict(hosts[index], name=name, url=url, enabled=enabled)
+    reclaim_target_gb = _host_reclaim_target_from_form()
+    if reclaim_target_gb is None:
+        host.pop("reclaim_target_gb", None)
+    else:
+        host["reclaim_target_gb"] = reclaim_target_gb
+    hosts[index] = host
+    
     config["docker_hosts"] = hosts
     save_config()
-    
+    
     flash(f"Docker主机 '{name}' 更新成功。", "info")
     return redirect(url_for("index"))
 
@@ -1882,18 +5118,18 @@ def update_host(index):
 def delete_host(index):
     """删除Docker主机"""
     load_config(silent=True)
-    
+    
     hosts = config.get("docker_hosts", [])
     if index < 0 or index >= len(hosts):
         flash("无效的主机索引。", "warn")
         return redirect(url_for("index"))
-    
+    
     deleted_name = hosts[index].get("name", "未知")
     del hosts[index]
-    
+    
     config["docker_hosts"] = hosts
     save_config()
-    
+    
     flash(f"Docker主机 '{deleted_name}' 删除成功。", "info")
     return redirect(url_for("index"))
 
@@ -1902,22 +5138,49 @@ def delete_host(index):
 def toggle_host(index):
     """切换Docker主机的启用/禁用状态"""
     load_config(silent=True)
-    
+    
     hosts = config.get("docker_hosts", [])
     if index < 0 or index >= len(hosts):
         return jsonify({"success": False, "error": "无效的主机索引"}), 400
-    
+    
     hosts[index]["enabled"] = not hosts[index].get("enabled", True)
     config["docker_hosts"] = hosts
     save_config()
-    
+    
     status = "已启用" if hosts[index]["enabled"] else "已禁用"
     return jsonify({"success": True, "enabled": hosts[index]["enabled"], "message": f"主机已{status}"})
 
 
+def start_background_services() -> None:
+    """在Gunicorn Worker进程中启动后台线程：调度器（计划清理、客户端健康检查、统计导出、磁盘用量触发）、
+    实时资源索引的事件订阅、通知发送队列（重新发送磁盘队列中的通知）和通知摘要的定时器
+
+    Master进程fork出Worker时线程不会被复制，在Master中启动的线程对处理请求的Worker不可见，
+    它们更新的指标、缓存和索引也只存在于Master中，因此这些线程由post_fork钩子在Worker中启动。
+    """
+    load_config(silent=True)
+    scheduler.start()
+    schedule_state["active"] = True
+    apply_schedule(force=True)
+    catch_up_missed_run()
+    scheduler.add_job(check_docker_clients, "interval", seconds=DOCKER_CLIENT_PING_AFTER, id="docker_client_health", max_instances=1, coalesce=True)
+    scheduler.add_job(export_stats_file, "interval", seconds=stats_export_interval, id="stats_export", max_instances=1, coalesce=True)
+    scheduler.add_job(check_disk_triggers, "interval", seconds=disk_check_interval, id="disk_trigger_check", max_instances=1, coalesce=True)
+    load_host_last_prune()
+    inventory_state["active"] = True
+    sync_inventory_watchers()
+    replay_notification_spool()
+    resume_notification_digest()
+
+
+def post_fork(server, worker) -> None:
+    """Gunicorn post_fork钩子：Worker进程创建后启动后台服务"""
+    start_background_services()
+
+
 class StandaloneApplication(BaseApplication):
     """自定义Gunicorn应用"""
-    
+    
     def __init__(self, app, options=None):
         """初始化Gunicorn应用"""
         self.options = options or {}
@@ -1937,16 +5200,16 @@ class StandaloneApplication(BaseApplication):
 
 if __name__ == "__main__":
     load_config()
-    scheduler.add_job(heartbeat, CronTrigger(second=0), id="heartbeat", max_instances=1, coalesce=True)
-    log("调度器心跳任务已启动（每分钟在:00 执行）。")
-    
+    
     options = {
         "bind": "0.0.0.0:8080",
         "workers": 1,
-        "threads": 2,
+        # 2个线程处理普通请求，另为SSE事件流和流式预览预留PRUNEMATE_MAX_STREAMS个线程
+        "threads": 2 + max_event_streams,
         "timeout": 120,
         "accesslog": None,
         "errorlog": "-",
         "loglevel": "info",
+        "post_fork": post_fork,
     }
     StandaloneApplication(app, options).run()
\ No newline at end of file
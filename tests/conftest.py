@@ -0,0 +1,70 @@
+"""测试公共设置：把PruneMate的所有文件路径指向临时目录，并提供模拟Docker守护进程"""
+
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from isolation import isolate_paths  # noqa: E402
+
+# prunemate在导入时读取这些环境变量，必须在导入之前设置
+WORKDIR = Path(tempfile.mkdtemp(prefix="prunemate-tests-"))
+isolate_paths(WORKDIR)
+
+from fake_docker import FakeDockerDaemon, build_inventory  # noqa: E402
+
+
+@pytest.fixture
+def pm():
+    import prunemate
+    return prunemate
+
+
+@pytest.fixture
+def fake_daemon():
+    daemon = FakeDockerDaemon(build_inventory(10, 6, 4)).start()
+    yield daemon
+    daemon.stop()
+
+
+@pytest.fixture
+def write_config(pm):
+    """写入config.json并重新加载"""
+    def write(**values):
+        Path(os.environ["PRUNEMATE_CONFIG"]).write_text(json.dumps(values), encoding="utf-8")
+        pm.load_config(silent=True)
+    return write
+
+
+@pytest.fixture
+def run_in_worker(pm):
+    """模拟Gunicorn：当前进程相当于Master，fork出的子进程运行post_fork钩子后相当于Worker
+
+    返回的函数在子进程中运行func并返回其结果（必须可JSON序列化）。
+    """
+    def run(func):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                os.close(read_fd)
+                pm.post_fork(None, None)
+                os.write(write_fd, json.dumps(func()).encode("utf-8"))
+                status = 0
+            finally:
+                os._exit(status)
+        os.close(write_fd)
+        with os.fdopen(read_fd, "rb") as f:
+            data = f.read()
+        _, status = os.waitpid(pid, 0)
+        assert status == 0
+        return json.loads(data)
+    return run
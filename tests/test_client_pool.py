@@ -0,0 +1,106 @@
+"""Docker客户端连接池的租用和关闭"""
+
+import threading
+
+URL = "tcp://pooled:2375"
+
+
+class _StubClient:
+    """记录是否已关闭的客户端，关闭后的请求失败"""
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def ping(self):
+        return True
+
+    def request(self):
+        if self.closed:
+            raise ConnectionError("client closed")
+        return "ok"
+
+
+def _stub_pool(pm, monkeypatch) -> list:
+    created = []
+
+    def create(host_url):
+        created.append(_StubClient())
+        return created[-1]
+
+    monkeypatch.setattr(pm, "create_docker_client", create)
+    pm.discard_docker_client(URL)
+    return created
+
+
+def test_timeout_keeps_client_open_for_other_users(pm, monkeypatch):
+    created = _stub_pool(pm, monkeypatch)
+    host = {"name": "pooled", "url": URL}
+    release = threading.Event()
+    preview_running = threading.Event()
+    prune_finished = threading.Event()
+    preview_result = {}
+
+    def preview():
+        # 另一个调用方（例如预览）同时在使用同一主机的客户端
+        client = pm.get_docker_client(URL)
+        try:
+            preview_running.set()
+            release.wait(5)
+            preview_result["value"] = client.request()
+        finally:
+            pm.release_docker_client(URL, client)
+
+    def slow_prune(host, holder):
+        client = pm.get_docker_client(URL)
+        holder["client"] = client
+        try:
+            release.wait(5)
+            return {"url": URL, "success": True}
+        finally:
+            pm.release_docker_client(URL, client)
+            prune_finished.set()
+
+    other = threading.Thread(target=preview)
+    other.start()
+    try:
+        assert preview_running.wait(5)
+        results = pm._run_per_host([host], slow_prune, lambda h, error: {"url": URL, "error": error}, 0.2)
+        assert results == [{"url": URL, "error": "timeout"}]
+        # 超时的客户端已移出连接池，但另一个调用方仍持有它，不能关闭
+        assert len(created) == 1 and not created[0].closed
+        assert pm.get_docker_client(URL) is not created[0]
+        pm.release_docker_client(URL, created[1])
+    finally:
+        release.set()
+        other.join(5)
+        # 被放弃的主机线程也可能是最后一个持有者
+        assert prune_finished.wait(5)
+
+    assert preview_result == {"value": "ok"}
+    # 最后一个持有者归还后关闭
+    assert created[0].closed
+    pm.discard_docker_client(URL)
+
+
+def test_timeout_closes_client_without_other_users(pm, monkeypatch):
+    created = _stub_pool(pm, monkeypatch)
+    release = threading.Event()
+
+    def slow_prune(host, holder):
+        client = pm.get_docker_client(URL)
+        holder["client"] = client
+        try:
+            release.wait(5)
+        finally:
+            pm.release_docker_client(URL, client)
+
+    try:
+        pm._run_per_host([{"name": "pooled", "url": URL}], slow_prune, lambda h, error: error, 0.2)
+        # 只有超时的主机线程在使用：立即关闭以中断其请求
+        assert created[0].closed
+        assert URL not in pm.docker_clients
+    finally:
+        release.set()
@@ -0,0 +1,37 @@
+"""单主机清理超时"""
+
+import threading
+
+
+def test_timed_out_host_is_skipped_until_its_thread_exits(pm, write_config, monkeypatch):
+    write_config(prune_images=True)
+    release = threading.Event()
+    finished = threading.Event()
+    calls = []
+
+    def slow_prune_host(host, options, holder, *args):
+        calls.append(host["url"])
+        try:
+            release.wait(10)
+            return pm._failed_prune_result(host, "released")
+        finally:
+            finished.set()
+
+    monkeypatch.setattr(pm, "_prune_host", slow_prune_host)
+    monkeypatch.setattr(pm, "host_prune_timeout", 0.2)
+
+    # 第一次运行在超时后结束并释放清理锁，但主机线程仍在执行
+    assert pm.run_prune_job(origin="test")
+    assert calls == ["unix:///var/run/docker.sock"]
+    assert pm.run_prune_job(origin="test")
+    assert len(calls) == 1
+
+    release.set()
+    assert finished.wait(5)
+    # 线程在_prune_host返回后才解除占用
+    for _ in range(50):
+        if not pm.pruning_hosts:
+            break
+        threading.Event().wait(0.02)
+    assert pm.run_prune_job(origin="test")
+    assert len(calls) == 2
@@ -0,0 +1,12 @@
+"""测试和基准测试的路径隔离覆盖prunemate.py中的所有/config路径"""
+
+import re
+
+from conftest import ROOT
+from isolation import PRUNEMATE_PATHS
+
+
+def test_every_config_path_is_isolated():
+    source = (ROOT / "prunemate.py").read_text(encoding="utf-8")
+    defaults = set(re.findall(r'os\.environ\.get\("(PRUNEMATE_\w+)", "/config/', source))
+    assert defaults and defaults == {name for name, _ in PRUNEMATE_PATHS}
@@ -0,0 +1,57 @@
+"""实时资源索引：根据Docker事件增量更新"""
+
+import threading
+import time
+
+import docker
+
+
+def _wait_for(predicate, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        value = predicate()
+        if value:
+            return value
+        time.sleep(0.02)
+    return predicate()
+
+
+def _image_ids(snapshot) -> set | None:
+    return None if snapshot is None else {img["Id"] for img in snapshot[0]["images"]}
+
+
+def test_image_events_relist_once_per_burst(pm, fake_daemon, monkeypatch):
+    monkeypatch.setattr(pm, "IMAGE_RELIST_DELAY", 0.2)
+    url = fake_daemon.url
+    inv = pm._new_host_inventory(url)
+    with pm.host_inventories_lock:
+        pm.host_inventories[url] = inv
+    inv["thread"] = threading.Thread(target=pm._inventory_watch, args=(inv,), daemon=True)
+    inv["thread"].start()
+    client = docker.DockerClient(base_url=url)
+    try:
+        assert _wait_for(lambda: pm.live_inventory_snapshot(url))
+        fake_daemon.reset()
+
+        # 清理镜像产生的untag/delete事件增量更新索引，不重新列出镜像
+        client.api.prune_images()
+        remaining = {img["Id"] for img in fake_daemon.inventory["images"]}
+        assert _wait_for(lambda: _image_ids(pm.live_inventory_snapshot(url)) == remaining)
+        assert fake_daemon.calls["GET /images/json"] == 0
+
+        # 一批拉取事件只重新列出一次；列出之前索引中的镜像不可用
+        pulled = [{"Id": f"sha256:{i:064x}", "ParentId": "", "RepoTags": [f"new{i}:latest"], "Size": 1,
+                   "SharedSize": -1, "Containers": -1, "Created": 0} for i in range(1000, 1005)]
+        for image in pulled:
+            fake_daemon.pull_image(image, image["RepoTags"][0])
+        assert _wait_for(lambda: inv["images_pending"])
+        assert pm.live_inventory_snapshot(url) is None
+        expected = remaining | {img["Id"] for img in pulled}
+        assert _wait_for(lambda: _image_ids(pm.live_inventory_snapshot(url)) == expected)
+        assert fake_daemon.calls["GET /images/json"] == 1
+    finally:
+        client.close()
+        with pm.host_inventories_lock:
+            pm.host_inventories.pop(url, None)
+        pm._stop_inventory_watch(inv)
+        inv["thread"].join(5)
@@ -0,0 +1,27 @@
+"""通知摘要的定时发送"""
+
+import time
+
+
+def test_digest_timer_rearms_from_its_own_thread(pm, write_config, monkeypatch):
+    write_config(notifications={"digest_enabled": True, "digest_window": 60})
+    sent = []
+    monkeypatch.setattr(pm, "queue_notification", lambda *args, **kwargs: sent.append(args))
+    try:
+        pm.add_to_notification_digest("manual", [{"name": "h", "url": "tcp://h:2375", "success": True, "space": 1}])
+        first = pm.digest_state["timer"]
+        first.cancel()
+        first.join()
+        # 定时器提前触发（例如窗口被调大，或其他进程已发送并重新开始摘要）：窗口未结束时必须重新等待
+        pm._arm_digest_timer(0)
+        fired = pm.digest_state["timer"]
+        deadline = time.monotonic() + 5
+        while pm.digest_state["timer"] is fired and time.monotonic() < deadline:
+            time.sleep(0.02)
+        rearmed = pm.digest_state["timer"]
+        assert rearmed is not fired and rearmed.is_alive()
+        assert not sent
+    finally:
+        if pm.digest_state["timer"] is not None:
+            pm.digest_state["timer"].cancel()
+        pm.NOTIFY_DIGEST_FILE.unlink(missing_ok=True)
@@ -0,0 +1,45 @@
+"""后台通知队列：队列上限和磁盘队列的恢复"""
+
+import json
+import time
+
+
+def _spooled_ids(pm) -> set:
+    return {path.stem for path in pm.NOTIFY_SPOOL_DIR.glob("*.json")}
+
+
+def test_trimming_keeps_memory_and_spool_in_sync(pm, monkeypatch):
+    monkeypatch.setattr(pm, "MAX_SPOOLED_NOTIFICATIONS", 3)
+    monkeypatch.setattr(pm, "_ensure_notification_worker", lambda: None)
+    try:
+        queued = [pm.queue_notification(f"标题{i}", "内容", provider="gotify")[0]["id"] for i in range(5)]
+        pending_ids = {item["id"] for _, _, item in pm.notify_pending}
+        assert pending_ids == set(queued[2:])
+        assert _spooled_ids(pm) == pending_ids
+    finally:
+        with pm.notify_condition:
+            for _, _, item in pm.notify_pending:
+                pm._unspool_notification(item)
+            pm.notify_pending.clear()
+
+
+def test_spool_is_replayed_only_in_the_worker(pm, write_config, run_in_worker):
+    write_config(prune_images=True)
+    pm.NOTIFY_SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+    for i in range(2):
+        item = {"id": f"replay-{i}", "provider": "gotify", "title": "标题", "message": "内容",
+                "priority": "medium", "attempts": 0, "created_at": time.time()}
+        (pm.NOTIFY_SPOOL_DIR / f"{item['id']}.json").write_text(json.dumps(item), encoding="utf-8")
+
+    def delivered():
+        deadline = time.monotonic() + 10
+        while _spooled_ids(pm) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return [line for line in pm.render_metrics().splitlines()
+                if line.startswith("prunemate_notifications_total{") and 'status="failed"' in line]
+
+    # 未配置提供商，Worker发送时直接放弃并删除磁盘文件
+    assert run_in_worker(delivered) == ['prunemate_notifications_total{provider="gotify",status="failed"} 2']
+    # Master没有恢复也没有发送这些通知
+    assert not pm.notify_pending
+    assert not _spooled_ids(pm)
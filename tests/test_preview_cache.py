@@ -0,0 +1,45 @@
+"""预览缓存"""
+
+import time
+
+
+def test_recorded_prune_invalidates_cache_without_database_reads(pm, fake_daemon, write_config, monkeypatch):
+    host = {"name": "fake", "url": fake_daemon.url, "enabled": True}
+    write_config(docker_hosts=[host], prune_images=True)
+    options = {"prune_images": True}
+    pm.invalidate_preview_cache(host["url"])
+
+    assert not pm._cached_preview_host(host, options, {}).get("cached")
+
+    # 缓存命中只读内存中的最近清理时间，不打开运行历史数据库
+    def no_database():
+        raise AssertionError("缓存命中时不应访问运行历史")
+
+    with monkeypatch.context() as m:
+        m.setattr(pm, "_history_connect", no_database)
+        assert pm._cached_preview_host(host, options, {}).get("cached")
+
+    # 记录到运行历史的清理（例如磁盘用量触发的清理）使缓存条目失效
+    finished = time.time()
+    pm.record_run("disk", finished - 1, finished, [{"name": host["name"], "url": host["url"], "success": True}])
+    assert pm._host_last_prune(host["url"]) == finished
+    assert not pm._cached_preview_host(host, options, {}).get("cached")
+    assert pm._cached_preview_host(host, options, {}).get("cached")
+
+
+def test_last_prune_is_seeded_once_from_history(pm):
+    url = "tcp://seeded:2375"
+    conn = pm._history_connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO host_totals (host_url, host_name, last_run) VALUES (?, ?, ?) "
+                "ON CONFLICT (host_url) DO UPDATE SET last_run = excluded.last_run",
+                (url, "seeded", 1_700_000_000.0),
+            )
+    finally:
+        conn.close()
+    assert pm._host_last_prune(url) is None
+
+    pm.load_host_last_prune()
+    assert pm._host_last_prune(url) == 1_700_000_000.0
@@ -0,0 +1,60 @@
+"""镜像可回收空间估算"""
+
+import docker
+
+
+class _CountingClient:
+    """只记录inspect_image调用的客户端"""
+
+    def __init__(self):
+        self.api = self
+        self.inspected = []
+
+    def inspect_image(self, image_id):
+        self.inspected.append(image_id)
+        return {"RootFS": {"Layers": ["base", image_id]}}
+
+
+def test_estimate_uses_list_data_without_inspect(pm):
+    images = [
+        {"Id": "a", "Size": 30, "SharedSize": 10},
+        {"Id": "b", "Size": 40, "SharedSize": 10},
+        {"Id": "kept", "Size": 50, "SharedSize": 10},
+    ]
+    client = _CountingClient()
+    pm.image_layers_cache.clear()
+
+    # 保留的镜像仍引用共享层，只计算被删除镜像的独有部分
+    assert pm.estimate_image_reclaim(client, images, {"a", "b"}) == 20 + 30
+    assert client.inspected == []
+
+
+def test_estimate_counts_shared_layers_when_no_kept_image_shares(pm):
+    images = [
+        {"Id": "a", "Size": 30, "SharedSize": 10},
+        {"Id": "b", "Size": 40, "SharedSize": 10},
+        {"Id": "c", "Size": 50, "SharedSize": -1},
+    ]
+    assert pm.estimate_image_reclaim(None, images, {"a", "b"}) == 20 + 30 + 10
+
+
+def test_list_images_falls_back_to_public_api_on_old_daemons(pm, fake_daemon):
+    client = docker.DockerClient(base_url=fake_daemon.url, version="1.41")
+    images = pm._list_images(client)
+    assert [img["Id"] for img in images] == [img["Id"] for img in fake_daemon.inventory["images"]]
+    assert fake_daemon.calls["GET /images/json"] == 1
+
+
+def test_layer_estimate_is_opt_in(pm, monkeypatch):
+    images = [
+        {"Id": "a", "Size": 30, "SharedSize": 10},
+        {"Id": "b", "Size": 40, "SharedSize": 10},
+        {"Id": "kept", "Size": 50, "SharedSize": 10},
+    ]
+    client = _CountingClient()
+    pm.image_layers_cache.clear()
+    monkeypatch.setattr(pm, "layer_estimate_enabled", True)
+
+    # 共享层"base"仍被保留的镜像引用，按层估算同样只计算独有部分，但需要inspect有共享层的镜像
+    assert pm.estimate_image_reclaim(client, images, {"a", "b"}) == 20 + 30
+    assert sorted(client.inspected) == ["a", "b", "kept"]
@@ -0,0 +1,60 @@
+"""回收目标模式下的逐层清理"""
+
+
+def test_tiered_prune_skips_estimate(pm, fake_daemon, write_config):
+    host = {"name": "fake", "url": fake_daemon.url, "enabled": True}
+    write_config(docker_hosts=[host], prune_containers=True, prune_images=True,
+                 reclaim_target={"enabled": True, "target_gb": 0})
+    trace = pm.new_api_trace()
+
+    result = pm._prune_host(host, pm._selected_prune_options(), {}, trace=trace)
+
+    assert result["success"] and result["reclaim_tier"] is not None
+    assert result["estimated_space"] is None
+    assert "estimate" not in {span["phase"] for span in trace["spans"]}
+
+
+def test_regular_prune_takes_estimate_from_preview_cache(pm, fake_daemon, write_config):
+    host = {"name": "fake", "url": fake_daemon.url, "enabled": True}
+    write_config(docker_hosts=[host], prune_containers=True, prune_images=True)
+    options = pm._selected_prune_options()
+    pm.invalidate_preview_cache(host["url"])
+    preview = pm._cached_preview_host(host, options, {})
+    fake_daemon.reset()
+
+    result = pm._prune_host(host, options, {})
+
+    assert result["success"] and result["reclaim_tier"] is None
+    assert result["estimated_space"] == preview["estimated_space"]
+    # 估算不在清理的主机超时内重新列出资源
+    assert fake_daemon.calls["GET /images/json"] == 0
+
+
+def test_regular_prune_skips_estimate_without_cached_preview(pm, fake_daemon, write_config):
+    host = {"name": "fake", "url": fake_daemon.url, "enabled": True}
+    write_config(docker_hosts=[host], prune_containers=True, prune_images=True)
+    pm.invalidate_preview_cache(host["url"])
+    fake_daemon.reset()
+
+    result = pm._prune_host(host, pm._selected_prune_options(), {})
+
+    assert result["success"] and result["estimated_space"] is None
+    assert fake_daemon.calls["GET /images/json"] == 0
+
+
+def test_host_form_validates_reclaim_target(pm, write_config):
+    write_config(docker_hosts=[])
+    client = pm.app.test_client()
+
+    client.post("/hosts/add", data={"name": "a", "url": "tcp://a:2375", "enabled": "on", "reclaim_target_gb": "2.5"})
+    client.post("/hosts/add", data={"name": "b", "url": "tcp://b:2375", "enabled": "on", "reclaim_target_gb": "-3"})
+    client.post("/hosts/add", data={"name": "c", "url": "tcp://c:2375", "enabled": "on", "reclaim_target_gb": "abc"})
+    hosts = pm.config["docker_hosts"]
+    assert [h.get("reclaim_target_gb") for h in hosts] == [2.5, 0.0, None]
+
+    # 编辑时留空则删除覆盖，改用全局目标
+    client.post("/hosts/0/update", data={"name": "a", "url": "tcp://a:2375", "enabled": "on", "reclaim_target_gb": ""})
+    client.post("/hosts/2/update", data={"name": "c", "url": "tcp://c:2375", "enabled": "on", "reclaim_target_gb": "4"})
+    hosts = pm.config["docker_hosts"]
+    assert "reclaim_target_gb" not in hosts[0]
+    assert hosts[2]["reclaim_target_gb"] == 4.0
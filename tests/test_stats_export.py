@@ -0,0 +1,31 @@
+"""累计统计与stats.json导出"""
+
+import json
+
+
+def test_runs_update_history_and_export_stats_file(pm, write_config, monkeypatch):
+    write_config(prune_images=True)
+    monkeypatch.setattr(pm, "_prune_host", lambda host, *args: pm._failed_prune_result(host, "skipped"))
+    pm.STATS_FILE.unlink(missing_ok=True)
+    before = pm.load_history_totals()["prune_runs"]
+
+    assert pm.run_prune_job(origin="test")
+    assert pm.load_history_totals()["prune_runs"] == before + 1
+    assert not pm.STATS_FILE.exists()
+
+    pm.export_stats_file()
+    exported = json.loads(pm.STATS_FILE.read_text(encoding="utf-8"))
+    assert exported == pm.load_history_totals()
+    mtime = pm.STATS_FILE.stat().st_mtime_ns
+    pm.export_stats_file()
+    assert pm.STATS_FILE.stat().st_mtime_ns == mtime
+
+
+def test_stats_file_is_updated_when_history_is_unavailable(pm, write_config, monkeypatch):
+    write_config(prune_images=True)
+    monkeypatch.setattr(pm, "_prune_host", lambda host, *args: pm._failed_prune_result(host, "skipped"))
+    monkeypatch.setattr(pm, "record_run", lambda *args, **kwargs: None)
+    before = pm._load_stats_file()["prune_runs"]
+
+    assert pm.run_prune_job(origin="test")
+    assert pm._load_stats_file()["prune_runs"] == before + 1
@@ -0,0 +1,28 @@
+"""长连接槽位：SSE事件流和NDJSON流式预览共用PRUNEMATE_MAX_STREAMS"""
+
+import json
+import threading
+
+
+def test_preview_stream_shares_slots_with_event_stream(pm, fake_daemon, write_config, monkeypatch):
+    write_config(docker_hosts=[{"name": "fake", "url": fake_daemon.url, "enabled": True}], prune_images=True)
+    monkeypatch.setattr(pm, "event_stream_slots", threading.BoundedSemaphore(1))
+    client = pm.app.test_client()
+
+    # 槽位被事件流占用时，流式预览不再占用普通请求的线程
+    assert pm.event_stream_slots.acquire(blocking=False)
+    response = client.post("/preview-prune/stream")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "10"
+    pm.event_stream_slots.release()
+
+    response = client.post("/preview-prune/stream", buffered=False)
+    assert response.status_code == 200
+    assert not pm.event_stream_slots.acquire(blocking=False)
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[-1]["type"] == "totals"
+    response.close()
+
+    # 响应关闭后归还槽位
+    assert pm.event_stream_slots.acquire(blocking=False)
+    pm.event_stream_slots.release()
@@ -0,0 +1,41 @@
+"""Gunicorn Worker进程中的后台服务"""
+
+import time
+
+
+def test_live_inventory_serves_previews_in_forked_worker(pm, fake_daemon, write_config, run_in_worker):
+    host = {"name": "fake", "url": fake_daemon.url, "enabled": True}
+    write_config(docker_hosts=[host], prune_containers=True, prune_images=True)
+    # Master只导入模块和加载配置，不启动事件订阅线程
+    assert not pm.host_inventories
+
+    def preview():
+        deadline = time.monotonic() + 10
+        while pm.live_inventory_snapshot(host["url"]) is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        result = pm._preview_host(host, {"prune_containers": True, "prune_images": True}, {})
+        return {"success": result["success"], "source": result.get("source")}
+
+    assert run_in_worker(preview) == {"success": True, "source": "live"}
+    assert not pm.host_inventories
+
+
+def test_scheduler_runs_in_forked_worker(pm, write_config, run_in_worker):
+    write_config(schedule_enabled=True, frequency="daily", time="03:00", prune_images=True)
+    assert not pm.scheduler.running
+
+    def scheduler_state():
+        # 计划清理等任务产生的指标与/metrics在同一进程中
+        pm.observe_metric("prunemate_scheduler_lag_seconds", 0.5)
+        return {
+            "running": pm.scheduler.running,
+            "jobs": sorted(job.id for job in pm.scheduler.get_jobs()),
+            "metrics": "prunemate_scheduler_lag_seconds_count 1" in pm.render_metrics(),
+        }
+
+    assert run_in_worker(scheduler_state) == {
+        "running": True,
+        "jobs": ["disk_trigger_check", "docker_client_health", "scheduled_prune", "stats_export"],
+        "metrics": True,
+    }
+    assert not pm.scheduler.running